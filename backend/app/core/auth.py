@@ -1,9 +1,12 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.core.security import verify_token
 from app.models.database import User
+from typing import Optional
+import os
+import secrets
 import uuid
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
@@ -38,4 +41,21 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email not verified"
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+async def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """
+    運用者向けAPIの認証（X-Admin-Token ヘッダーを環境変数 ADMIN_API_TOKEN と照合）
+    ADMIN_API_TOKEN が未設定の場合は運用者向けAPIを無効にする
+    """
+    admin_token = os.getenv("ADMIN_API_TOKEN")
+    if not admin_token:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin API is disabled"
+        )
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid admin token"
+        )
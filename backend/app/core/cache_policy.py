@@ -0,0 +1,111 @@
+"""
+キャッシュポリシーの一元管理
+キャッシュの種類ごとに有効期間・期限切れ後の猶予期間・件数上限・保存先を定義する。
+既定値は環境変数 CACHE_POLICIES（JSON）で項目単位に上書きでき、実行中も update で変更できる。
+
+例: CACHE_POLICIES='{"stock_price": {"ttl_seconds": 900}, "technical_indicators": {"max_entries": 4096}}'
+"""
+
+from typing import Any, Dict, Literal, Optional
+from datetime import timedelta
+import threading
+from pydantic import BaseModel, Field, model_validator
+from pydantic_settings import BaseSettings
+
+
+class CachePolicy(BaseModel):
+    ttl_seconds: int = Field(..., gt=0)             # 有効期間
+    stale_seconds: int = Field(0, ge=0)             # 期限切れ後も再利用の候補として保持する期間
+    max_entries: Optional[int] = Field(None, gt=0)  # 件数上限（プロセス内キャッシュのみ）
+    tier: Literal["memory", "database"]             # 保存先
+
+    @model_validator(mode="after")
+    def check_memory_limit(self) -> "CachePolicy":
+        if self.tier == "memory" and self.max_entries is None:
+            raise ValueError("max_entries is required for memory caches")
+        return self
+
+    @property
+    def ttl(self) -> timedelta:
+        return timedelta(seconds=self.ttl_seconds)
+
+    @property
+    def stale(self) -> timedelta:
+        return timedelta(seconds=self.stale_seconds)
+
+
+class CacheSettings(BaseSettings):
+    # キャッシュの種類ごとの上書き（既定値との差分のみ指定、CACHE_POLICIES の読み込みはここのみ）
+    cache_policies: Dict[str, Dict[str, Any]] = {}
+
+    class Config:
+        env_file = ".env"
+        case_sensitive = False
+        extra = "ignore"
+
+
+class CachePolicies:
+    # 既定のポリシー
+    DEFAULTS = {
+        # 株価データ: 30分（PostgreSQL）
+        "stock_price": CachePolicy(ttl_seconds=1800, tier="database"),
+        # AI解説: 1時間。指標がほぼ変わらなければ作成から24時間まで期限を延長して再利用する
+        "ai_explanation": CachePolicy(ttl_seconds=3600, stale_seconds=82800, tier="database"),
+        # テクニカル状態別の解説テンプレート: 24時間（状態に対する一般的な解説のため長めに保持）
+        "ai_template": CachePolicy(ttl_seconds=86400, tier="database"),
+        # テクニカル指標: 30分。再計算の方がDB往復より速いためプロセス内に保持する
+        "technical_indicators": CachePolicy(ttl_seconds=1800, max_entries=1024, tier="memory"),
+    }
+
+    _policies: Dict[str, CachePolicy] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _merge(base: CachePolicy, changes: Dict[str, Any]) -> CachePolicy:
+        """既定値に変更を重ねて検証したポリシー"""
+        return CachePolicy.model_validate({**base.model_dump(), **changes})
+
+    @staticmethod
+    def load(overrides: Optional[Dict[str, Dict[str, Any]]] = None):
+        """既定値に設定（未指定時は環境変数 CACHE_POLICIES）の上書きを適用して読み込み直す"""
+        if overrides is None:
+            overrides = CacheSettings().cache_policies
+        unknown = set(overrides) - set(CachePolicies.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown cache policy: {', '.join(sorted(unknown))}")
+
+        policies = {
+            name: CachePolicies._merge(policy, overrides.get(name, {}))
+            for name, policy in CachePolicies.DEFAULTS.items()
+        }
+        with CachePolicies._lock:
+            CachePolicies._policies = policies
+
+    @staticmethod
+    def get(name: str) -> CachePolicy:
+        """キャッシュの種類のポリシー（呼び出しのたびに参照するため、実行中の変更がすぐに反映される）"""
+        return CachePolicies._policies[name]
+
+    @staticmethod
+    def all() -> Dict[str, CachePolicy]:
+        """全ポリシー"""
+        return dict(CachePolicies._policies)
+
+    @staticmethod
+    def update(name: str, **changes) -> CachePolicy:
+        """
+        実行中のポリシー変更（このプロセスのみ、再起動後は設定値に戻る）
+        保存先はキャッシュの実装に対応するため変更できない
+        """
+        if name not in CachePolicies.DEFAULTS:
+            raise KeyError(name)
+        if "tier" in changes and changes["tier"] != CachePolicies.get(name).tier:
+            raise ValueError("Cache tier cannot be changed at runtime")
+
+        with CachePolicies._lock:
+            policy = CachePolicies._merge(CachePolicies._policies[name], changes)
+            CachePolicies._policies = {**CachePolicies._policies, name: policy}
+        return policy
+
+
+CachePolicies.load()
@@ -19,6 +19,15 @@ class AIExplanationResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class AIJobResponse(BaseModel):
+    job_id: Optional[uuid.UUID] = None  # キャッシュ済みで即時に返した場合は None
+    status: str  # "queued", "running", "done", "failed"
+    stock_code: str
+    chart_period: str
+    explanation: Optional[AIExplanationResponse] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+
 class APIUsageRequest(BaseModel):
     user_id: uuid.UUID
     estimated_tokens: int = 650  # デフォルトトークン数
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, DateTime, Integer, Date, Text, UniqueConstraint
+from sqlalchemy import Column, String, Boolean, DateTime, Integer, Date, Text, UniqueConstraint, Index, text
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID, JSONB
 from sqlalchemy.sql import func
 from app.core.database import Base
@@ -44,6 +44,59 @@ class AIExplanation(Base):
     technical_data = Column(JSONB)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    
+    # 銘柄・期間ごとに1行（再生成時は置き換える）
+    __table_args__ = (UniqueConstraint('stock_code', 'chart_period'),)
+
+class AIExplanationTemplate(Base):
+    __tablename__ = "ai_explanation_templates"
+    
+    # テクニカル状態（期間・トレンド・RSI・MACD・値動き）別の解説テンプレート
+    state_key = Column(String(100), primary_key=True)
+    chart_period = Column(String(20), nullable=False)
+    technical_state = Column(JSONB)
+    template_text = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class AIExplanationDemand(Base):
+    __tablename__ = "ai_explanation_demand"
+    
+    # 解説の需要（リクエスト数）を日別に集計し、事前生成の対象選定に使う
+    stock_code = Column(String(10), primary_key=True)
+    chart_period = Column(String(20), primary_key=True)
+    demand_date = Column(Date, primary_key=True)
+    request_count = Column(Integer, default=0)
+
+class AIExplanationJob(Base):
+    __tablename__ = "ai_explanation_jobs"
+    
+    # 利用枠の範囲で順次生成するAI解説のジョブ（同じ銘柄・期間の未完了ジョブは1件にまとめる）
+    id = Column(PG_UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    stock_code = Column(String(10), nullable=False)
+    chart_period = Column(String(20), nullable=False)
+    user_id = Column(PG_UUID(as_uuid=True))  # 最初にリクエストしたユーザー（利用回数の計上先）
+    status = Column(String(20), nullable=False, default="queued")  # queued / running / done / failed
+    priority = Column(Integer, default=0)
+    request_count = Column(Integer, default=1)  # まとめたリクエスト数
+    attempts = Column(Integer, default=0)
+    explanation_id = Column(PG_UUID(as_uuid=True))
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    available_at = Column(DateTime(timezone=True), nullable=False)  # 再試行時はこの時刻まで取り出さない
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    
+    __table_args__ = (
+        Index(
+            "uq_ai_job_active", "stock_code", "chart_period", unique=True,
+            postgresql_where=text("status IN ('queued', 'running')")
+        ),
+        Index(
+            "idx_ai_job_queue", priority.desc(), request_count.desc(), created_at,
+            postgresql_where=text("status = 'queued'")
+        ),
+    )
 
 class Stock(Base):
     __tablename__ = "stocks"
@@ -75,6 +128,7 @@ class DailyAPIUsage(Base):
     __tablename__ = "daily_api_usage"
     
     usage_date = Column(Date, primary_key=True)
+    shard = Column(Integer, primary_key=True, default=0)  # 同時更新を分散するシャード番号（参照時は合計）
     total_requests = Column(Integer, default=0)
     total_tokens = Column(Integer, default=0)
     estimated_tokens = Column(Integer, default=0)
@@ -84,6 +138,14 @@ class MinuteAPIUsage(Base):
     __tablename__ = "minute_api_usage"
     
     minute_key = Column(String(20), primary_key=True)
+    shard = Column(Integer, primary_key=True, default=0)  # 同時更新を分散するシャード番号（参照時は合計）
+    requests = Column(Integer, default=0)
+    tokens = Column(Integer, default=0)
+
+class HourlyAPIUsage(Base):
+    __tablename__ = "hourly_api_usage"
+    
+    hour_key = Column(String(16), primary_key=True)  # 分次使用量を集約（YYYY-MM-DD_HH、UTC）
     requests = Column(Integer, default=0)
     tokens = Column(Integer, default=0)
 
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime, date
 import uuid
@@ -27,20 +27,108 @@ class StockPriceData(BaseModel):
     close: float
     volume: Optional[int] = None
 
+class TechnicalIndicators(BaseModel):
+    sma_25: Optional[float] = None
+    sma_75: Optional[float] = None
+    rsi_14: Optional[float] = None
+    macd_line: Optional[float] = None
+    macd_signal: Optional[float] = None
+    macd_histogram: Optional[float] = None
+    volume_sma_25: Optional[float] = None
+    bb_upper: Optional[float] = None
+    bb_middle: Optional[float] = None
+    bb_lower: Optional[float] = None
+    atr_14: Optional[float] = None
+    stoch_k: Optional[float] = None
+    stoch_d: Optional[float] = None
+    stoch_slow_d: Optional[float] = None
+    ichimoku_tenkan: Optional[float] = None
+    ichimoku_kijun: Optional[float] = None
+    ichimoku_senkou_a: Optional[float] = None  # 当日位置の雲（先行スパン1）
+    ichimoku_senkou_b: Optional[float] = None  # 当日位置の雲（先行スパン2）
+    deviation_rate_25: Optional[float] = None  # 25日移動平均乖離率（%）
+
 class StockPriceResponse(BaseModel):
     stock_code: str
     period: str
     data: List[StockPriceData]
     last_updated: datetime
+    # 表示期間より長い取得履歴全体で計算したテクニカル指標（日足ベース）
+    indicators: Optional[TechnicalIndicators] = None
+    interval: str = "1d"  # "1d"（日足）, "1wk"（週足）, "1mo"（月足）
 
-class TechnicalIndicators(BaseModel):
+class TechnicalIndicatorSeriesResponse(BaseModel):
+    # time は StockPriceResponse.data の time と同じ並び（列形式）
+    stock_code: str
+    period: str
+    time: List[str]
+    sma_25: List[Optional[float]]
+    sma_75: List[Optional[float]]
+    rsi_14: List[Optional[float]]
+    macd_line: List[Optional[float]]
+    macd_signal: List[Optional[float]]
+    macd_histogram: List[Optional[float]]
+    volume_sma_25: List[Optional[float]]
+    bb_upper: List[Optional[float]]
+    bb_middle: List[Optional[float]]
+    bb_lower: List[Optional[float]]
+    atr_14: List[Optional[float]]
+    stoch_k: List[Optional[float]]
+    stoch_d: List[Optional[float]]
+    stoch_slow_d: List[Optional[float]]
+    ichimoku_tenkan: List[Optional[float]]
+    ichimoku_kijun: List[Optional[float]]
+    ichimoku_senkou_a: List[Optional[float]]
+    ichimoku_senkou_b: List[Optional[float]]
+    ichimoku_chikou: List[Optional[float]]  # 終値を25本前の位置に表示
+    deviation_rate_25: List[Optional[float]]
+    last_updated: datetime
+
+class BatchIndicatorsRequest(BaseModel):
+    stock_codes: List[str] = Field(..., min_length=1, max_length=50)
+    period: str = "1M"  # "1W", "1M", "3M", "6M", "1Y"
+
+class BatchIndicatorsResponse(BaseModel):
+    period: str
+    indicators: Dict[str, TechnicalIndicators]
+
+class ScreenerCondition(BaseModel):
+    rsi_below: Optional[float] = None
+    rsi_above: Optional[float] = None
+    golden_cross_within: Optional[int] = None  # 直近N日以内のゴールデンクロス（SMA25/75）
+    dead_cross_within: Optional[int] = None
+    volume_ratio_above: Optional[float] = None  # 出来高 ÷ 25日平均出来高
+    deviation_rate_below: Optional[float] = None
+    deviation_rate_above: Optional[float] = None
+    sector: Optional[str] = None
+    limit: int = 50
+
+class ScreenerResult(BaseModel):
+    code: str
+    name: str
+    sector: Optional[str] = None
+    close: Optional[float] = None
+    change_pct: Optional[float] = None
     sma_25: Optional[float] = None
     sma_75: Optional[float] = None
     rsi_14: Optional[float] = None
-    macd_line: Optional[float] = None
-    macd_signal: Optional[float] = None
     macd_histogram: Optional[float] = None
-    volume_sma_25: Optional[float] = None
+    volume_ratio: Optional[float] = None
+    deviation_rate_25: Optional[float] = None
+    days_since_golden_cross: Optional[int] = None
+    days_since_dead_cross: Optional[int] = None
+
+class ScreenerResponse(BaseModel):
+    total_count: int
+    matched_count: int
+    results: List[ScreenerResult]
+    refreshed_at: datetime
+
+class CachePolicyUpdate(BaseModel):
+    # 指定した項目のみ変更（保存先は変更不可）
+    ttl_seconds: Optional[int] = Field(None, gt=0)
+    stale_seconds: Optional[int] = Field(None, ge=0)
+    max_entries: Optional[int] = Field(None, gt=0)
 
 class SearchHistoryCreate(BaseModel):
     stock_code: str
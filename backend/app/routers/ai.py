@@ -1,14 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from app.models.ai import (
     AIExplanationRequest, AIExplanationResponse, 
-    APIUsageResponse
+    AIJobResponse, APIUsageResponse
 )
 from app.services.ai_service import AIService
 from app.services.stock_service import StockService
+from app.services.prefetch_service import PrefetchService
+from app.services.job_service import AIJobService
 from app.core.database import get_db
 from app.core.auth import get_current_active_user
 from app.models.database import User
+import json
+import uuid
 
 router = APIRouter(
     prefix="/ai",
@@ -17,6 +23,10 @@ router = APIRouter(
 
 ai_service = AIService()
 
+def _format_sse(event: str, data) -> str:
+    """Server-Sent Eventsの1イベント分の文字列"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @router.post("/explain", response_model=AIExplanationResponse)
 async def generate_ai_explanation(
     request: AIExplanationRequest,
@@ -25,12 +35,25 @@ async def generate_ai_explanation(
 ):
     """AIチャート解説生成"""
     try:
-        # 株価データとテクニカル指標を取得
-        price_data = StockService.get_stock_price_data(request.stock_code, request.chart_period)
-        indicators = StockService.calculate_technical_indicators(price_data.data)
+        # 事前生成の対象選定のため、キャッシュの有無にかかわらず需要を記録
+        PrefetchService.record_demand(request.stock_code, request.chart_period)
+        
+        # 解説キャッシュを最初に確認（ヒット時は株価データを取得しない）
+        cached = ai_service.get_cached_explanation(db, request.stock_code, request.chart_period, record_lookup=True)
+        if cached:
+            return cached
+        
+        # 株価データとテクニカル指標をキャッシュ経由で取得（指標は取得した履歴全体で計算済み）
+        # yfinanceの取得が発生しうるため、スレッドプールで実行してイベントループを止めない
+        price_data = await run_in_threadpool(
+            StockService.get_stock_with_cache, db, request.stock_code, request.chart_period
+        )
+        indicators = price_data.indicators
+        if indicators is None:
+            indicators = StockService.get_technical_indicators_with_cache(request.stock_code, price_data.data)
         
         # AI解説生成
-        explanation = ai_service.generate_explanation(
+        explanation = await ai_service.generate_explanation(
             db=db,
             user_id=current_user.id,
             stock_code=request.stock_code,
@@ -49,6 +72,123 @@ async def generate_ai_explanation(
             detail=f"Failed to generate explanation: {str(e)}"
         )
 
+@router.post("/explain/stream")
+async def stream_ai_explanation(
+    request: AIExplanationRequest,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    AIチャート解説生成（Server-Sent Events）
+    生成途中の文章を chunk イベントで順次送信し、保存した解説を done イベントで送信する
+    """
+    PrefetchService.record_demand(request.stock_code, request.chart_period)
+    
+    # キャッシュ済みの場合は株価データを取得せずに返す
+    cached = ai_service.get_cached_explanation(db, request.stock_code, request.chart_period, record_lookup=True)
+    if not cached:
+        try:
+            price_data = await run_in_threadpool(
+                StockService.get_stock_with_cache, db, request.stock_code, request.chart_period
+            )
+            indicators = price_data.indicators
+            if indicators is None:
+                indicators = StockService.get_technical_indicators_with_cache(request.stock_code, price_data.data)
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to generate explanation: {str(e)}"
+            )
+    
+    async def events():
+        if cached:
+            yield _format_sse("done", cached.model_dump(mode="json"))
+            return
+        try:
+            async for kind, value in ai_service.stream_explanation(
+                db=db,
+                user_id=current_user.id,
+                stock_code=request.stock_code,
+                period=request.chart_period,
+                price_data=price_data.data,
+                indicators=indicators
+            ):
+                if kind == "chunk":
+                    yield _format_sse("chunk", {"text": value})
+                else:
+                    yield _format_sse("done", value.model_dump(mode="json"))
+        except HTTPException as e:
+            yield _format_sse("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            yield _format_sse("error", {"status_code": 500, "detail": f"Failed to generate explanation: {str(e)}"})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/explain/jobs", response_model=AIJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def enqueue_ai_explanation(
+    request: AIExplanationRequest,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    AIチャート解説の生成ジョブ登録
+    利用枠の上限に達していても429を返さずに受け付け、ジョブIDで完了を確認する
+    （キャッシュ済みの場合は解説を含めて status=done で返す）
+    """
+    try:
+        PrefetchService.record_demand(request.stock_code, request.chart_period)
+        
+        cached = ai_service.get_cached_explanation(db, request.stock_code, request.chart_period, record_lookup=True)
+        if cached:
+            return AIJobResponse(
+                status="done",
+                stock_code=request.stock_code,
+                chart_period=request.chart_period,
+                explanation=cached,
+                created_at=cached.created_at
+            )
+        
+        ai_service.check_user_limit(db, current_user.id)
+        job_id = AIJobService.enqueue(db, request.stock_code, request.chart_period, current_user.id)
+        return AIJobService.to_response(db, AIJobService.get_job(db, job_id))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to enqueue explanation: {str(e)}"
+        )
+
+@router.get("/explain/jobs/{job_id}", response_model=AIJobResponse)
+async def get_ai_explanation_job(
+    job_id: uuid.UUID,
+    wait: float = Query(0, ge=0, le=AIJobService.MAX_WAIT_SECONDS),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """AIチャート解説の生成ジョブ確認（wait 秒まで完了を待って返す）"""
+    try:
+        # 認証で使ったリクエストのセッションの接続は、待機中に保持しないよう先に返す
+        db.close()
+        job = await AIJobService.wait_for_job(job_id, wait)
+        if job is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Job not found"
+            )
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to get job: {str(e)}"
+        )
+
 @router.get("/usage", response_model=APIUsageResponse)
 async def check_api_usage(
     current_user: User = Depends(get_current_active_user),
@@ -72,7 +212,8 @@ async def get_cached_explanation(
 ):
     """キャッシュされたAI解説取得"""
     try:
-        cached = ai_service.get_cached_explanation(db, stock_code, period)
+        PrefetchService.record_demand(stock_code, period)
+        cached = ai_service.get_cached_explanation(db, stock_code, period, record_lookup=True)
         if not cached:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
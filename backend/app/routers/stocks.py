@@ -1,15 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from app.models.stock import (
     StockResponse, StockPriceResponse, SearchHistoryResponse, 
-    BookmarkCreate, BookmarkResponse, SearchHistoryCreate, TechnicalIndicators
+    BookmarkCreate, BookmarkResponse, SearchHistoryCreate, TechnicalIndicators,
+    TechnicalIndicatorSeriesResponse, BatchIndicatorsRequest, BatchIndicatorsResponse,
+    ScreenerCondition, ScreenerResponse, CachePolicyUpdate
 )
 from app.services.stock_service import StockService
 from app.core.database import get_db
-from app.core.auth import get_current_active_user
+from app.core.auth import get_current_active_user, require_admin_token
 from app.models.database import User, SearchHistory, Bookmark
 from typing import List, Optional
 from datetime import datetime
+import asyncio
 
 router = APIRouter(
     prefix="/stocks",
@@ -43,12 +47,22 @@ async def search_stocks(
 async def get_stock_price(
     stock_code: str,
     period: str = Query("1M", description="期間: 1W, 1M, 3M, 6M, 1Y"),
+    interval: str = Query("1d", pattern="^(1d|1wk|1mo)$", description="足種: 1d（日足）, 1wk（週足）, 1mo（月足）"),
+    max_points: Optional[int] = Query(None, ge=3, le=5000, description="最大表示点数（超える場合はダウンサンプリング）"),
+    downsample: str = Query("ohlc", pattern="^(ohlc|lttb)$", description="ダウンサンプリング方式: ohlc（区間集約）, lttb（形状保持）"),
     db: Session = Depends(get_db)
 ):
     """株価データ取得（キャッシュ機能付き）"""
     try:
-        # キャッシュ付きでデータ取得
-        return StockService.get_stock_with_cache(db, stock_code, period)
+        # キャッシュ付きでデータ取得（週足・月足は日足から変換して足種ごとにキャッシュ）
+        price_data = StockService.get_stock_with_cache(db, stock_code, period, interval)
+        
+        # 小さなチャート向けに表示点数を削減
+        if max_points:
+            from app.services.resample_service import ResampleService
+            price_data = ResampleService.downsample(price_data, max_points, downsample)
+        
+        return price_data
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -63,19 +77,102 @@ async def get_technical_indicators(
 ):
     """テクニカル指標取得"""
     try:
-        # キャッシュ付きで株価データ取得
-        price_data = StockService.get_stock_with_cache(db, stock_code, period)
-        
-        # テクニカル指標計算
-        indicators = StockService.calculate_technical_indicators(price_data.data)
-        
-        return indicators
+        # 取得した履歴全体で計算したテクニカル指標（キャッシュ付き）
+        return StockService.get_technical_indicators_for_period(db, stock_code, period)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Failed to calculate indicators: {str(e)}"
         )
 
+@router.get("/{stock_code}/indicators/series", response_model=TechnicalIndicatorSeriesResponse)
+async def get_technical_indicator_series(
+    stock_code: str,
+    period: str = Query("1M", description="期間: 1W, 1M, 3M, 6M, 1Y"),
+    db: Session = Depends(get_db)
+):
+    """テクニカル指標の時系列取得（チャート重ね描き用）"""
+    try:
+        # 履歴全体で計算し、株価データと同じ並びに絞り込んだ指標系列
+        return StockService.get_indicator_series_with_cache(db, stock_code, period)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Failed to calculate indicator series: {str(e)}"
+        )
+
+@router.post("/indicators/batch", response_model=BatchIndicatorsResponse)
+async def get_technical_indicators_batch(
+    request: BatchIndicatorsRequest,
+    db: Session = Depends(get_db)
+):
+    """複数銘柄のテクニカル指標一括取得（ウォッチリスト用）"""
+    try:
+        # 株価履歴をまとめて取得し、全銘柄を一度に計算
+        # yfinanceの一括ダウンロードが発生しうるため、スレッドプールで実行してイベントループを止めない
+        histories = await run_in_threadpool(
+            StockService.get_stock_histories_bulk, db, request.stock_codes, request.period
+        )
+        indicators = await run_in_threadpool(StockService.calculate_technical_indicators_batch, histories)
+        
+        return BatchIndicatorsResponse(period=request.period, indicators=indicators)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to calculate indicators: {str(e)}"
+        )
+
+@router.get("/screener", response_model=ScreenerResponse)
+async def screen_stocks(
+    rsi_below: Optional[float] = Query(None, description="RSI(14)がこの値未満"),
+    rsi_above: Optional[float] = Query(None, description="RSI(14)がこの値より大きい"),
+    golden_cross_within: Optional[int] = Query(None, ge=0, description="直近N日以内にSMA25/75のゴールデンクロス"),
+    dead_cross_within: Optional[int] = Query(None, ge=0, description="直近N日以内にSMA25/75のデッドクロス"),
+    volume_ratio_above: Optional[float] = Query(None, description="出来高が25日平均の何倍より多いか"),
+    deviation_rate_below: Optional[float] = Query(None, description="25日移動平均乖離率（%）がこの値未満"),
+    deviation_rate_above: Optional[float] = Query(None, description="25日移動平均乖離率（%）がこの値より大きい"),
+    sector: Optional[str] = Query(None, description="セクター"),
+    limit: int = Query(50, ge=1, le=500, description="取得件数"),
+    db: Session = Depends(get_db)
+):
+    """銘柄スクリーニング（事前計算した指標行列から検索）"""
+    try:
+        from app.services.screener_service import ScreenerService
+        condition = ScreenerCondition(
+            rsi_below=rsi_below,
+            rsi_above=rsi_above,
+            golden_cross_within=golden_cross_within,
+            dead_cross_within=dead_cross_within,
+            volume_ratio_above=volume_ratio_above,
+            deviation_rate_below=deviation_rate_below,
+            deviation_rate_above=deviation_rate_above,
+            sector=sector,
+            limit=limit
+        )
+        return ScreenerService.screen(db, condition)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to screen stocks: {str(e)}"
+        )
+
+@router.post("/screener/refresh", status_code=status.HTTP_202_ACCEPTED)
+async def refresh_screener(
+    current_user: User = Depends(get_current_active_user)
+):
+    """スクリーニング用指標行列の更新を開始（定期更新とは別に即時更新する。完了を待たずに返す）"""
+    try:
+        from app.services.screener_service import ScreenerService
+        asyncio.get_running_loop().run_in_executor(None, ScreenerService.refresh_with_session)
+        return {"message": "Screener refresh started"}
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to refresh screener: {str(e)}"
+        )
+
 @router.post("/search-history", response_model=SearchHistoryResponse)
 async def add_search_history(
     search: SearchHistoryCreate,
@@ -293,6 +390,37 @@ async def get_cache_stats(
             detail=f"Failed to get cache stats: {str(e)}"
         )
 
+@router.get("/cache/policies")
+async def get_cache_policies():
+    """キャッシュポリシー一覧（有効期間・猶予期間・件数上限・保存先）"""
+    from app.core.cache_policy import CachePolicies
+    return {name: policy.model_dump() for name, policy in CachePolicies.all().items()}
+
+@router.patch("/cache/policies/{name}")
+async def update_cache_policy(
+    name: str,
+    changes: CachePolicyUpdate,
+    _: None = Depends(require_admin_token)
+):
+    """
+    キャッシュポリシーの変更（運用者のみ。このプロセスのみ、再起動後は CACHE_POLICIES の設定値に戻る）
+    /cache/stats のヒット率を見ながら有効期間・件数上限を調整する
+    """
+    from app.core.cache_policy import CachePolicies
+    try:
+        policy = CachePolicies.update(name, **changes.model_dump(exclude_unset=True))
+        return policy.model_dump()
+    except KeyError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown cache policy: {name}"
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
+
 @router.post("/cache/cleanup")
 async def cleanup_cache(
     db: Session = Depends(get_db)
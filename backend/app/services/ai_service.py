@@ -1,10 +1,20 @@
-import google.generativeai as genai
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, Tuple
 from sqlalchemy.orm import Session
-from app.models.database import AIExplanation, DailyAPIUsage, MinuteAPIUsage, UserDailyUsage, User
+from app.models.database import AIExplanation, UserDailyUsage, User
 from app.models.ai import AIExplanationRequest, AIExplanationResponse, APIUsageResponse
 from app.models.stock import StockPriceData, TechnicalIndicators
+from app.services.rate_limiter import RateLimiter
+from app.services.usage_service import UsageService
+from app.services.cache_service import CacheService
+from app.services.prefetch_service import PrefetchService
+from app.services.explanation_template_service import ExplanationTemplateService
+from app.services.llm_client import create_llm_client
+from app.services.token_estimator import TokenEstimator
+from app.core.database import SessionLocal, try_advisory_lock, release_advisory_lock
+from app.core.cache_policy import CachePolicies
 from fastapi import HTTPException, status
 import os
 import json
@@ -17,151 +27,241 @@ class AIService:
         "MINUTE_TOKENS": 850000,    # 分間制限85% (100万 × 0.85)
         "MINUTE_REQUESTS": 25       # 分間制限85% (30 × 0.85)
     }
-    TOKENS_PER_REQUEST = 650
+    TOKENS_PER_REQUEST = 650        # トークン見積もりの学習前の初期値
     USER_DAILY_LIMIT = 10
     
-    def __init__(self):
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key or api_key == "your_gemini_api_key_here":
-            self.enabled = False
-        else:
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
-            self.enabled = True
+    # トークン見積もりの補正比率を学習する過去の使用量の期間（日）
+    TOKEN_HISTORY_DAYS = 7
     
-    def check_api_limits(self, db: Session, user_id: uuid.UUID) -> APIUsageResponse:
-        """API制限チェック"""
-        today = date.today()
-        current_minute = datetime.utcnow().strftime("%Y-%m-%d_%H:%M")
-        
-        # 1. 日次リクエスト制限チェック
-        daily_usage = db.query(DailyAPIUsage).filter(
-            DailyAPIUsage.usage_date == today
-        ).first()
-        
-        daily_requests = daily_usage.total_requests if daily_usage else 0
-        if daily_requests >= self.APP_LIMITS["DAILY_REQUESTS"]:
-            return APIUsageResponse(
-                allowed=False,
-                reason="Daily request limit exceeded",
-                remaining_requests=0,
-                daily_limit=self.USER_DAILY_LIMIT
-            )
+    # 他ワーカーが同じ解説を生成中の場合の待機設定
+    GENERATION_WAIT_SECONDS = 60
+    GENERATION_POLL_SECONDS = 0.5
+    
+    # 使用量をデータベースに書き込む間隔（秒）
+    USAGE_FLUSH_SECONDS = 5
+    
+    # 解説の有効期間と延長できる期間は CachePolicies の ai_explanation（有効期間 + 猶予期間が作成からの上限）
+    
+    # 延長判定の許容差（移動平均・MACDはSMA25に対する%、RSIはポイント）
+    PRICE_TOLERANCE_PCT = 0.5
+    RSI_TOLERANCE = 2.0
+    
+    # テクニカル状態別テンプレートの利用（同じ状態の銘柄で解説を共有し、Gemini呼び出しを減らす）
+    STATE_CACHE_ENABLED = os.getenv("AI_STATE_CACHE_ENABLED", "false").lower() == "true"
+    
+    # 複数銘柄の解説を1回のGemini呼び出しにまとめる（制約はトークンではなくリクエスト数のため）
+    PACKING_ENABLED = os.getenv("AI_PACKING_ENABLED", "false").lower() == "true"
+    PACK_SIZE = 5
+    PACK_WINDOW_SECONDS = 0.5
+    
+    def __init__(self):
+        # GEMINI_API_KEY が未設定の場合はスタンドインを使い、本番と同じ経路（キャッシュ・利用枠）で動かす
+        self.backend, self.model = create_llm_client('gemini-2.0-flash-exp')
         
-        # 2. 分次リクエスト制限チェック
-        minute_usage = db.query(MinuteAPIUsage).filter(
-            MinuteAPIUsage.minute_key == current_minute
-        ).first()
+        # Gemini呼び出しは専用スレッドで実行し、イベントループ（株価APIなど）をブロックしない
+        # 同時実行数は分間リクエスト上限に合わせる
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.APP_LIMITS["MINUTE_REQUESTS"],
+            thread_name_prefix="gemini"
+        )
+        self._semaphore = asyncio.Semaphore(self.APP_LIMITS["MINUTE_REQUESTS"])
         
-        minute_requests = minute_usage.requests if minute_usage else 0
-        if minute_requests >= self.APP_LIMITS["MINUTE_REQUESTS"]:
-            return APIUsageResponse(
-                allowed=False,
-                reason="Rate limit exceeded, please try again later",
-                remaining_requests=0,
-                daily_limit=self.USER_DAILY_LIMIT
-            )
+        # 利用枠の判定はメモリ上で行い、使用量の記録はバックグラウンドで書き込む
+        self.rate_limiter = RateLimiter(
+            daily_requests=self.APP_LIMITS["DAILY_REQUESTS"],
+            minute_requests=self.APP_LIMITS["MINUTE_REQUESTS"],
+            minute_tokens=self.APP_LIMITS["MINUTE_TOKENS"],
+            user_daily_limit=self.USER_DAILY_LIMIT,
+            user_refresh_seconds=self.USAGE_FLUSH_SECONDS
+        )
         
-        # 3. 分次トークン制限チェック
-        minute_tokens = minute_usage.tokens if minute_usage else 0
-        if minute_tokens + self.TOKENS_PER_REQUEST > self.APP_LIMITS["MINUTE_TOKENS"]:
-            return APIUsageResponse(
-                allowed=False,
-                reason="Token rate limit exceeded",
-                remaining_requests=0,
-                daily_limit=self.USER_DAILY_LIMIT
-            )
+        # 分間トークンの予約はプロンプトの長さと実績から見積もる
+        self.token_estimator = TokenEstimator(self.TOKENS_PER_REQUEST)
         
-        # 4. ユーザー日次制限チェック
-        user_usage = db.query(UserDailyUsage).filter(
-            UserDailyUsage.user_id == user_id,
-            UserDailyUsage.usage_date == today
-        ).first()
+        # まとめて生成する待機中の解説と、まとめる待ち時間のタイマー
+        self._pack_queue: list = []
+        self._pack_timer: Optional[asyncio.TimerHandle] = None
         
-        user_requests = user_usage.request_count if user_usage else 0
-        if user_requests >= self.USER_DAILY_LIMIT:
-            return APIUsageResponse(
-                allowed=False,
-                reason="Daily user limit exceeded",
-                remaining_requests=0,
-                daily_limit=self.USER_DAILY_LIMIT
-            )
+        # 生成中の解説（キー: (銘柄コード, 期間)）
+        self._inflight: Dict[tuple, asyncio.Future] = {}
         
+        # 実行中のバックグラウンドタスク（完了まで参照を保持する）
+        self._tasks: set = set()
+    
+    def _start_task(self, coroutine) -> asyncio.Task:
+        """バックグラウンドタスクを開始（完了まで参照を保持し、途中で破棄されないようにする）"""
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+    
+    async def _generate_content(self, prompt: str):
+        """Gemini API呼び出し（同時実行数を制限して専用スレッドで実行）"""
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self.model.generate_content, prompt)
+    
+    def check_api_limits(self, db: Session, user_id: uuid.UUID) -> APIUsageResponse:
+        """API制限チェック（予約はしない）"""
+        self._load_user_usage(db, user_id)
+        reason, remaining = self.rate_limiter.check(user_id, self.token_estimator.typical())
         return APIUsageResponse(
-            allowed=True,
-            remaining_requests=self.USER_DAILY_LIMIT - user_requests,
+            allowed=reason is None,
+            reason=reason,
+            remaining_requests=remaining if reason is None else 0,
             daily_limit=self.USER_DAILY_LIMIT
         )
     
-    def record_usage(self, db: Session, user_id: uuid.UUID, actual_tokens: int):
-        """API使用量記録"""
-        today = date.today()
-        current_minute = datetime.utcnow().strftime("%Y-%m-%d_%H:%M")
-        
-        # 日次使用量更新
-        daily_usage = db.query(DailyAPIUsage).filter(
-            DailyAPIUsage.usage_date == today
-        ).first()
-        
-        if not daily_usage:
-            daily_usage = DailyAPIUsage(
-                usage_date=today,
-                total_requests=1,
-                total_tokens=actual_tokens,
-                estimated_tokens=self.TOKENS_PER_REQUEST,
-                actual_tokens=actual_tokens
-            )
-            db.add(daily_usage)
-        else:
-            daily_usage.total_requests += 1
-            daily_usage.total_tokens += actual_tokens
-            daily_usage.estimated_tokens += self.TOKENS_PER_REQUEST
-            daily_usage.actual_tokens += actual_tokens
-        
-        # 分次使用量更新
-        minute_usage = db.query(MinuteAPIUsage).filter(
-            MinuteAPIUsage.minute_key == current_minute
-        ).first()
-        
-        if not minute_usage:
-            minute_usage = MinuteAPIUsage(
-                minute_key=current_minute,
-                requests=1,
-                tokens=actual_tokens
+    def check_user_limit(self, db: Session, user_id: uuid.UUID):
+        """ユーザーの日次回数のみ確認（ジョブ登録時。全体の利用枠はジョブの待機で調整する）"""
+        self._load_user_usage(db, user_id)
+        _, remaining = self.rate_limiter.check(user_id, 0)
+        if remaining <= 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Daily user limit exceeded"
             )
-            db.add(minute_usage)
-        else:
-            minute_usage.requests += 1
-            minute_usage.tokens += actual_tokens
-        
-        # ユーザー日次使用量更新
+    
+    def _load_user_usage(self, db: Session, user_id: uuid.UUID):
+        """
+        ユーザーの本日の使用回数をレート制限に読み込み
+        単一ワーカーでは本日初回のみ読み込み、以降はメモリ上の回数で判定する
+        複数ワーカーでは書き込み間隔 USAGE_FLUSH_SECONDS ごとに全ワーカーの書き込み済み回数を読み込み直す
+        （他ワーカーの使用分の反映の遅れは、読み込み間隔と書き込み間隔を合わせた時間内の同時利用に限られる）
+        """
+        if user_id is None or not self.rate_limiter.needs_user_refresh(user_id):
+            return
         user_usage = db.query(UserDailyUsage).filter(
             UserDailyUsage.user_id == user_id,
-            UserDailyUsage.usage_date == today
+            UserDailyUsage.usage_date == date.today()
+        ).first()
+        self.rate_limiter.seed_user(user_id, user_usage.request_count if user_usage else 0)
+    
+    def seed_usage(self, db: Session):
+        """起動時に本日・現在の分の使用量をレート制限に反映"""
+        daily_usage = UsageService.get_daily_usage(db, date.today())
+        minute_usage = UsageService.get_minute_usage(db, datetime.utcnow().strftime("%Y-%m-%d_%H:%M"))
+        self.rate_limiter.seed(daily_usage["requests"], minute_usage["requests"], minute_usage["tokens"])
+        self.token_estimator.seed(**UsageService.get_token_totals(
+            db, date.today() - timedelta(days=self.TOKEN_HISTORY_DAYS)
+        ))
+    
+    def flush_usage(self, db: Session) -> int:
+        """記録待ちの使用量をデータベースに書き込み"""
+        events = self.rate_limiter.drain()
+        if not events:
+            return 0
+        if not UsageService.record(db, events):
+            self.rate_limiter.requeue(events)
+            return 0
+        self.rate_limiter.confirm_flushed(events)
+        return len(events)
+    
+    async def run_usage_recorder(self):
+        """使用量を定期的にデータベースへ書き込むバックグラウンドタスク"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.USAGE_FLUSH_SECONDS)
+            await loop.run_in_executor(None, self._flush_usage_with_session)
+    
+    def _flush_usage_with_session(self) -> int:
+        """専用セッションで使用量（解説の需要を含む）を書き込み"""
+        db = SessionLocal()
+        try:
+            PrefetchService.flush_demand(db)
+            return self.flush_usage(db)
+        finally:
+            db.close()
+    
+    def _extend_if_unchanged(
+        self,
+        db: Session,
+        stock_code: str,
+        period: str,
+        price_data: list[StockPriceData],
+        indicators: TechnicalIndicators
+    ) -> Optional[AIExplanationResponse]:
+        """直近の解説の指標と現在の指標の差が許容範囲内なら、有効期限を延長して返す"""
+        policy = CachePolicies.get("ai_explanation")
+        latest = db.query(AIExplanation).filter(
+            AIExplanation.stock_code == stock_code,
+            AIExplanation.chart_period == period,
+            AIExplanation.created_at > datetime.utcnow() - (policy.ttl + policy.stale)
         ).first()
         
-        if not user_usage:
-            user_usage = UserDailyUsage(
-                user_id=user_id,
-                usage_date=today,
-                request_count=1,
-                token_count=actual_tokens
-            )
-            db.add(user_usage)
-        else:
-            user_usage.request_count += 1
-            user_usage.token_count += actual_tokens
+        if not latest or not self._is_within_tolerance(latest.technical_data or {}, period, price_data, indicators):
+            return None
         
+        latest.expires_at = datetime.utcnow() + policy.ttl
         db.commit()
+        db.refresh(latest)
+        
+        return AIExplanationResponse(
+            id=latest.id,
+            stock_code=latest.stock_code,
+            chart_period=latest.chart_period,
+            explanation_text=latest.explanation_text,
+            technical_data=latest.technical_data,
+            created_at=latest.created_at,
+            expires_at=latest.expires_at
+        )
+    
+    def _is_within_tolerance(
+        self,
+        stored: Dict[str, Any],
+        period: str,
+        price_data: list[StockPriceData],
+        indicators: TechnicalIndicators
+    ) -> bool:
+        """保存時の指標と現在の指標の差が許容範囲内か"""
+        reference = indicators.sma_25 or stored.get("sma_25")
+        for field in ("sma_25", "sma_75", "macd_line", "macd_signal", "rsi_14"):
+            old, new = stored.get(field), getattr(indicators, field)
+            if old is None or new is None:
+                if old is not None or new is not None:
+                    return False
+                continue
+            if field == "rsi_14":
+                tolerance = self.RSI_TOLERANCE
+            elif reference:
+                tolerance = abs(reference) * self.PRICE_TOLERANCE_PCT / 100
+            else:
+                return False
+            if abs(new - old) > tolerance:
+                return False
+        
+        # MACDとシグナルの上下関係（ヒストグラムの符号）が変わった場合は延長しない
+        if stored.get("macd_line") is not None and stored.get("macd_signal") is not None:
+            if (stored["macd_line"] > stored["macd_signal"]) != (indicators.macd_line > indicators.macd_signal):
+                return False
+        
+        # テンプレートから作成した解説は、量子化した状態が同じ場合のみ延長
+        if stored.get("state_key"):
+            state = ExplanationTemplateService.quantize(price_data, indicators)
+            if ExplanationTemplateService.state_key(period, state) != stored["state_key"]:
+                return False
+        
+        return True
     
-    def get_cached_explanation(self, db: Session, stock_code: str, period: str) -> Optional[AIExplanationResponse]:
-        """キャッシュされた解説取得"""
+    def get_cached_explanation(
+        self,
+        db: Session,
+        stock_code: str,
+        period: str,
+        record_lookup: bool = False
+    ) -> Optional[AIExplanationResponse]:
+        """
+        キャッシュされた解説取得（銘柄・期間の一意インデックスで1行を参照）
+        record_lookup: リクエストの最初の確認としてヒット率に記録する（生成中の再確認は含めない）
+        """
         cached = db.query(AIExplanation).filter(
             AIExplanation.stock_code == stock_code,
             AIExplanation.chart_period == period,
             AIExplanation.expires_at > datetime.utcnow()
         ).first()
         
+        if record_lookup:
+            CacheService.record_lookup("ai_explanation", cached is not None)
         if cached:
             return AIExplanationResponse(
                 id=cached.id,
@@ -174,7 +274,7 @@ class AIService:
             )
         return None
     
-    def generate_explanation(
+    async def generate_explanation(
         self, 
         db: Session, 
         user_id: uuid.UUID,
@@ -185,122 +285,581 @@ class AIService:
     ) -> AIExplanationResponse:
         """AI解説生成"""
         
-        # MVP版：Gemini APIが設定されていない場合はモック応答を返す
-        if not self.enabled:
-            # モック解説を生成
-            mock_explanation = self._generate_mock_explanation(stock_code, price_data, indicators)
-            
-            # モック使用量記録
-            self.record_usage(db, user_id, self.TOKENS_PER_REQUEST)
-            
-            # キャッシュ保存
-            expires_at = datetime.utcnow() + timedelta(hours=1)
-            ai_explanation = AIExplanation(
-                stock_code=stock_code,
-                chart_period=period,
-                explanation_text=mock_explanation,
-                technical_data={
-                    "sma_25": indicators.sma_25,
-                    "sma_75": indicators.sma_75,
-                    "rsi_14": indicators.rsi_14,
-                    "macd_line": indicators.macd_line,
-                    "macd_signal": indicators.macd_signal,
-                    "macd_histogram": indicators.macd_histogram,
-                    "volume_sma_25": indicators.volume_sma_25
-                },
-                expires_at=expires_at
-            )
-            
-            db.add(ai_explanation)
-            db.commit()
-            db.refresh(ai_explanation)
-            
-            return AIExplanationResponse(
-                id=ai_explanation.id,
-                stock_code=stock_code,
-                chart_period=period,
-                explanation_text=mock_explanation,
-                technical_data={
-                    "sma_25": indicators.sma_25,
-                    "sma_75": indicators.sma_75,
-                    "rsi_14": indicators.rsi_14,
-                    "macd_line": indicators.macd_line,
-                    "macd_signal": indicators.macd_signal,
-                    "macd_histogram": indicators.macd_histogram,
-                    "volume_sma_25": indicators.volume_sma_25
-                },
-                created_at=ai_explanation.created_at,
-                expires_at=ai_explanation.expires_at
-            )
-        
         # キャッシュ確認
         cached = self.get_cached_explanation(db, stock_code, period)
         if cached:
             return cached
         
-        # API制限チェック
-        usage_check = self.check_api_limits(db, user_id)
-        if not usage_check.allowed:
+        # 同じ銘柄・期間の生成が実行中なら、その結果を待って共有する（Gemini呼び出しは1回のみ）
+        key = (stock_code, period)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        
+        future = asyncio.get_running_loop().create_future()
+        # 待機者がいない場合でも例外が未取得の警告を出さない
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._inflight[key] = future
+        try:
+            explanation = await self._generate_with_lock(db, user_id, stock_code, period, price_data, indicators)
+            future.set_result(explanation)
+            return explanation
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._inflight[key]
+    
+    async def _generate_with_lock(
+        self,
+        db: Session,
+        user_id: uuid.UUID,
+        stock_code: str,
+        period: str,
+        price_data: list[StockPriceData],
+        indicators: TechnicalIndicators
+    ) -> AIExplanationResponse:
+        """ワーカー間ロックを取得して生成（他ワーカーが生成中ならキャッシュ保存を待つ）"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.GENERATION_WAIT_SECONDS
+        
+        while True:
+            acquired, connection = await self._acquire_generation_lock(db, stock_code, period)
+            if acquired:
+                try:
+                    reused = self._reuse_saved_explanation(db, stock_code, period, price_data, indicators)
+                    if reused:
+                        return reused
+                    return await self._create_new_explanation(db, user_id, stock_code, period, price_data, indicators)
+                finally:
+                    await self._release_generation_lock(connection, stock_code, period)
+            
+            if loop.time() >= deadline:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="AI explanation is being generated, please try again later"
+                )
+            
+            await asyncio.sleep(self.GENERATION_POLL_SECONDS)
+            cached = self.get_cached_explanation(db, stock_code, period)
+            if cached:
+                return cached
+    
+    @staticmethod
+    def _generation_lock_name(stock_code: str, period: str) -> str:
+        """解説生成のアドバイザリロック名"""
+        return f"ai_explanation:{stock_code}:{period}"
+    
+    async def _acquire_generation_lock(self, db: Session, stock_code: str, period: str):
+        """
+        ワーカー間ロックの取得（(取得できたか, 接続) を返す）
+        取得を待つ間にキャンセルされた場合は、スレッドで取得されたロックと接続を後から解放する
+        """
+        loop = asyncio.get_running_loop()
+        lock_name = self._generation_lock_name(stock_code, period)
+        pending = loop.run_in_executor(None, try_advisory_lock, db.get_bind(), lock_name)
+        try:
+            return await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            def release_later(done: asyncio.Future):
+                if not done.cancelled() and done.exception() is None:
+                    loop.run_in_executor(None, release_advisory_lock, done.result()[1], lock_name)
+            pending.add_done_callback(release_later)
+            raise
+    
+    async def _release_generation_lock(self, connection, stock_code: str, period: str):
+        """ワーカー間ロックの解放（キャンセルされても解放は最後まで行う）"""
+        loop = asyncio.get_running_loop()
+        await asyncio.shield(loop.run_in_executor(
+            None, release_advisory_lock, connection, self._generation_lock_name(stock_code, period)
+        ))
+    
+    def _reuse_saved_explanation(
+        self,
+        db: Session,
+        stock_code: str,
+        period: str,
+        price_data: list[StockPriceData],
+        indicators: TechnicalIndicators
+    ) -> Optional[AIExplanationResponse]:
+        """ロック取得後の再確認（待機中に他ワーカーが保存した解説、または延長できる期限切れの解説）"""
+        cached = self.get_cached_explanation(db, stock_code, period)
+        if cached:
+            return cached
+        # 指標がほぼ変わっていなければ、期限切れの解説を延長して再利用
+        return self._extend_if_unchanged(db, stock_code, period, price_data, indicators)
+    
+    async def prefetch_explanation(
+        self,
+        db: Session,
+        stock_code: str,
+        period: str,
+        price_data: list[StockPriceData],
+        indicators: TechnicalIndicators,
+        expires_at: datetime
+    ) -> AIExplanationResponse:
+        """事前生成（ユーザー制限の対象外、全体の利用枠は通常の生成と共有）"""
+        return await self._create_new_explanation(db, None, stock_code, period, price_data, indicators, expires_at)
+    
+    def _acquire_quota(self, db: Session, user_id: Optional[uuid.UUID], reserved_tokens: int):
+        """API制限チェック（全バケットから同時に予約し、同時リクエストでも上限を超えない）"""
+        self._load_user_usage(db, user_id)
+        reason, _ = self.rate_limiter.try_acquire(user_id, reserved_tokens)
+        if reason:
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail=usage_check.reason
+                detail=reason
             )
+    
+    def _actual_tokens(self, response, reserved_tokens: int) -> int:
+        """Geminiのレスポンスから実際のトークン数を取得（取得できない場合は予約したトークン数）"""
+        usage_metadata = getattr(response, 'usage_metadata', None)
+        return usage_metadata.total_token_count if usage_metadata else reserved_tokens
+    
+    def _record_usage(self, user_id: Optional[uuid.UUID], base_tokens: int, reserved_tokens: int, response):
+        """使用量を記録し、実際のトークン数で見積もりの補正比率を更新"""
+        actual_tokens = self._actual_tokens(response, reserved_tokens)
+        if getattr(response, 'usage_metadata', None):
+            self.token_estimator.observe(base_tokens, actual_tokens)
+        self.rate_limiter.record(user_id, reserved_tokens, actual_tokens, estimated_tokens=base_tokens)
+    
+    def _save_explanation(
+        self,
+        db: Session,
+        stock_code: str,
+        period: str,
+        explanation_text: str,
+        indicators: TechnicalIndicators,
+        expires_at: Optional[datetime] = None,
+        state_key: Optional[str] = None
+    ) -> AIExplanationResponse:
+        """生成した解説をキャッシュ保存"""
+        expires_at = expires_at or datetime.utcnow() + CachePolicies.get("ai_explanation").ttl
+        technical_data = {
+            "sma_25": indicators.sma_25,
+            "sma_75": indicators.sma_75,
+            "rsi_14": indicators.rsi_14,
+            "macd_line": indicators.macd_line,
+            "macd_signal": indicators.macd_signal
+        }
+        if state_key:
+            technical_data["state_key"] = state_key
+        # 銘柄・期間ごとに1行（前回の解説は置き換える）
+        ai_explanation = CacheService.upsert_ai_explanation(
+            db, stock_code, period, explanation_text, technical_data, expires_at
+        )
         
+        return AIExplanationResponse(
+            id=ai_explanation.id,
+            stock_code=ai_explanation.stock_code,
+            chart_period=ai_explanation.chart_period,
+            explanation_text=ai_explanation.explanation_text,
+            technical_data=ai_explanation.technical_data,
+            created_at=ai_explanation.created_at,
+            expires_at=ai_explanation.expires_at
+        )
+    
+    async def _create_new_explanation(
+        self,
+        db: Session,
+        user_id: Optional[uuid.UUID],
+        stock_code: str,
+        period: str,
+        price_data: list[StockPriceData],
+        indicators: TechnicalIndicators,
+        expires_at: Optional[datetime] = None
+    ) -> AIExplanationResponse:
+        """キャッシュにない解説を作成（テクニカル状態別テンプレートが有効ならテンプレートから）"""
+        if self.STATE_CACHE_ENABLED:
+            return await self._create_state_explanation(db, user_id, stock_code, period, price_data, indicators, expires_at)
+        if self.PACKING_ENABLED:
+            return await self._submit_packed({
+                "user_id": user_id,
+                "stock_code": stock_code,
+                "period": period,
+                "price_data": price_data,
+                "indicators": indicators,
+                "expires_at": expires_at
+            })
+        return await self._create_explanation(db, user_id, stock_code, period, price_data, indicators, expires_at)
+    
+    async def _submit_packed(self, job: Dict[str, Any]) -> AIExplanationResponse:
+        """短時間に集まった生成をまとめて1回のGemini呼び出しで処理"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pack_queue.append((job, future))
+        if len(self._pack_queue) >= self.PACK_SIZE:
+            self._flush_pack()
+        elif self._pack_timer is None:
+            self._pack_timer = loop.call_later(self.PACK_WINDOW_SECONDS, self._flush_pack)
+        return await future
+    
+    def _flush_pack(self):
+        """待機中の生成をまとめて実行"""
+        if self._pack_timer is not None:
+            self._pack_timer.cancel()
+            self._pack_timer = None
+        batch, self._pack_queue = self._pack_queue, []
+        if batch:
+            self._start_task(self._run_pack(batch))
+    
+    async def _run_pack(self, batch: list):
+        """まとめた生成を専用セッションで実行し、各リクエストに結果を返す"""
+        db = SessionLocal()
         try:
-            # プロンプト作成
-            prompt = self._create_prompt(stock_code, period, price_data, indicators)
-            
-            # Gemini API呼び出し
-            response = self.model.generate_content(prompt)
-            explanation_text = response.text
-            
-            # 使用量記録（実際のトークン数）
-            actual_tokens = response.usage_metadata.total_token_count if hasattr(response, 'usage_metadata') else self.TOKENS_PER_REQUEST
-            self.record_usage(db, user_id, actual_tokens)
-            
-            # キャッシュ保存
-            expires_at = datetime.utcnow() + timedelta(hours=1)
-            ai_explanation = AIExplanation(
-                stock_code=stock_code,
-                chart_period=period,
-                explanation_text=explanation_text,
-                technical_data={
-                    "sma_25": indicators.sma_25,
-                    "sma_75": indicators.sma_75,
-                    "rsi_14": indicators.rsi_14,
-                    "macd_line": indicators.macd_line,
-                    "macd_signal": indicators.macd_signal
-                },
-                expires_at=expires_at
+            results = await self.create_packed_explanations(db, [job for job, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            db.close()
+    
+    async def create_packed_explanations(self, db: Session, jobs: list[Dict[str, Any]]) -> list:
+        """
+        複数銘柄の解説を1回のGemini呼び出しで生成して保存
+        jobs の各要素: user_id, stock_code, period, price_data, indicators, expires_at
+        戻り値は jobs と同じ順の AIExplanationResponse または例外
+        """
+        results: list = [None] * len(jobs)
+        
+        # ユーザー別の日次回数は解説ごとに予約し、全体の枠は1リクエスト分として予約する
+        for index, job in enumerate(jobs):
+            if job["user_id"] is None:
+                continue
+            self._load_user_usage(db, job["user_id"])
+            reason = self.rate_limiter.try_acquire_user(job["user_id"])
+            if reason:
+                results[index] = HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=reason)
+        
+        active = [index for index in range(len(jobs)) if results[index] is None]
+        if not active:
+            return results
+        
+        def fail(indices: list, error: HTTPException):
+            for index in indices:
+                self.rate_limiter.release_user(jobs[index]["user_id"])
+                results[index] = error
+        
+        prompt = self._create_packed_prompt([jobs[index] for index in active])
+        base_tokens, reserved_tokens = self.token_estimator.estimate(prompt, outputs=len(active))
+        reason, _ = self.rate_limiter.try_acquire(None, reserved_tokens)
+        if reason:
+            fail(active, HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=reason))
+            return results
+        
+        try:
+            response = await self._generate_content(prompt)
+            explanations = self._parse_packed_response(response.text)
+        except Exception as e:
+            self.rate_limiter.record(None, reserved_tokens, reserved_tokens, estimated_tokens=base_tokens)
+            fail(active, HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to generate AI explanation: {str(e)}"
+            ))
+            return results
+        
+        parsed = [index for position, index in enumerate(active, start=1) if position in explanations]
+        missing = [index for position, index in enumerate(active, start=1) if position not in explanations]
+        
+        # 使用量は1リクエストとして記録し、トークンは応答に含まれた解説ごとに按分
+        # （ユーザー別の回数も含まれた解説のみ加算し、含まれなかった解説は個別生成で記録する）
+        actual_tokens = self._actual_tokens(response, reserved_tokens)
+        if getattr(response, 'usage_metadata', None):
+            self.token_estimator.observe(base_tokens, actual_tokens)
+        
+        recipients = [jobs[index]["user_id"] for index in parsed] or [None]
+        
+        def share(total: int, position: int) -> int:
+            return total // len(recipients) + (total % len(recipients) if position == 0 else 0)
+        
+        for position, user_id in enumerate(recipients):
+            self.rate_limiter.record(
+                user_id, share(reserved_tokens, position), share(actual_tokens, position),
+                requests=1 if position == 0 else 0, estimated_tokens=share(base_tokens, position)
             )
+        
+        for position, index in enumerate(active, start=1):
+            if index in parsed:
+                job = jobs[index]
+                results[index] = self._save_explanation(
+                    db, job["stock_code"], job["period"], explanations[position], job["indicators"], job["expires_at"]
+                )
+        
+        # 応答に含まれなかった銘柄は個別に生成
+        for index in missing:
+            job = jobs[index]
+            self.rate_limiter.release_user(job["user_id"])
+            try:
+                results[index] = await self._create_explanation(
+                    db, job["user_id"], job["stock_code"], job["period"], job["price_data"], job["indicators"], job["expires_at"]
+                )
+            except Exception as e:
+                results[index] = e
+        
+        return results
+    
+    async def _create_state_explanation(
+        self,
+        db: Session,
+        user_id: Optional[uuid.UUID],
+        stock_code: str,
+        period: str,
+        price_data: list[StockPriceData],
+        indicators: TechnicalIndicators,
+        expires_at: Optional[datetime] = None
+    ) -> AIExplanationResponse:
+        """同じテクニカル状態の銘柄で共有するテンプレートから解説を作成（テンプレートがない場合のみGemini呼び出し）"""
+        state = ExplanationTemplateService.quantize(price_data, indicators)
+        state_key = ExplanationTemplateService.state_key(period, state)
+        
+        template_text = ExplanationTemplateService.get_template(db, state_key)
+        if template_text is None:
+            template_key = ("template", state_key)
+            inflight = self._inflight.get(template_key)
+            if inflight is not None:
+                template_text = await asyncio.shield(inflight)
+            else:
+                future = asyncio.get_running_loop().create_future()
+                future.add_done_callback(lambda done: done.cancelled() or done.exception())
+                self._inflight[template_key] = future
+                try:
+                    template_text = await self._create_template(db, user_id, state_key, period, state)
+                    future.set_result(template_text)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except BaseException as e:
+                    future.set_exception(e)
+                    raise
+                finally:
+                    self._inflight.pop(template_key, None)
+        
+        explanation_text = ExplanationTemplateService.render(template_text, stock_code, price_data)
+        return self._save_explanation(db, stock_code, period, explanation_text, indicators, expires_at, state_key)
+    
+    async def _create_template(
+        self,
+        db: Session,
+        user_id: Optional[uuid.UUID],
+        state_key: str,
+        period: str,
+        state: Dict[str, str]
+    ) -> str:
+        """テクニカル状態別のテンプレートをGemini APIで生成して保存"""
+        prompt = ExplanationTemplateService.create_prompt(period, state)
+        base_tokens, reserved_tokens = self.token_estimator.estimate(prompt)
+        self._acquire_quota(db, user_id, reserved_tokens)
+        
+        try:
+            response = await self._generate_content(prompt)
+            self._record_usage(user_id, base_tokens, reserved_tokens, response)
+            ExplanationTemplateService.save_template(db, state_key, period, state, response.text)
+            return response.text
+        except Exception as e:
+            self.rate_limiter.release_user(user_id)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to generate AI explanation template: {str(e)}"
+            )
+    
+    async def _create_explanation(
+        self,
+        db: Session,
+        user_id: Optional[uuid.UUID],
+        stock_code: str,
+        period: str,
+        price_data: list[StockPriceData],
+        indicators: TechnicalIndicators,
+        expires_at: Optional[datetime] = None
+    ) -> AIExplanationResponse:
+        """Gemini APIで解説を生成してキャッシュ保存（user_id が None の場合はシステムによる事前生成）"""
+        # プロンプト作成（分間トークンはプロンプトの長さから見積もって予約）
+        prompt = self._create_prompt(stock_code, period, price_data, indicators)
+        base_tokens, reserved_tokens = self.token_estimator.estimate(prompt)
+        self._acquire_quota(db, user_id, reserved_tokens)
+        
+        try:
+            # Gemini API呼び出し
+            response = await self._generate_content(prompt)
             
-            db.add(ai_explanation)
-            db.commit()
-            db.refresh(ai_explanation)
+            # 使用量記録（実際のトークン数、DBへの書き込みはバックグラウンド）
+            self._record_usage(user_id, base_tokens, reserved_tokens, response)
             
-            return AIExplanationResponse(
-                id=ai_explanation.id,
-                stock_code=ai_explanation.stock_code,
-                chart_period=ai_explanation.chart_period,
-                explanation_text=ai_explanation.explanation_text,
-                technical_data=ai_explanation.technical_data,
-                created_at=ai_explanation.created_at,
-                expires_at=ai_explanation.expires_at
-            )
+            return self._save_explanation(db, stock_code, period, response.text, indicators, expires_at)
             
         except Exception as e:
+            self.rate_limiter.release_user(user_id)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to generate AI explanation: {str(e)}"
             )
     
-    def _create_prompt(self, stock_code: str, period: str, price_data: list[StockPriceData], indicators: TechnicalIndicators) -> str:
-        """プロンプト作成"""
+    async def stream_explanation(
+        self,
+        db: Session,
+        user_id: uuid.UUID,
+        stock_code: str,
+        period: str,
+        price_data: list[StockPriceData],
+        indicators: TechnicalIndicators
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        AI解説をストリーミング生成
+        ("chunk", 生成途中の文章) を順に返し、最後に ("done", 保存した解説) を返す
+        キャッシュ済み・他リクエストが生成中の場合は完成した解説のみを返す
+        """
+        # テンプレート利用時は生成済みテンプレートへの差し込みが中心のため、ストリーミングしない
+        if self.STATE_CACHE_ENABLED:
+            yield "done", await self.generate_explanation(db, user_id, stock_code, period, price_data, indicators)
+            return
         
-        # 最新の価格情報
-        latest = price_data[-1] if price_data else None
-        if not latest:
-            return ""
+        cached = self.get_cached_explanation(db, stock_code, period)
+        if cached:
+            yield "done", cached
+            return
+        
+        key = (stock_code, period)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            yield "done", await asyncio.shield(inflight)
+            return
+        
+        # ロック取得の待機中に同じキーのリクエストが来ても重複しないよう、先に登録する
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._inflight[key] = future
+        
+        # 生成タスクに引き継ぐまでは、キャンセル（接続切断）を含むすべての終了で待機者を解放する
+        held, connection = False, None
+        try:
+            held, connection = await self._acquire_generation_lock(db, stock_code, period)
+            if held:
+                explanation = self._reuse_saved_explanation(db, stock_code, period, price_data, indicators)
+                if explanation:
+                    held = False
+                    await self._release_generation_lock(connection, stock_code, period)
+            else:
+                # 他ワーカーが生成中のため、保存を待って返す
+                explanation = await self._generate_with_lock(db, user_id, stock_code, period, price_data, indicators)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+            else:
+                future.cancel()
+            self._inflight.pop(key, None)
+            if held:
+                asyncio.get_running_loop().run_in_executor(
+                    None, release_advisory_lock, connection, self._generation_lock_name(stock_code, period)
+                )
+            raise
+        
+        if explanation:
+            future.set_result(explanation)
+            self._inflight.pop(key, None)
+            yield "done", explanation
+            return
+        
+        # 生成はタスクで行い、接続が切れても最後まで生成・保存する（利用枠を無駄にしない）
+        events: asyncio.Queue = asyncio.Queue()
+        self._start_task(self._stream_and_save(
+            user_id, stock_code, period, price_data, indicators, events, future, connection
+        ))
+        
+        while True:
+            kind, value = await events.get()
+            if kind == "error":
+                raise value
+            yield kind, value
+            if kind == "done":
+                return
+    
+    async def _stream_and_save(
+        self,
+        user_id: uuid.UUID,
+        stock_code: str,
+        period: str,
+        price_data: list[StockPriceData],
+        indicators: TechnicalIndicators,
+        events: asyncio.Queue,
+        future: asyncio.Future,
+        connection
+    ):
+        """ストリーミング生成した文章を順次キューに送り、完了後に保存・使用量を記録"""
+        key = (stock_code, period)
+        db = SessionLocal()
+        try:
+            prompt = self._create_prompt(stock_code, period, price_data, indicators)
+            base_tokens, reserved_tokens = self.token_estimator.estimate(prompt)
+            self._acquire_quota(db, user_id, reserved_tokens)
+            try:
+                chunks = []
+                response = None
+                async for kind, value in self._stream_content(prompt):
+                    if kind == "chunk":
+                        chunks.append(value)
+                        events.put_nowait(("chunk", value))
+                    else:
+                        response = value
+                
+                # 使用量記録は生成完了時に実際のトークン数で行う
+                self._record_usage(user_id, base_tokens, reserved_tokens, response)
+                explanation = self._save_explanation(db, stock_code, period, "".join(chunks), indicators)
+            except Exception as e:
+                self.rate_limiter.release_user(user_id)
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Failed to generate AI explanation: {str(e)}"
+                )
+            future.set_result(explanation)
+            events.put_nowait(("done", explanation))
+        except Exception as e:
+            future.set_exception(e)
+            events.put_nowait(("error", e))
+        except BaseException:
+            # シャットダウンなどでタスクが止められた場合も待機者を解放する
+            future.cancel()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            await self._release_generation_lock(connection, stock_code, period)
+            db.close()
+    
+    async def _stream_content(self, prompt: str) -> AsyncIterator[Tuple[str, Any]]:
+        """Gemini APIのストリーミング呼び出し（("chunk", 文章) を順に返し、最後に ("end", レスポンス)）"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        def produce():
+            try:
+                response = self.model.generate_content(prompt, stream=True)
+                for chunk in response:
+                    loop.call_soon_threadsafe(queue.put_nowait, ("chunk", chunk.text))
+                loop.call_soon_threadsafe(queue.put_nowait, ("end", response))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+        
+        async with self._semaphore:
+            loop.run_in_executor(self._executor, produce)
+            while True:
+                kind, value = await queue.get()
+                if kind == "error":
+                    raise value
+                yield kind, value
+                if kind == "end":
+                    return
+    
+    def _describe_chart(self, price_data: list[StockPriceData], indicators: TechnicalIndicators) -> str:
+        """プロンプト用の現在の状況とテクニカル指標"""
+        latest = price_data[-1]
         
         # 価格変化の計算
         if len(price_data) >= 2:
@@ -309,19 +868,28 @@ class AIService:
         else:
             change_pct = 0
         
-        prompt = f"""
-株式コード {stock_code} の{period}チャート分析をお願いします。
-
-【現在の状況】
+        return f"""【現在の状況】
 - 現在価格: {latest.close:.2f}円
 - 前日比: {change_pct:+.2f}%
 - 出来高: {latest.volume:,}株
 
 【テクニカル指標】
-- SMA25日: {indicators.sma_25:.2f}円 (現在価格との差: {(latest.close - indicators.sma_25):.2f}円)
-- SMA75日: {indicators.sma_75:.2f}円 (現在価格との差: {(latest.close - indicators.sma_75):.2f}円)
-- RSI(14日): {indicators.rsi_14:.1f}
-- MACD: {indicators.macd_line:.3f} (シグナル: {indicators.macd_signal:.3f})
+- SMA25日: {self._format_sma(indicators.sma_25, latest.close)}
+- SMA75日: {self._format_sma(indicators.sma_75, latest.close)}
+- RSI(14日): {self._format_value(indicators.rsi_14, ".1f")}
+- MACD: {self._format_value(indicators.macd_line, ".3f")} (シグナル: {self._format_value(indicators.macd_signal, ".3f")})"""
+    
+    def _create_prompt(self, stock_code: str, period: str, price_data: list[StockPriceData], indicators: TechnicalIndicators) -> str:
+        """プロンプト作成"""
+        
+        # 最新の価格情報
+        if not price_data:
+            return ""
+        
+        prompt = f"""
+株式コード {stock_code} の{period}チャート分析をお願いします。
+
+{self._describe_chart(price_data, indicators)}
 
 【分析依頼】
 投資初心者の女性向けに、以下の点で分析してください：
@@ -338,46 +906,62 @@ class AIService:
         
         return prompt
     
-    def _generate_mock_explanation(
-        self, 
-        stock_code: str, 
-        price_data: list[StockPriceData], 
-        indicators: TechnicalIndicators
-    ) -> str:
-        """モック解説生成（MVP版）"""
-        latest = price_data[-1]
-        
-        # 基本的な分析
-        if indicators.sma_25 and indicators.sma_75:
-            if indicators.sma_25 > indicators.sma_75:
-                trend = "上昇トレンド"
-            else:
-                trend = "下降トレンド"
-        else:
-            trend = "横ばい"
-        
-        # RSIによる状況判断
-        if indicators.rsi_14:
-            if indicators.rsi_14 > 70:
-                rsi_desc = "買われすぎ"
-            elif indicators.rsi_14 < 30:
-                rsi_desc = "売られすぎ"
-            else:
-                rsi_desc = "適正水準"
-        else:
-            rsi_desc = "適正水準"
-        
-        # MACDによるモメンタム
-        if indicators.macd_histogram and indicators.macd_histogram > 0:
-            momentum = "上昇の勢いがあります"
-        else:
-            momentum = "下降の勢いがみられます"
+    def _create_packed_prompt(self, jobs: list[Dict[str, Any]]) -> str:
+        """複数銘柄をまとめたプロンプト作成（JSONで銘柄ごとの解説を返させる）"""
+        sections = "\n\n".join(
+            f"""### 解説{number}: 株式コード {job["stock_code"]} の{job["period"]}チャート
+{self._describe_chart(job["price_data"], job["indicators"])}"""
+            for number, job in enumerate(jobs, start=1)
+        )
         
-        mock_explanation = f"""
-現在、{stock_code}は{trend}にあります。
-RSIは{rsi_desc}の状態で、{momentum}。
-短期移動平均線が長期線を上回っている場合は比較的良好な状況ですが、
-投資判断はご自身でお決めください。
-        """.strip()
+        return f"""
+以下の{len(jobs)}件のチャートについて、それぞれ分析をお願いします。
+
+{sections}
+
+【分析依頼】
+投資初心者の女性向けに、各チャートについて以下の点で分析してください：
+1. 現在のトレンド状況（上昇・下降・横ばい）
+2. テクニカル指標から読み取れる状況
+3. 初心者向けのやさしいアドバイス
+
+【注意事項】
+- 具体的な売買判断は避けてください
+- やさしく分かりやすい言葉で説明してください
+- 各解説は150文字以内でお願いします
+- 各解説の最後に「投資判断はご自身でお決めください」を追加してください
+
+【出力形式】
+次の形式のJSONのみを出力してください（id は解説の番号）：
+[{{"id": 1, "explanation": "解説文"}}, {{"id": 2, "explanation": "解説文"}}]
+"""
+    
+    @staticmethod
+    def _parse_packed_response(text: str) -> Dict[int, str]:
+        """まとめて生成した解説を番号ごとに分割"""
+        start, end = text.find("["), text.rfind("]")
+        if start < 0 or end < start:
+            raise ValueError("Packed response does not contain a JSON array")
         
-        return mock_explanation
\ No newline at end of file
+        explanations = {}
+        for item in json.loads(text[start:end + 1]):
+            if not (isinstance(item, dict) and isinstance(item.get("explanation"), str) and item["explanation"].strip()):
+                continue
+            # 番号が欠けている・数値でない項目は含まれなかった扱い（個別に生成する）
+            try:
+                explanations[int(item.get("id"))] = item["explanation"].strip()
+            except (TypeError, ValueError):
+                continue
+        return explanations
+    
+    @staticmethod
+    def _format_value(value: Optional[float], spec: str) -> str:
+        """指標値の書式化（計算できない場合はデータ不足と表示）"""
+        return format(value, spec) if value is not None else "データ不足"
+    
+    @staticmethod
+    def _format_sma(sma: Optional[float], close: float) -> str:
+        """移動平均と現在価格との差の書式化"""
+        if sma is None:
+            return "データ不足"
+        return f"{sma:.2f}円 (現在価格との差: {(close - sma):.2f}円)"
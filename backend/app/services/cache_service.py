@@ -3,25 +3,46 @@
 PostgreSQLを使用したキャッシュ管理を提供
 """
 
-from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+from collections import OrderedDict
+from datetime import datetime
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, func
+from sqlalchemy.dialects.postgresql import insert
 from app.models.database import StockPriceCache, AIExplanation
-from app.models.stock import StockPriceResponse
+from app.core.cache_policy import CachePolicies
+from app.models.stock import StockPriceResponse, StockPriceData
 import json
 import hashlib
+import threading
 
 class CacheService:
-    # キャッシュ期間設定
-    CACHE_DURATIONS = {
-        "stock_price": timedelta(minutes=30),        # 株価データ: 30分
-        "ai_explanation": timedelta(hours=4),        # AI説明: 4時間
-        "popular_stocks": timedelta(hours=1),        # 人気銘柄: 1時間
-        "sector_stocks": timedelta(hours=2),         # セクター別: 2時間
-        "technical_indicators": timedelta(minutes=30) # テクニカル指標: 30分
+    # キャッシュ期間・件数上限は app/core/cache_policy.py の CachePolicies で管理する
+    
+    # 計算済みテクニカル指標のプロセス内キャッシュ（キー: 株価データのフィンガープリント、登録順）
+    _indicator_cache: "OrderedDict[str, Tuple[datetime, Any]]" = OrderedDict()
+    
+    # キャッシュの種類ごとの参照結果（プロセス内、ポリシー調整の判断材料）
+    _cache_metrics: Dict[str, Dict[str, int]] = {
+        name: {"hits": 0, "misses": 0} for name in ("stock_price", "ai_explanation", "technical_indicators")
     }
     
+    # スレッドプール（/ai/explain・ジョブワーカー・事前生成）から同時に更新されるため、
+    # プロセス内キャッシュと参照結果の読み書きはこのロック内で行う
+    _memory_lock = threading.Lock()
+    
+    @staticmethod
+    def record_lookup(name: str, hit: bool, count: int = 1):
+        """キャッシュ参照のヒット・ミスを記録"""
+        with CacheService._memory_lock:
+            CacheService._cache_metrics[name]["hits" if hit else "misses"] += count
+    
+    @staticmethod
+    def get_cache_metrics() -> Dict[str, Dict[str, int]]:
+        """キャッシュの種類ごとの参照結果のコピー"""
+        with CacheService._memory_lock:
+            return {name: dict(metrics) for name, metrics in CacheService._cache_metrics.items()}
+    
     @staticmethod
     def get_cache_key(prefix: str, **kwargs) -> str:
         """キャッシュキーの生成"""
@@ -31,14 +52,31 @@ class CacheService:
         key_string = "|".join(key_parts)
         return hashlib.md5(key_string.encode()).hexdigest()
     
+    @staticmethod
+    def get_stock_price_cache_key(stock_code: str, period: str, interval: str = "1d") -> str:
+        """株価データのキャッシュキー（日足は従来のキーのまま、週足・月足は足種ごと）"""
+        if interval == "1d":
+            return CacheService.get_cache_key("stock_price", code=stock_code, period=period)
+        return CacheService.get_cache_key("stock_price", code=stock_code, period=period, interval=interval)
+    
+    @staticmethod
+    def get_price_fingerprint(price_data: List[StockPriceData]) -> str:
+        """株価データのフィンガープリント（本数・先頭日・最終日・最終足の値）"""
+        if not price_data:
+            return "empty"
+        first = price_data[0]
+        last = price_data[-1]
+        return f"{len(price_data)}|{first.time}|{last.time}|{last.close}|{last.volume}"
+    
     @staticmethod
     def get_stock_price_cache(
         db: Session, 
         stock_code: str, 
-        period: str
+        period: str,
+        interval: str = "1d"
     ) -> Optional[StockPriceResponse]:
         """株価データキャッシュ取得"""
-        cache_key = CacheService.get_cache_key("stock_price", code=stock_code, period=period)
+        cache_key = CacheService.get_stock_price_cache_key(stock_code, period, interval)
         
         # キャッシュエントリ検索
         cached_entry = db.query(StockPriceCache).filter(
@@ -52,6 +90,7 @@ class CacheService:
             try:
                 # JSON データをパース
                 cache_data = json.loads(cached_entry.price_data)
+                CacheService.record_lookup("stock_price", True)
                 return StockPriceResponse(**cache_data)
             except Exception as e:
                 print(f"Cache parse error: {str(e)}")
@@ -59,6 +98,7 @@ class CacheService:
                 db.delete(cached_entry)
                 db.commit()
         
+        CacheService.record_lookup("stock_price", False)
         return None
     
     @staticmethod
@@ -66,12 +106,13 @@ class CacheService:
         db: Session, 
         stock_code: str, 
         period: str,
-        data: StockPriceResponse
+        data: StockPriceResponse,
+        interval: str = "1d"
     ) -> bool:
         """株価データキャッシュ設定"""
         try:
-            cache_key = CacheService.get_cache_key("stock_price", code=stock_code, period=period)
-            expires_at = datetime.utcnow() + CacheService.CACHE_DURATIONS["stock_price"]
+            cache_key = CacheService.get_stock_price_cache_key(stock_code, period, interval)
+            expires_at = datetime.utcnow() + CachePolicies.get("stock_price").ttl
             
             # 既存キャッシュエントリの削除
             db.query(StockPriceCache).filter(
@@ -97,6 +138,83 @@ class CacheService:
             db.rollback()
             return False
     
+    @staticmethod
+    def get_stock_price_caches(
+        db: Session,
+        stock_codes: List[str],
+        period: str,
+        include_expired: bool = False
+    ) -> Dict[str, StockPriceResponse]:
+        """
+        株価データキャッシュの一括取得（1回のクエリで複数銘柄）
+        include_expired=True の場合は期限切れのエントリも返す（ヒット率には数えない）
+        """
+        cache_keys = {
+            CacheService.get_stock_price_cache_key(stock_code, period): stock_code
+            for stock_code in stock_codes
+        }
+        
+        query = db.query(StockPriceCache).filter(StockPriceCache.cache_key.in_(list(cache_keys)))
+        if not include_expired:
+            query = query.filter(StockPriceCache.expires_at > datetime.utcnow())
+        cached_entries = query.all()
+        
+        results = {}
+        for cached_entry in cached_entries:
+            try:
+                cache_data = json.loads(cached_entry.price_data)
+                results[cache_keys[cached_entry.cache_key]] = StockPriceResponse(**cache_data)
+            except Exception as e:
+                # パースできないエントリはキャッシュミスとして扱う
+                print(f"Cache parse error: {str(e)}")
+        
+        if not include_expired:
+            CacheService.record_lookup("stock_price", True, len(results))
+            CacheService.record_lookup("stock_price", False, len(cache_keys) - len(results))
+        return results
+    
+    @staticmethod
+    def set_stock_price_caches(
+        db: Session,
+        period: str,
+        data_by_code: Dict[str, StockPriceResponse]
+    ) -> bool:
+        """株価データキャッシュの一括設定（1回のコミット）"""
+        if not data_by_code:
+            return True
+        
+        try:
+            expires_at = datetime.utcnow() + CachePolicies.get("stock_price").ttl
+            cache_keys = {
+                stock_code: CacheService.get_stock_price_cache_key(stock_code, period)
+                for stock_code in data_by_code
+            }
+            
+            # 既存キャッシュエントリの削除
+            db.query(StockPriceCache).filter(
+                StockPriceCache.cache_key.in_(list(cache_keys.values()))
+            ).delete(synchronize_session=False)
+            
+            # 新しいキャッシュエントリ作成
+            db.add_all([
+                StockPriceCache(
+                    cache_key=cache_keys[stock_code],
+                    stock_code=stock_code,
+                    period=period,
+                    price_data=data.model_dump_json(),
+                    expires_at=expires_at
+                )
+                for stock_code, data in data_by_code.items()
+            ])
+            db.commit()
+            
+            return True
+            
+        except Exception as e:
+            print(f"Cache set error: {str(e)}")
+            db.rollback()
+            return False
+    
     @staticmethod
     def get_ai_explanation_cache(
         db: Session,
@@ -117,6 +235,43 @@ class CacheService:
         
         return None
     
+    @staticmethod
+    def upsert_ai_explanation(
+        db: Session,
+        stock_code: str,
+        chart_period: str,
+        explanation: str,
+        technical_data: Optional[Dict[str, Any]],
+        expires_at: datetime
+    ) -> AIExplanation:
+        """
+        AI説明の保存（銘柄・期間ごとに1行、既存の行は内容を置き換える）
+        行のIDは最初の保存時のものを引き継ぐ
+        """
+        statement = insert(AIExplanation).values(
+            stock_code=stock_code,
+            chart_period=chart_period,
+            explanation_text=explanation,
+            technical_data=technical_data,
+            expires_at=expires_at
+        )
+        explanation_id = db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[AIExplanation.stock_code, AIExplanation.chart_period],
+                set_={
+                    "explanation_text": statement.excluded.explanation_text,
+                    "technical_data": statement.excluded.technical_data,
+                    "created_at": func.now(),
+                    "expires_at": statement.excluded.expires_at,
+                }
+            ).returning(AIExplanation.id)
+        ).scalar()
+        db.commit()
+        
+        saved = db.get(AIExplanation, explanation_id)
+        db.refresh(saved)
+        return saved
+    
     @staticmethod
     def set_ai_explanation_cache(
         db: Session,
@@ -127,28 +282,10 @@ class CacheService:
     ) -> bool:
         """AI説明キャッシュ設定"""
         try:
-            expires_at = datetime.utcnow() + CacheService.CACHE_DURATIONS["ai_explanation"]
-            
-            # 既存キャッシュエントリの削除
-            db.query(AIExplanation).filter(
-                and_(
-                    AIExplanation.stock_code == stock_code,
-                    AIExplanation.chart_period == chart_period
-                )
-            ).delete()
-            
-            # 新しいキャッシュエントリ作成
-            cache_entry = AIExplanation(
-                stock_code=stock_code,
-                chart_period=chart_period,
-                explanation_text=explanation,
-                technical_data=technical_data,
-                expires_at=expires_at
+            expires_at = datetime.utcnow() + CachePolicies.get("ai_explanation").ttl
+            CacheService.upsert_ai_explanation(
+                db, stock_code, chart_period, explanation, technical_data, expires_at
             )
-            
-            db.add(cache_entry)
-            db.commit()
-            
             return True
             
         except Exception as e:
@@ -156,25 +293,94 @@ class CacheService:
             db.rollback()
             return False
     
+    @staticmethod
+    def get_technical_indicators_cache(
+        stock_code: str,
+        kind: str,
+        price_data: List[StockPriceData]
+    ) -> Optional[Any]:
+        """テクニカル指標キャッシュ取得"""
+        cache_key = CacheService.get_cache_key(
+            "technical_indicators",
+            code=stock_code,
+            kind=kind,
+            fingerprint=CacheService.get_price_fingerprint(price_data)
+        )
+        
+        with CacheService._memory_lock:
+            cached_entry = CacheService._indicator_cache.get(cache_key)
+            hit = cached_entry is not None and cached_entry[0] > datetime.utcnow()
+            CacheService._cache_metrics["technical_indicators"]["hits" if hit else "misses"] += 1
+        return cached_entry[1] if hit else None
+    
+    @staticmethod
+    def set_technical_indicators_cache(
+        stock_code: str,
+        kind: str,
+        price_data: List[StockPriceData],
+        value: Any
+    ) -> bool:
+        """テクニカル指標キャッシュ設定"""
+        cache_key = CacheService.get_cache_key(
+            "technical_indicators",
+            code=stock_code,
+            kind=kind,
+            fingerprint=CacheService.get_price_fingerprint(price_data)
+        )
+        policy = CachePolicies.get("technical_indicators")
+        expires_at = datetime.utcnow() + policy.ttl
+        
+        with CacheService._memory_lock:
+            # 上限を超える場合は期限切れ→古い順に削除（実行中に上限を下げた場合も上限まで減らす）
+            if len(CacheService._indicator_cache) >= policy.max_entries:
+                CacheService._remove_expired_indicators()
+            while len(CacheService._indicator_cache) >= policy.max_entries:
+                CacheService._indicator_cache.popitem(last=False)
+            
+            CacheService._indicator_cache.pop(cache_key, None)
+            CacheService._indicator_cache[cache_key] = (expires_at, value)
+        return True
+    
+    @staticmethod
+    def _remove_expired_indicators() -> int:
+        """期限切れのテクニカル指標キャッシュを削除（ロック内で呼ぶ）"""
+        current_time = datetime.utcnow()
+        expired_keys = [
+            key for key, (expires_at, _) in CacheService._indicator_cache.items()
+            if expires_at <= current_time
+        ]
+        for key in expired_keys:
+            del CacheService._indicator_cache[key]
+        return len(expired_keys)
+    
+    @staticmethod
+    def _cleanup_indicator_cache() -> int:
+        """期限切れのテクニカル指標キャッシュを削除"""
+        with CacheService._memory_lock:
+            return CacheService._remove_expired_indicators()
+    
     @staticmethod
     def cleanup_expired_caches(db: Session) -> int:
-        """期限切れキャッシュのクリーンアップ"""
+        """期限切れキャッシュのクリーンアップ（ポリシーの猶予期間を過ぎたもの）"""
         try:
             current_time = datetime.utcnow()
             
             # 期限切れ株価キャッシュを削除
             stock_price_deleted = db.query(StockPriceCache).filter(
-                StockPriceCache.expires_at <= current_time
+                StockPriceCache.expires_at <= current_time - CachePolicies.get("stock_price").stale
             ).delete()
             
-            # 期限切れAI説明キャッシュを削除
+            # 期限切れAI説明キャッシュを削除（猶予期間中は延長の候補として残す）
             ai_explanation_deleted = db.query(AIExplanation).filter(
-                AIExplanation.expires_at <= current_time
+                AIExplanation.expires_at <= current_time - CachePolicies.get("ai_explanation").stale
             ).delete()
             
             db.commit()
             
-            total_deleted = stock_price_deleted + ai_explanation_deleted
+            # 期限切れテクニカル指標キャッシュを削除
+            indicator_deleted = CacheService._cleanup_indicator_cache()
+            
+            total_deleted = stock_price_deleted + ai_explanation_deleted + indicator_deleted
             print(f"Cleaned up {total_deleted} expired cache entries")
             
             return total_deleted
@@ -202,6 +408,10 @@ class CacheService:
                 AIExplanation.expires_at > current_time
             ).count()
             
+            metrics = CacheService.get_cache_metrics()
+            with CacheService._memory_lock:
+                indicator_entries = len(CacheService._indicator_cache)
+            
             return {
                 "stock_price_cache": {
                     "total": stock_price_total,
@@ -213,10 +423,17 @@ class CacheService:
                     "valid": ai_explanation_valid,
                     "expired": ai_explanation_total - ai_explanation_valid
                 },
+                "technical_indicators_cache": {
+                    "entries": indicator_entries,
+                    **metrics["technical_indicators"]
+                },
+                # このプロセスでの参照のヒット率（ポリシーの有効期間・件数上限の調整に使う）
+                "lookups": metrics,
                 "cache_hit_rate": {
-                    "stock_price": stock_price_valid / max(stock_price_total, 1),
-                    "ai_explanation": ai_explanation_valid / max(ai_explanation_total, 1)
-                }
+                    name: counts["hits"] / max(counts["hits"] + counts["misses"], 1)
+                    for name, counts in metrics.items()
+                },
+                "policies": {name: policy.model_dump() for name, policy in CachePolicies.all().items()}
             }
             
         except Exception as e:
@@ -263,8 +480,8 @@ class CacheService:
                         # キャッシュが存在しない場合のみ取得
                         cached_data = CacheService.get_stock_price_cache(db, stock_code, period)
                         if not cached_data:
-                            fresh_data = StockService.get_stock_price_data(stock_code, period)
-                            CacheService.set_stock_price_cache(db, stock_code, period, fresh_data)
+                            # 同じ取得期間の履歴はキャッシュを共有するため再取得しない
+                            StockService.get_stock_with_cache(db, stock_code, period)
                             warmed_up_count += 1
                     except Exception as e:
                         print(f"Warm up error for {stock_code} {period}: {str(e)}")
@@ -0,0 +1,165 @@
+"""
+テクニカル状態別のAI解説テンプレート
+トレンド・RSI・MACD・当日の値動きを少数の状態に量子化し、同じ状態の銘柄で
+解説テンプレートを共有する（銘柄コード・価格・前日比のみ差し替える）
+"""
+
+from typing import Dict, List, Optional
+from datetime import datetime
+from sqlalchemy.orm import Session
+from app.models.database import AIExplanationTemplate
+from app.models.stock import StockPriceData, TechnicalIndicators
+from app.core.cache_policy import CachePolicies
+
+
+class ExplanationTemplateService:
+    # テンプレートの有効期間は CachePolicies の ai_template
+
+    # 量子化の閾値
+    TREND_THRESHOLD_PCT = 1.0    # SMA25とSMA75の差（SMA75比、%）
+    RSI_OVERSOLD = 30
+    RSI_OVERBOUGHT = 70
+    MOVE_THRESHOLD_PCT = 1.0     # 前日比（%）
+    LARGE_MOVE_THRESHOLD_PCT = 3.0
+
+    # テンプレート内の差し替え位置
+    PLACEHOLDERS = {"stock": "{stock}", "price": "{price}", "change": "{change}"}
+
+    # プロンプト用の状態の説明
+    STATE_LABELS = {
+        "trend": {
+            "up": "上昇トレンド（短期移動平均線が長期線を上回っている）",
+            "down": "下降トレンド（短期移動平均線が長期線を下回っている）",
+            "flat": "横ばい（短期・長期の移動平均線がほぼ同じ水準）",
+            "unknown": "判定に十分なデータがない",
+        },
+        "rsi": {
+            "overbought": "買われすぎの水準（70以上）",
+            "oversold": "売られすぎの水準（30以下）",
+            "neutral": "適正水準",
+            "unknown": "判定に十分なデータがない",
+        },
+        "momentum": {
+            "positive": "上昇の勢いがある（MACDヒストグラムがプラス）",
+            "negative": "下降の勢いがある（MACDヒストグラムがマイナス）",
+            "unknown": "判定に十分なデータがない",
+        },
+        "move": {
+            "surge": "大きく上昇",
+            "up": "上昇",
+            "flat": "ほぼ変わらず",
+            "down": "下落",
+            "plunge": "大きく下落",
+        },
+    }
+
+    @staticmethod
+    def _change_pct(price_data: List[StockPriceData]) -> float:
+        """前日比（%）"""
+        if len(price_data) < 2 or not price_data[-2].close:
+            return 0.0
+        return (price_data[-1].close - price_data[-2].close) / price_data[-2].close * 100
+
+    @staticmethod
+    def quantize(price_data: List[StockPriceData], indicators: TechnicalIndicators) -> Dict[str, str]:
+        """テクニカル指標を量子化した状態"""
+        service = ExplanationTemplateService
+
+        if indicators.sma_25 is None or indicators.sma_75 is None or not indicators.sma_75:
+            trend = "unknown"
+        else:
+            spread = (indicators.sma_25 - indicators.sma_75) / indicators.sma_75 * 100
+            trend = "up" if spread > service.TREND_THRESHOLD_PCT else "down" if spread < -service.TREND_THRESHOLD_PCT else "flat"
+
+        if indicators.rsi_14 is None:
+            rsi = "unknown"
+        else:
+            rsi = "overbought" if indicators.rsi_14 >= service.RSI_OVERBOUGHT else "oversold" if indicators.rsi_14 <= service.RSI_OVERSOLD else "neutral"
+
+        if indicators.macd_histogram is None:
+            momentum = "unknown"
+        else:
+            momentum = "positive" if indicators.macd_histogram > 0 else "negative"
+
+        change = service._change_pct(price_data)
+        if change >= service.LARGE_MOVE_THRESHOLD_PCT:
+            move = "surge"
+        elif change >= service.MOVE_THRESHOLD_PCT:
+            move = "up"
+        elif change <= -service.LARGE_MOVE_THRESHOLD_PCT:
+            move = "plunge"
+        elif change <= -service.MOVE_THRESHOLD_PCT:
+            move = "down"
+        else:
+            move = "flat"
+
+        return {"trend": trend, "rsi": rsi, "momentum": momentum, "move": move}
+
+    @staticmethod
+    def state_key(period: str, state: Dict[str, str]) -> str:
+        """テンプレートのキー（例: 1M:up:overbought:positive:surge）"""
+        return ":".join([period, state["trend"], state["rsi"], state["momentum"], state["move"]])
+
+    @staticmethod
+    def create_prompt(period: str, state: Dict[str, str]) -> str:
+        """テンプレート生成用のプロンプト（銘柄固有の数値を含めない）"""
+        labels = ExplanationTemplateService.STATE_LABELS
+        placeholders = ExplanationTemplateService.PLACEHOLDERS
+        return f"""
+以下の{period}チャートの状況について、投資初心者の女性向けの解説を作成してください。
+
+【チャートの状況】
+- トレンド: {labels["trend"][state["trend"]]}
+- RSI(14日): {labels["rsi"][state["rsi"]]}
+- MACD: {labels["momentum"][state["momentum"]]}
+- 当日の値動き: {labels["move"][state["move"]]}
+
+【書式】
+- 銘柄名の代わりに {placeholders["stock"]}、現在価格の代わりに {placeholders["price"]}、前日比の代わりに {placeholders["change"]} をそのまま書いてください
+- それ以外の具体的な数値は書かないでください
+
+【分析依頼】
+1. 現在のトレンド状況（上昇・下降・横ばい）
+2. テクニカル指標から読み取れる状況
+3. 初心者向けのやさしいアドバイス
+
+【注意事項】
+- 具体的な売買判断は避けてください
+- やさしく分かりやすい言葉で説明してください
+- 150文字以内でお願いします
+- 最後に「投資判断はご自身でお決めください」を追加してください
+"""
+
+    @staticmethod
+    def render(template_text: str, stock_code: str, price_data: List[StockPriceData]) -> str:
+        """テンプレートに銘柄コード・現在価格・前日比を差し込む"""
+        placeholders = ExplanationTemplateService.PLACEHOLDERS
+        latest = price_data[-1] if price_data else None
+        return (
+            template_text
+            .replace(placeholders["stock"], stock_code)
+            .replace(placeholders["price"], f"{latest.close:,.2f}円" if latest else "-")
+            .replace(placeholders["change"], f"{ExplanationTemplateService._change_pct(price_data):+.2f}%")
+        )
+
+    @staticmethod
+    def get_template(db: Session, state_key: str) -> Optional[str]:
+        """有効なテンプレートを取得"""
+        template = db.query(AIExplanationTemplate).filter(
+            AIExplanationTemplate.state_key == state_key,
+            AIExplanationTemplate.expires_at > datetime.utcnow()
+        ).first()
+        return template.template_text if template else None
+
+    @staticmethod
+    def save_template(db: Session, state_key: str, period: str, state: Dict[str, str], template_text: str):
+        """テンプレートを保存（同じ状態のテンプレートは置き換える）"""
+        db.merge(AIExplanationTemplate(
+            state_key=state_key,
+            chart_period=period,
+            technical_state=state,
+            template_text=template_text,
+            created_at=datetime.utcnow(),
+            expires_at=datetime.utcnow() + CachePolicies.get("ai_template").ttl
+        ))
+        db.commit()
@@ -0,0 +1,321 @@
+"""
+テクニカル指標計算サービス
+NumPyのベクトル化カーネルで指標の時系列を計算する
+
+各カーネルは最後の軸を時間軸として扱うため、1銘柄の1次元配列でも
+複数銘柄を並べた2次元配列でも同じように計算できる。
+計算できない位置（期間不足など）はNaNで返す。
+"""
+
+from typing import Dict, List, Optional
+import numpy as np
+from app.models.stock import StockPriceData, TechnicalIndicators
+
+# EMAをブロック単位で計算する際のブロック長（減衰係数の累乗が桁あふれしないように分割）
+EMA_BLOCK_SIZE = 128
+
+# 一目均衡表の先行・遅行スパンのずらし幅（当日を含めて26本目 = 25本ずらす）
+ICHIMOKU_DISPLACEMENT = 26
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """単純移動平均（累積和の差分で計算）"""
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(values.shape, np.nan)
+    if values.shape[-1] < window:
+        return result
+
+    valid = ~np.isnan(values)
+    padding = np.zeros(values.shape[:-1] + (1,))
+    cumsum = np.concatenate([padding, np.cumsum(np.where(valid, values, 0.0), axis=-1)], axis=-1)
+    counts = np.concatenate([padding, np.cumsum(valid, axis=-1)], axis=-1)
+
+    window_sums = cumsum[..., window:] - cumsum[..., :-window]
+    window_counts = counts[..., window:] - counts[..., :-window]
+    result[..., window - 1:] = np.where(window_counts == window, window_sums / window, np.nan)
+    return result
+
+
+def rolling_std(values: np.ndarray, window: int) -> np.ndarray:
+    """移動標準偏差（母標準偏差、銘柄ごとに平均を引いてから累積和で計算）"""
+    values = np.asarray(values, dtype=np.float64)
+    # 有効な値のみの平均（有効な値がない銘柄は0、空配列でも警告を出さない）
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=-1, keepdims=True)
+    offset = np.where(valid, values, 0.0).sum(axis=-1, keepdims=True) / np.maximum(counts, 1)
+    centered = values - offset
+    mean = rolling_mean(centered, window)
+    mean_of_squares = rolling_mean(centered * centered, window)
+    return np.sqrt(np.maximum(mean_of_squares - mean * mean, 0.0))
+
+
+def _rolling_extreme(values: np.ndarray, window: int, reducer: np.ufunc) -> np.ndarray:
+    """移動最大・最小値（van Herk/Gil-Werman法: 窓幅によらずO(n)）
+
+    窓幅ごとのブロック内で前方・後方の累積値を求め、
+    各窓を「前のブロックの後方累積」と「次のブロックの前方累積」の2値から求める。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(values.shape, np.nan)
+    length = values.shape[-1]
+    if length < window:
+        return result
+
+    blocks = -(-length // window)
+    padding = np.repeat(values[..., -1:], blocks * window - length, axis=-1)
+    blocked = np.concatenate([values, padding], axis=-1).reshape(values.shape[:-1] + (blocks, window))
+
+    forward = reducer.accumulate(blocked, axis=-1).reshape(values.shape[:-1] + (-1,))
+    backward = reducer.accumulate(blocked[..., ::-1], axis=-1)[..., ::-1].reshape(values.shape[:-1] + (-1,))
+    result[..., window - 1:] = reducer(backward[..., :length - window + 1], forward[..., window - 1:length])
+    return result
+
+
+def rolling_max(values: np.ndarray, window: int) -> np.ndarray:
+    """移動最大値（窓内にNaNを含む位置はNaN）"""
+    return _rolling_extreme(values, window, np.maximum)
+
+
+def rolling_min(values: np.ndarray, window: int) -> np.ndarray:
+    """移動最小値（窓内にNaNを含む位置はNaN）"""
+    return _rolling_extreme(values, window, np.minimum)
+
+
+def shift(values: np.ndarray, periods: int) -> np.ndarray:
+    """時間軸方向にずらす（正の値で未来側へ、空いた位置はNaN）"""
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(values.shape, np.nan)
+    if periods == 0:
+        result[...] = values
+    elif abs(periods) < values.shape[-1]:
+        if periods > 0:
+            result[..., periods:] = values[..., :-periods]
+        else:
+            result[..., :periods] = values[..., -periods:]
+    return result
+
+
+def _decayed_cumsum(values: np.ndarray, decay: float) -> np.ndarray:
+    """y[t] = x[t] + decay * y[t-1] をブロック単位でベクトル計算"""
+    result = np.empty_like(values)
+    carry = np.zeros(values.shape[:-1])
+    length = values.shape[-1]
+
+    for start in range(0, length, EMA_BLOCK_SIZE):
+        block = values[..., start:start + EMA_BLOCK_SIZE]
+        powers = decay ** np.arange(block.shape[-1])
+        # y[s+k] = decay^k * (decay * carry + Σ_{j<=k} x[s+j] / decay^j)
+        scaled = np.cumsum(block / powers, axis=-1) + decay * carry[..., None]
+        result[..., start:start + block.shape[-1]] = powers * scaled
+        carry = result[..., start + block.shape[-1] - 1]
+
+    return result
+
+
+def ema(values: np.ndarray, span: Optional[int] = None, alpha: Optional[float] = None) -> np.ndarray:
+    """指数移動平均（pandasの ewm(adjust=True).mean() と同じ定義）
+
+    先頭のNaN（銘柄ごとのデータ長の違いによる埋め草）は無視して計算する。
+    """
+    if alpha is None:
+        alpha = 2.0 / (span + 1.0)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    counts = np.cumsum(valid, axis=-1)
+
+    decay = 1.0 - alpha
+    if decay <= 0.0:
+        return np.where(counts > 0, values, np.nan)
+
+    numerator = _decayed_cumsum(filled, decay)
+    denominator = (1.0 - decay ** counts) / alpha
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(counts > 0, numerator / denominator, np.nan)
+
+
+def rsi(close: np.ndarray, period: int = 14) -> np.ndarray:
+    """RSI（値上がり幅・値下がり幅の単純平均による計算）"""
+    close = np.asarray(close, dtype=np.float64)
+    delta = np.diff(close, axis=-1, prepend=np.nan)
+    missing = np.isnan(close)
+    gain = np.where(missing, np.nan, np.where(delta > 0, delta, 0.0))
+    loss = np.where(missing, np.nan, np.where(delta < 0, -delta, 0.0))
+
+    average_gain = rolling_mean(gain, period)
+    average_loss = rolling_mean(loss, period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rs = average_gain / average_loss
+        return 100.0 - 100.0 / (1.0 + rs)
+
+
+def macd(close: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9) -> Dict[str, np.ndarray]:
+    """MACD（MACD線・シグナル線・ヒストグラム）"""
+    close = np.asarray(close, dtype=np.float64)
+    macd_line = ema(close, span=fast) - ema(close, span=slow)
+    signal_line = ema(macd_line, span=signal)
+    return {
+        "macd_line": macd_line,
+        "macd_signal": signal_line,
+        "macd_histogram": macd_line - signal_line,
+    }
+
+
+def bollinger_bands(close: np.ndarray, window: int = 20, num_std: float = 2.0) -> Dict[str, np.ndarray]:
+    """ボリンジャーバンド（中心線 ± num_std σ）"""
+    middle = rolling_mean(close, window)
+    deviation = num_std * rolling_std(close, window)
+    return {
+        "bb_upper": middle + deviation,
+        "bb_middle": middle,
+        "bb_lower": middle - deviation,
+    }
+
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = 14) -> np.ndarray:
+    """ATR（真の値幅をワイルダーの平滑化 α=1/period で平均）"""
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    previous_close = shift(close, 1)
+    # 前日終値がない先頭の足は高値-安値（fmaxはNaNを無視する）
+    true_range = np.fmax(high - low, np.fmax(np.abs(high - previous_close), np.abs(low - previous_close)))
+
+    result = ema(true_range, alpha=1.0 / period)
+    counts = np.cumsum(~np.isnan(true_range), axis=-1)
+    return np.where(counts >= period, result, np.nan)
+
+
+def stochastics(
+    high: np.ndarray,
+    low: np.ndarray,
+    close: np.ndarray,
+    k_period: int = 14,
+    d_period: int = 3,
+    slow_period: int = 3
+) -> Dict[str, np.ndarray]:
+    """ストキャスティクス（%K・%D・スロー%D）"""
+    lowest = rolling_min(low, k_period)
+    highest = rolling_max(high, k_period)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percent_k = np.where(highest > lowest, (close - lowest) / (highest - lowest) * 100.0, np.nan)
+    percent_d = rolling_mean(percent_k, d_period)
+    return {
+        "stoch_k": percent_k,
+        "stoch_d": percent_d,
+        "stoch_slow_d": rolling_mean(percent_d, slow_period),
+    }
+
+
+def ichimoku(
+    high: np.ndarray,
+    low: np.ndarray,
+    close: np.ndarray,
+    conversion: int = 9,
+    base: int = 26,
+    leading: int = 52
+) -> Dict[str, np.ndarray]:
+    """一目均衡表（各足の位置にそろえた値。先行スパンは当日の雲の位置）"""
+    offset = ICHIMOKU_DISPLACEMENT - 1
+    tenkan = (rolling_max(high, conversion) + rolling_min(low, conversion)) / 2.0
+    kijun = (rolling_max(high, base) + rolling_min(low, base)) / 2.0
+    senkou_b = (rolling_max(high, leading) + rolling_min(low, leading)) / 2.0
+    return {
+        "ichimoku_tenkan": tenkan,
+        "ichimoku_kijun": kijun,
+        "ichimoku_senkou_a": shift((tenkan + kijun) / 2.0, offset),
+        "ichimoku_senkou_b": shift(senkou_b, offset),
+        "ichimoku_chikou": shift(close, -offset),
+    }
+
+
+def deviation_rate(close: np.ndarray, window: int = 25) -> np.ndarray:
+    """移動平均乖離率（%）"""
+    average = rolling_mean(close, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (np.asarray(close, dtype=np.float64) - average) / average * 100.0
+
+
+class IndicatorService:
+    # 系列レスポンスの小数点以下桁数
+    SERIES_DECIMALS = 4
+
+    @staticmethod
+    def to_arrays(price_data: List[StockPriceData]) -> Dict[str, np.ndarray]:
+        """株価データを列ごとのNumPy配列に変換"""
+        count = len(price_data)
+        return {
+            "high": np.fromiter((bar.high for bar in price_data), dtype=np.float64, count=count),
+            "low": np.fromiter((bar.low for bar in price_data), dtype=np.float64, count=count),
+            "close": np.fromiter((bar.close for bar in price_data), dtype=np.float64, count=count),
+            "volume": np.fromiter((bar.volume or 0 for bar in price_data), dtype=np.float64, count=count),
+        }
+
+    @staticmethod
+    def stack_arrays(columns_list: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+        """複数銘柄の列を右詰め（最新足をそろえる）の2次元配列にまとめる
+
+        データ長が短い銘柄の先頭はNaNで埋める（各カーネルは先頭のNaNを無視する）。
+        """
+        if not columns_list:
+            return {}
+        length = max(columns["close"].shape[-1] for columns in columns_list)
+        stacked = {}
+        for name in columns_list[0]:
+            matrix = np.full((len(columns_list), length), np.nan)
+            for row, columns in enumerate(columns_list):
+                values = columns[name]
+                if values.shape[-1]:
+                    matrix[row, length - values.shape[-1]:] = values
+            stacked[name] = matrix
+        return stacked
+
+    @staticmethod
+    def calculate_series(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """全指標の時系列を計算（キーは TechnicalIndicators のフィールド名）"""
+        high, low, close = columns["high"], columns["low"], columns["close"]
+        series = {
+            "sma_25": rolling_mean(close, 25),
+            "sma_75": rolling_mean(close, 75),
+            "rsi_14": rsi(close, 14),
+        }
+        series.update(macd(close))
+        series["volume_sma_25"] = rolling_mean(columns["volume"], 25)
+        series.update(bollinger_bands(close))
+        series["atr_14"] = atr(high, low, close, 14)
+        series.update(stochastics(high, low, close))
+        series.update(ichimoku(high, low, close))
+        series["deviation_rate_25"] = deviation_rate(close, 25)
+        return series
+
+    @staticmethod
+    def latest(series: Dict[str, np.ndarray]) -> TechnicalIndicators:
+        """各指標系列の最新値を TechnicalIndicators に変換"""
+        values = {}
+        for name, values_array in series.items():
+            if name not in TechnicalIndicators.model_fields or values_array.shape[-1] == 0:
+                continue
+            value = float(values_array[-1])
+            values[name] = None if np.isnan(value) else value
+        return TechnicalIndicators(**values)
+
+    @staticmethod
+    def latest_batch(series: Dict[str, np.ndarray]) -> List[TechnicalIndicators]:
+        """2次元の指標系列から銘柄ごとの最新値を取り出す"""
+        latest_columns = {
+            name: values[:, -1]
+            for name, values in series.items()
+            if name in TechnicalIndicators.model_fields and values.shape[-1]
+        }
+        if not latest_columns:
+            return []
+        rows = next(iter(latest_columns.values())).shape[0]
+        return [
+            IndicatorService.latest({name: values[row:row + 1] for name, values in latest_columns.items()})
+            for row in range(rows)
+        ]
+
+    @staticmethod
+    def to_json_list(values: np.ndarray) -> List[Optional[float]]:
+        """NaNをNoneに置き換えたJSON向けリストに変換"""
+        rounded = np.round(values, IndicatorService.SERIES_DECIMALS)
+        return np.where(np.isnan(rounded), None, rounded).tolist()
@@ -0,0 +1,285 @@
+"""
+AI解説の生成ジョブキュー
+利用枠の上限に達しても429を返さずにジョブとして受け付け、ワーカーが優先度順に
+分間リクエスト上限のペースで生成する（クライアントはジョブIDで完了を確認する）
+
+- 同じ（銘柄, 期間）の未完了ジョブは1件にまとめる（まとめたリクエスト数を優先度に反映）
+- ジョブはデータベースに保存し、FOR UPDATE SKIP LOCKED で複数ワーカーから重複なく取り出す
+- 処理中に停止したジョブは一定時間後にキューへ戻す
+"""
+
+from typing import Optional
+from datetime import datetime, timedelta
+import asyncio
+import time
+import uuid
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from app.core.database import SessionLocal
+from app.models.ai import AIExplanationResponse, AIJobResponse
+from app.models.database import AIExplanation, AIExplanationJob
+from app.services.stock_service import StockService
+
+
+class AIJobService:
+    # 再試行（利用枠による待機は回数に含めない）
+    MAX_ATTEMPTS = 3
+    RETRY_DELAY_SECONDS = 10  # 試行回数に比例して延長
+
+    # 処理中のまま停止したジョブをキューへ戻すまでの時間と、完了したジョブの保持期間
+    RUNNING_TIMEOUT = timedelta(minutes=5)
+    JOB_RETENTION = timedelta(days=1)
+
+    # ワーカーの待機間隔（秒）
+    IDLE_POLL_SECONDS = 1.0
+    MAINTENANCE_INTERVAL_SECONDS = 600
+
+    # ジョブ完了の待機（ロングポーリング）
+    MAX_WAIT_SECONDS = 30
+    WAIT_POLL_SECONDS = 0.5
+
+    # 登録（同じ銘柄・期間の未完了ジョブがあればまとめる）
+    ENQUEUE_SQL = text("""
+        INSERT INTO ai_explanation_jobs AS job
+            (id, stock_code, chart_period, user_id, status, priority, request_count, attempts, created_at, available_at)
+        VALUES (:id, :stock_code, :chart_period, :user_id, 'queued', :priority, 1, 0, :now, :now)
+        ON CONFLICT (stock_code, chart_period) WHERE status IN ('queued', 'running') DO UPDATE SET
+            request_count = job.request_count + 1,
+            priority = GREATEST(job.priority, EXCLUDED.priority)
+        RETURNING job.id
+    """).bindparams(
+        bindparam("id", type_=PG_UUID(as_uuid=True)), bindparam("user_id", type_=PG_UUID(as_uuid=True))
+    ).columns(id=PG_UUID(as_uuid=True))
+
+    # 優先度の高いジョブを1件取り出す（他ワーカーが取り出し中の行は飛ばす）
+    CLAIM_SQL = text("""
+        UPDATE ai_explanation_jobs AS job
+        SET status = 'running', started_at = :now, attempts = job.attempts + 1
+        WHERE job.id = (
+            SELECT id FROM ai_explanation_jobs
+            WHERE status = 'queued' AND available_at <= :now
+            ORDER BY priority DESC, request_count DESC, created_at
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING job.id, job.stock_code, job.chart_period, job.user_id, job.attempts
+    """).columns(id=PG_UUID(as_uuid=True), user_id=PG_UUID(as_uuid=True))
+
+    # 処理中のまま停止したジョブをキューへ戻す
+    RECOVER_SQL = text("""
+        UPDATE ai_explanation_jobs
+        SET status = 'queued', available_at = :now
+        WHERE status = 'running' AND started_at < :cutoff
+    """)
+
+    @staticmethod
+    def enqueue(
+        db: Session,
+        stock_code: str,
+        period: str,
+        user_id: Optional[uuid.UUID],
+        priority: int = 0
+    ) -> uuid.UUID:
+        """ジョブを登録してジョブIDを返す（未完了の同じジョブがあればそのID）"""
+        try:
+            job_id = db.execute(AIJobService.ENQUEUE_SQL, {
+                "id": uuid.uuid4(),
+                "stock_code": stock_code,
+                "chart_period": period,
+                "user_id": user_id,
+                "priority": priority,
+                "now": datetime.utcnow(),
+            }).scalar()
+            db.commit()
+            return job_id
+        except Exception:
+            db.rollback()
+            raise
+
+    @staticmethod
+    def get_job(db: Session, job_id: uuid.UUID) -> Optional[AIExplanationJob]:
+        """ジョブ取得"""
+        return db.query(AIExplanationJob).filter(AIExplanationJob.id == job_id).first()
+
+    @staticmethod
+    def to_response(db: Session, job: AIExplanationJob) -> AIJobResponse:
+        """ジョブの状態（完了時は解説を含む）"""
+        explanation = None
+        if job.explanation_id:
+            saved = db.query(AIExplanation).filter(AIExplanation.id == job.explanation_id).first()
+            if saved:
+                explanation = AIExplanationResponse.model_validate(saved)
+        return AIJobResponse(
+            job_id=job.id,
+            status=job.status,
+            stock_code=job.stock_code,
+            chart_period=job.chart_period,
+            explanation=explanation,
+            error=job.error,
+            created_at=job.created_at
+        )
+
+    @staticmethod
+    def load_response(db: Session, job_id: uuid.UUID) -> Optional[AIJobResponse]:
+        """ジョブの状態（ジョブがなければ None）"""
+        job = AIJobService.get_job(db, job_id)
+        return AIJobService.to_response(db, job) if job else None
+
+    @staticmethod
+    async def wait_for_job(job_id: uuid.UUID, wait_seconds: float) -> Optional[AIJobResponse]:
+        """
+        ジョブが完了するか待機時間が過ぎるまで待って状態を返す
+        待機中に接続を保持しないよう、確認ごとに専用セッションを開いてスレッドで参照する
+        """
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + min(wait_seconds, AIJobService.MAX_WAIT_SECONDS)
+        while True:
+            response = await loop.run_in_executor(
+                None, AIJobService._with_session, AIJobService.load_response, job_id
+            )
+            if response is None or response.status in ("done", "failed") or time.monotonic() >= deadline:
+                return response
+            await asyncio.sleep(AIJobService.WAIT_POLL_SECONDS)
+
+    @staticmethod
+    def claim(db: Session):
+        """次に処理するジョブを取り出す（なければ None）"""
+        try:
+            job = db.execute(AIJobService.CLAIM_SQL, {"now": datetime.utcnow()}).first()
+            db.commit()
+            return job
+        except Exception as e:
+            print(f"AI job claim error: {str(e)}")
+            db.rollback()
+            return None
+
+    @staticmethod
+    def _finish(db: Session, job_id: uuid.UUID, values: dict):
+        """ジョブの状態を更新"""
+        try:
+            db.query(AIExplanationJob).filter(AIExplanationJob.id == job_id).update(
+                values, synchronize_session=False
+            )
+            db.commit()
+        except Exception as e:
+            print(f"AI job update error: {str(e)}")
+            db.rollback()
+
+    @staticmethod
+    def complete(db: Session, job_id: uuid.UUID, explanation_id: uuid.UUID):
+        """生成完了"""
+        AIJobService._finish(db, job_id, {
+            "status": "done", "explanation_id": explanation_id, "error": None, "finished_at": datetime.utcnow()
+        })
+
+    @staticmethod
+    def fail(db: Session, job_id: uuid.UUID, error: str):
+        """生成失敗（再試行しない）"""
+        AIJobService._finish(db, job_id, {"status": "failed", "error": error, "finished_at": datetime.utcnow()})
+
+    @staticmethod
+    def retry(db: Session, job_id: uuid.UUID, delay_seconds: float, count_attempt: bool = True):
+        """キューへ戻して delay_seconds 後に再度取り出す（利用枠による待機は試行回数に含めない）"""
+        values = {"status": "queued", "available_at": datetime.utcnow() + timedelta(seconds=delay_seconds)}
+        if not count_attempt:
+            values["attempts"] = AIExplanationJob.attempts - 1
+        AIJobService._finish(db, job_id, values)
+
+    @staticmethod
+    def run_maintenance(db: Session):
+        """停止したジョブをキューへ戻し、保持期間を過ぎた完了ジョブを削除"""
+        now = datetime.utcnow()
+        try:
+            db.execute(AIJobService.RECOVER_SQL, {"now": now, "cutoff": now - AIJobService.RUNNING_TIMEOUT})
+            db.query(AIExplanationJob).filter(
+                AIExplanationJob.status.in_(["done", "failed"]),
+                AIExplanationJob.finished_at < now - AIJobService.JOB_RETENTION
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            print(f"AI job maintenance error: {str(e)}")
+            db.rollback()
+
+    @staticmethod
+    def _with_session(func, *args):
+        """専用セッションで実行"""
+        db = SessionLocal()
+        try:
+            return func(db, *args)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _seconds_until_next_minute() -> float:
+        """分間の利用枠が補充されるまでの秒数"""
+        now = datetime.utcnow()
+        return 60 - now.second - now.microsecond / 1_000_000
+
+    @staticmethod
+    async def process(ai_service, job):
+        """ジョブ1件の生成（キャッシュ・同時生成の共有・利用枠は通常の生成と同じ）"""
+        loop = asyncio.get_running_loop()
+        db = SessionLocal()
+        try:
+            price_data = await loop.run_in_executor(
+                None, StockService.get_stock_with_cache, db, job.stock_code, job.chart_period
+            )
+            indicators = price_data.indicators or StockService.get_technical_indicators_with_cache(
+                job.stock_code, price_data.data
+            )
+            explanation = await ai_service.generate_explanation(
+                db, job.user_id, job.stock_code, job.chart_period, price_data.data, indicators
+            )
+            AIJobService.complete(db, job.id, explanation.id)
+        except HTTPException as e:
+            if e.status_code == status.HTTP_429_TOO_MANY_REQUESTS and e.detail != "Daily user limit exceeded":
+                # 他のリクエストと利用枠を取り合った場合は、次の枠の補充後に再度処理する
+                AIJobService.retry(db, job.id, AIJobService._seconds_until_next_minute(), count_attempt=False)
+            elif e.status_code == status.HTTP_429_TOO_MANY_REQUESTS or job.attempts >= AIJobService.MAX_ATTEMPTS:
+                AIJobService.fail(db, job.id, str(e.detail))
+            else:
+                AIJobService.retry(db, job.id, AIJobService.RETRY_DELAY_SECONDS * job.attempts)
+        except Exception as e:
+            print(f"AI job error for {job.stock_code} ({job.chart_period}): {str(e)}")
+            if job.attempts >= AIJobService.MAX_ATTEMPTS:
+                AIJobService.fail(db, job.id, str(e))
+            else:
+                AIJobService.retry(db, job.id, AIJobService.RETRY_DELAY_SECONDS * job.attempts)
+        finally:
+            db.close()
+
+    @staticmethod
+    async def run_worker(ai_service):
+        """
+        ジョブを処理するバックグラウンドタスク
+        分間リクエスト上限を均等に割った間隔でジョブを開始し、利用枠がない間は補充まで待つ
+        """
+        loop = asyncio.get_running_loop()
+        interval = 60 / max(ai_service.rate_limiter.minute_requests.capacity, 1)
+        tasks = set()
+        last_maintenance = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_maintenance >= AIJobService.MAINTENANCE_INTERVAL_SECONDS:
+                    await loop.run_in_executor(None, AIJobService._with_session, AIJobService.run_maintenance)
+                    last_maintenance = time.monotonic()
+
+                reason, _ = ai_service.rate_limiter.check(None, ai_service.token_estimator.typical())
+                if reason:
+                    await asyncio.sleep(AIJobService._seconds_until_next_minute())
+                    continue
+
+                job = await loop.run_in_executor(None, AIJobService._with_session, AIJobService.claim)
+                if job is None:
+                    await asyncio.sleep(AIJobService.IDLE_POLL_SECONDS)
+                    continue
+
+                task = asyncio.create_task(AIJobService.process(ai_service, job))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                await asyncio.sleep(interval)
+            except Exception as e:
+                print(f"AI job worker error: {str(e)}")
+                await asyncio.sleep(AIJobService.IDLE_POLL_SECONDS)
@@ -0,0 +1,212 @@
+"""
+AI解説生成に使うLLMクライアント
+Gemini SDK の GenerativeModel と同じ generate_content(prompt, stream=False) を持つクライアントを
+LLM_BACKEND で切り替える（gemini / stub / http）
+
+- gemini: Gemini API（GEMINI_API_KEY が必要）
+- stub:   プロセス内のスタンドイン（遅延・トークン数・エラー率を設定可能、負荷試験・開発用）
+- http:   scripts/gemini_stub_server.py など Gemini REST API 互換のサーバー（LLM_STUB_URL）
+"""
+
+from typing import Iterator, List, Optional, Tuple
+import json
+import os
+import random
+import re
+import time
+import httpx
+import google.generativeai as genai
+
+
+class UsageMetadata:
+    """Gemini のレスポンスの usage_metadata に相当"""
+
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class LLMChunk:
+    """ストリーミング時の途中の文章"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class LLMResponse:
+    """
+    Gemini のレスポンスに相当（text と usage_metadata）
+    ストリーミング時は反復で LLMChunk を返し、反復の完了後に text と usage_metadata が揃う
+    """
+
+    def __init__(self, chunks: Iterator[Tuple[str, Optional[UsageMetadata]]]):
+        self._chunks = chunks
+        self._texts: List[str] = []
+        self.usage_metadata: Optional[UsageMetadata] = None
+
+    def __iter__(self) -> Iterator[LLMChunk]:
+        for text, usage_metadata in self._chunks:
+            if usage_metadata is not None:
+                self.usage_metadata = usage_metadata
+            if text:
+                self._texts.append(text)
+                yield LLMChunk(text)
+
+    @property
+    def text(self) -> str:
+        return "".join(self._texts)
+
+    @classmethod
+    def resolved(cls, chunks: Iterator[Tuple[str, Optional[UsageMetadata]]]) -> "LLMResponse":
+        """全チャンクを読み込んだレスポンス（ストリーミングしない呼び出し用）"""
+        response = cls(chunks)
+        for _ in response:
+            pass
+        return response
+
+
+class LLMStubError(RuntimeError):
+    """スタンドインが設定したエラー率で返すエラー"""
+
+
+class StubLLMClient:
+    """
+    Gemini のスタンドイン
+    プロンプトの形式（単一銘柄・複数銘柄のJSON・状態別テンプレート）に合わせた定型文を返す
+    """
+
+    STREAM_CHUNKS = 5
+
+    def __init__(
+        self,
+        latency_seconds: float = 0.0,
+        latency_jitter_seconds: float = 0.0,
+        output_tokens: int = 200,
+        error_rate: float = 0.0,
+        chars_per_token: float = 1.5,
+        seed: Optional[int] = None
+    ):
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.chars_per_token = chars_per_token
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_env(cls) -> "StubLLMClient":
+        """環境変数の設定で作成"""
+        return cls(
+            latency_seconds=float(os.getenv("LLM_STUB_LATENCY_MS", "0")) / 1000,
+            latency_jitter_seconds=float(os.getenv("LLM_STUB_LATENCY_JITTER_MS", "0")) / 1000,
+            output_tokens=int(os.getenv("LLM_STUB_OUTPUT_TOKENS", "200")),
+            error_rate=float(os.getenv("LLM_STUB_ERROR_RATE", "0")),
+        )
+
+    def sample_latency(self) -> float:
+        """1回の呼び出しの遅延（秒）"""
+        jitter = self._random.uniform(-self.latency_jitter_seconds, self.latency_jitter_seconds)
+        return max(self.latency_seconds + jitter, 0.0)
+
+    def should_fail(self) -> bool:
+        """エラー率に従って失敗させるか"""
+        return self._random.random() < self.error_rate
+
+    @staticmethod
+    def create_text(prompt: str) -> str:
+        """プロンプトの形式に合わせた定型文"""
+        sections = re.findall(r"### 解説(\d+)", prompt)
+        if sections and "【出力形式】" in prompt:
+            return json.dumps([
+                {"id": int(number), "explanation": f"解説{number}の銘柄は落ち着いた値動きです。投資判断はご自身でお決めください"}
+                for number in sections
+            ], ensure_ascii=False)
+        if "{stock}" in prompt:
+            return "{stock}は現在{price}（前日比{change}）です。落ち着いた値動きが続いています。投資判断はご自身でお決めください"
+        return "現在のチャートは落ち着いた値動きです。移動平均線やRSIを確認しながら、無理のない範囲で見守りましょう。投資判断はご自身でお決めください"
+
+    def create_usage(self, prompt: str) -> UsageMetadata:
+        """プロンプトの長さと設定した出力トークン数から使用トークン数を作成"""
+        return UsageMetadata(int(len(prompt) / self.chars_per_token), self.output_tokens)
+
+    def split_text(self, text: str) -> List[str]:
+        """ストリーミング用に文章を分割"""
+        size = max(-(-len(text) // self.STREAM_CHUNKS), 1)
+        return [text[start:start + size] for start in range(0, len(text), size)]
+
+    def _chunks(self, prompt: str, latency: float) -> Iterator[Tuple[str, Optional[UsageMetadata]]]:
+        """遅延をチャンクに分けて文章を返す"""
+        parts = self.split_text(self.create_text(prompt))
+        for index, part in enumerate(parts):
+            time.sleep(latency / len(parts))
+            yield part, self.create_usage(prompt) if index == len(parts) - 1 else None
+
+    def generate_content(self, prompt: str, stream: bool = False) -> LLMResponse:
+        """Gemini の generate_content と同じ呼び出し方"""
+        latency = self.sample_latency()
+        if self.should_fail():
+            time.sleep(latency)
+            raise LLMStubError("Simulated LLM error")
+        chunks = self._chunks(prompt, latency)
+        return LLMResponse(chunks) if stream else LLMResponse.resolved(chunks)
+
+
+class HTTPLLMClient:
+    """Gemini REST API 互換のサーバー（generateContent / streamGenerateContent）のクライアント"""
+
+    def __init__(self, base_url: str, model: str, timeout: float = 60.0):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self._client = httpx.Client(timeout=timeout)
+
+    @staticmethod
+    def _parse(payload: dict) -> Tuple[str, Optional[UsageMetadata]]:
+        """REST API のレスポンスから文章と使用トークン数を取得"""
+        candidates = payload.get("candidates") or [{}]
+        parts = candidates[0].get("content", {}).get("parts", [])
+        usage = payload.get("usageMetadata")
+        usage_metadata = UsageMetadata(
+            usage.get("promptTokenCount", 0), usage.get("candidatesTokenCount", 0)
+        ) if usage else None
+        return "".join(part.get("text", "") for part in parts), usage_metadata
+
+    def _stream(self, body: dict) -> Iterator[Tuple[str, Optional[UsageMetadata]]]:
+        """Server-Sent Events で返されるチャンクを順に読む"""
+        url = f"{self.base_url}/v1beta/models/{self.model}:streamGenerateContent"
+        with self._client.stream("POST", url, params={"alt": "sse"}, json=body) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line.startswith("data:"):
+                    yield self._parse(json.loads(line[len("data:"):]))
+
+    def generate_content(self, prompt: str, stream: bool = False) -> LLMResponse:
+        """Gemini の generate_content と同じ呼び出し方"""
+        body = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+        if stream:
+            return LLMResponse(self._stream(body))
+
+        response = self._client.post(f"{self.base_url}/v1beta/models/{self.model}:generateContent", json=body)
+        response.raise_for_status()
+        return LLMResponse.resolved(iter([self._parse(response.json())]))
+
+
+def create_llm_client(model_name: str):
+    """
+    LLM_BACKEND に応じたクライアントを作成（(バックエンド名, クライアント) を返す）
+    未指定時は GEMINI_API_KEY があれば gemini、なければ stub
+    """
+    api_key = os.getenv("GEMINI_API_KEY")
+    has_api_key = bool(api_key) and api_key != "your_gemini_api_key_here"
+    backend = os.getenv("LLM_BACKEND", "gemini" if has_api_key else "stub").lower()
+
+    if backend == "gemini":
+        if not has_api_key:
+            raise ValueError("GEMINI_API_KEY is required for LLM_BACKEND=gemini")
+        genai.configure(api_key=api_key)
+        return backend, genai.GenerativeModel(model_name)
+    if backend == "http":
+        return backend, HTTPLLMClient(os.getenv("LLM_STUB_URL", "http://localhost:8090"), model_name)
+    if backend == "stub":
+        return backend, StubLLMClient.from_env()
+    raise ValueError(f"Unknown LLM_BACKEND: {backend}")
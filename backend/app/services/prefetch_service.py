@@ -0,0 +1,217 @@
+"""
+AI解説の事前生成サービス
+解説の需要を（銘柄, 期間）ごとに集計し、大引け後に需要の高い組み合わせの解説を
+日次利用枠の一部を使って生成する（次の取引開始までキャッシュとして有効）
+"""
+
+from typing import Dict, List, Tuple
+from collections import Counter
+from datetime import datetime, date, time, timedelta
+from zoneinfo import ZoneInfo
+import asyncio
+import os
+import threading
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from sqlalchemy import func, text
+from app.core.database import SessionLocal, try_advisory_lock, release_advisory_lock
+from app.models.database import AIExplanation, AIExplanationDemand
+from app.services.stock_service import StockService
+
+
+class PrefetchService:
+    # 東証の取引時間（祝日は考慮しない）
+    MARKET_TIMEZONE = ZoneInfo("Asia/Tokyo")
+    MARKET_OPEN = time(9, 0)
+    PREFETCH_START = time(16, 0)  # 大引け（15:30）後に開始
+
+    # 事前生成に使う日次利用枠の割合と、1分あたりの生成数（残りはユーザーのリクエスト用）
+    BUDGET_SHARE = float(os.getenv("AI_PREFETCH_BUDGET_SHARE", "0.3"))
+    REQUESTS_PER_MINUTE = 10
+
+    # 需要の集計期間と保持期間
+    DEMAND_LOOKBACK_DAYS = 7
+    DEMAND_RETENTION_DAYS = 30
+
+    RECORD_DEMAND_SQL = text("""
+        INSERT INTO ai_explanation_demand AS demand (stock_code, chart_period, demand_date, request_count)
+        SELECT * FROM unnest(
+            CAST(:stock_codes AS varchar[]), CAST(:chart_periods AS varchar[]),
+            CAST(:demand_dates AS date[]), CAST(:request_counts AS integer[])
+        )
+        ON CONFLICT (stock_code, chart_period, demand_date) DO UPDATE SET
+            request_count = demand.request_count + EXCLUDED.request_count
+    """)
+
+    # 未記録の需要（キー: (銘柄コード, 期間, 日付)）
+    _demand: Counter = Counter()
+    _demand_lock = threading.Lock()
+
+    @staticmethod
+    def record_demand(stock_code: str, period: str):
+        """解説リクエストを需要として記録（DBへの書き込みは使用量と一緒にバックグラウンド）"""
+        with PrefetchService._demand_lock:
+            PrefetchService._demand[(stock_code, period, date.today())] += 1
+
+    @staticmethod
+    def flush_demand(db: Session) -> int:
+        """未記録の需要をデータベースに加算"""
+        with PrefetchService._demand_lock:
+            pending, PrefetchService._demand = PrefetchService._demand, Counter()
+        if not pending:
+            return 0
+
+        try:
+            db.execute(PrefetchService.RECORD_DEMAND_SQL, {
+                "stock_codes": [stock_code for stock_code, _, _ in pending],
+                "chart_periods": [period for _, period, _ in pending],
+                "demand_dates": [demand_date for _, _, demand_date in pending],
+                "request_counts": list(pending.values()),
+            })
+            db.commit()
+            return len(pending)
+        except Exception as e:
+            print(f"Demand flush error: {str(e)}")
+            db.rollback()
+            with PrefetchService._demand_lock:
+                PrefetchService._demand.update(pending)
+            return 0
+
+    @staticmethod
+    def _next_market_time(now: datetime, at: time) -> datetime:
+        """now（UTC）より後の平日の指定時刻（東京時間）をUTCで返す"""
+        local = now.replace(tzinfo=ZoneInfo("UTC")).astimezone(PrefetchService.MARKET_TIMEZONE)
+        candidate = datetime.combine(local.date(), at, tzinfo=PrefetchService.MARKET_TIMEZONE)
+        while candidate <= local or candidate.weekday() >= 5:
+            candidate = datetime.combine(candidate.date() + timedelta(days=1), at, tzinfo=PrefetchService.MARKET_TIMEZONE)
+        return candidate.astimezone(ZoneInfo("UTC")).replace(tzinfo=None)
+
+    @staticmethod
+    def next_market_open(now: datetime) -> datetime:
+        """次の取引開始時刻（UTC）"""
+        return PrefetchService._next_market_time(now, PrefetchService.MARKET_OPEN)
+
+    @staticmethod
+    def next_prefetch_time(now: datetime) -> datetime:
+        """次の事前生成開始時刻（UTC）"""
+        return PrefetchService._next_market_time(now, PrefetchService.PREFETCH_START)
+
+    @staticmethod
+    def get_targets(db: Session, limit: int, valid_until: datetime) -> List[Tuple[str, str]]:
+        """需要の高い順に、valid_until まで有効な解説がない（銘柄, 期間）を返す"""
+        since = date.today() - timedelta(days=PrefetchService.DEMAND_LOOKBACK_DAYS)
+        demand = db.query(
+            AIExplanationDemand.stock_code,
+            AIExplanationDemand.chart_period,
+            func.sum(AIExplanationDemand.request_count).label("requests")
+        ).filter(
+            AIExplanationDemand.demand_date >= since
+        ).group_by(
+            AIExplanationDemand.stock_code, AIExplanationDemand.chart_period
+        ).order_by(
+            func.sum(AIExplanationDemand.request_count).desc()
+        ).limit(limit * 2).all()
+
+        covered = set(db.query(AIExplanation.stock_code, AIExplanation.chart_period).filter(
+            AIExplanation.expires_at >= valid_until
+        ).distinct().all())
+
+        return [
+            (row.stock_code, row.chart_period) for row in demand
+            if (row.stock_code, row.chart_period) not in covered
+        ][:limit]
+
+    @staticmethod
+    async def run_prefetch(ai_service) -> Dict[str, int]:
+        """需要の高い解説を事前生成（全ワーカーのうち1つだけが実行）"""
+        loop = asyncio.get_running_loop()
+        db = SessionLocal()
+        acquired, connection = await loop.run_in_executor(
+            None, try_advisory_lock, db.get_bind(), "ai_explanation_prefetch"
+        )
+        if not acquired:
+            db.close()
+            return {}
+
+        stats = {"generated": 0, "failed": 0}
+        try:
+            await loop.run_in_executor(None, PrefetchService.flush_demand, db)
+            db.query(AIExplanationDemand).filter(
+                AIExplanationDemand.demand_date < date.today() - timedelta(days=PrefetchService.DEMAND_RETENTION_DAYS)
+            ).delete(synchronize_session=False)
+            db.commit()
+
+            # 複数銘柄をまとめて生成する場合は1リクエストで PACK_SIZE 件を生成できる
+            chunk_size = ai_service.PACK_SIZE if ai_service.PACKING_ENABLED and not ai_service.STATE_CACHE_ENABLED else 1
+            budget = int(ai_service.APP_LIMITS["DAILY_REQUESTS"] * PrefetchService.BUDGET_SHARE) // ai_service.rate_limiter.workers
+            valid_until = PrefetchService.next_market_open(datetime.utcnow())
+            targets = PrefetchService.get_targets(db, budget * chunk_size, valid_until)
+            print(f"AI prefetch started: {len(targets)} targets (budget {budget} requests)")
+
+            for start in range(0, len(targets), chunk_size):
+                jobs = []
+                for stock_code, period in targets[start:start + chunk_size]:
+                    try:
+                        price_data = await loop.run_in_executor(
+                            None, StockService.get_stock_with_cache, db, stock_code, period
+                        )
+                        indicators = price_data.indicators or StockService.get_technical_indicators_with_cache(
+                            stock_code, price_data.data
+                        )
+                        jobs.append({
+                            "user_id": None,
+                            "stock_code": stock_code,
+                            "period": period,
+                            "price_data": price_data.data,
+                            "indicators": indicators,
+                            "expires_at": valid_until
+                        })
+                    except Exception as e:
+                        print(f"AI prefetch error for {stock_code} ({period}): {str(e)}")
+                        stats["failed"] += 1
+
+                if chunk_size > 1:
+                    results = await ai_service.create_packed_explanations(db, jobs) if jobs else []
+                else:
+                    results = []
+                    for job in jobs:
+                        try:
+                            results.append(await ai_service.prefetch_explanation(
+                                db, job["stock_code"], job["period"], job["price_data"], job["indicators"], valid_until
+                            ))
+                        except Exception as e:
+                            results.append(e)
+
+                daily_limit_reached = False
+                for job, result in zip(jobs, results):
+                    if not isinstance(result, Exception):
+                        stats["generated"] += 1
+                        continue
+                    # 日次の利用枠に達した場合は終了、分間の枠は次の周期で再開
+                    if isinstance(result, HTTPException) and result.status_code == 429 and "Daily" in str(result.detail):
+                        daily_limit_reached = True
+                    else:
+                        print(f"AI prefetch error for {job['stock_code']} ({job['period']}): {str(result)}")
+                    stats["failed"] += 1
+                if daily_limit_reached:
+                    break
+
+                # 分間の利用枠をユーザーのリクエストと分け合うためのペース配分
+                await asyncio.sleep(60 / PrefetchService.REQUESTS_PER_MINUTE)
+
+            print(f"AI prefetch finished: {stats}")
+            return stats
+        finally:
+            await loop.run_in_executor(None, release_advisory_lock, connection, "ai_explanation_prefetch")
+            db.close()
+
+    @staticmethod
+    async def run_prefetch_loop(ai_service):
+        """平日の大引け後に事前生成を実行するバックグラウンドタスク"""
+        while True:
+            now = datetime.utcnow()
+            await asyncio.sleep((PrefetchService.next_prefetch_time(now) - now).total_seconds())
+            try:
+                await PrefetchService.run_prefetch(ai_service)
+            except Exception as e:
+                print(f"AI prefetch loop error: {str(e)}")
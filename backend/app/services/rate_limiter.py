@@ -0,0 +1,266 @@
+"""
+Gemini APIの利用枠を管理するレート制限
+日次リクエストの枠・分間リクエストと分間トークンのスライディングウィンドウ・ユーザー別の日次回数をメモリ上で管理し、
+使用量の記録はキューに積んでバックグラウンドでデータベースに書き込む
+"""
+
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from collections import deque
+from datetime import datetime, date
+import os
+import threading
+import time
+import uuid
+
+
+class QuotaBucket:
+    """暦日単位の上限カウンタ（日付が変わると容量まで戻る）"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.window_key: Optional[str] = None
+        self.used = 0
+
+    def refill(self, window_key: str):
+        """時間枠が変わっていれば補充"""
+        if window_key != self.window_key:
+            self.window_key = window_key
+            self.used = 0
+
+    def available(self) -> int:
+        return max(self.capacity - self.used, 0)
+
+
+class SlidingWindow:
+    """
+    直近 window_seconds 秒間の使用量で判定するスライディングウィンドウ
+    予約ごとの時刻を保持し、window_seconds 秒経過した分から順に枠に戻す
+    """
+
+    def __init__(self, capacity: int, window_seconds: float = 60.0):
+        self.capacity = capacity
+        self.window_seconds = window_seconds
+        self.used = 0
+        # 予約ごとの [時刻, 使用量]（古い順）
+        self._entries: Deque[List] = deque()
+
+    def expire(self, now: float):
+        """window_seconds 秒以上前の予約を枠に戻す"""
+        while self._entries and self._entries[0][0] <= now - self.window_seconds:
+            self.used -= self._entries.popleft()[1]
+
+    def available(self) -> int:
+        return max(self.capacity - self.used, 0)
+
+    def add(self, amount: int, now: float):
+        """使用量を現在時刻で予約"""
+        if amount <= 0:
+            return
+        self._entries.append([now, amount])
+        self.used += amount
+
+    def correct(self, reserved: int, actual: int):
+        """
+        予約した使用量を実際の値に置き換え（同じ量の予約のうち最も新しいものを対象とする）
+        予約がすでにウィンドウ外であれば補正しない
+        """
+        for entry in reversed(self._entries):
+            if entry[1] == reserved:
+                actual = max(actual, 0)
+                self.used += actual - entry[1]
+                entry[1] = actual
+                return
+
+
+class RateLimiter:
+    """
+    利用枠の判定と予約を1つのロック内で行うレート制限
+
+    分間の枠は直近60秒間の予約の合計で判定するため、どの60秒間でも上限を超えて許可しない。
+    日次の枠は暦日単位で、日付が変わると戻る。
+    ワーカープロセスごとに保持するため、全体の上限はワーカー数で分割する。
+    ユーザー別の日次回数は分割せず、データベースの回数（全ワーカーの書き込み済み分）に
+    このプロセスの未書き込み分を加えて反映する。データベースの読み込みは、単一ワーカーではユーザーごとに
+    1日1回、複数ワーカーでは user_refresh_seconds 秒ごと（needs_user_refresh）に限る。
+    """
+
+    def __init__(
+        self,
+        daily_requests: int,
+        minute_requests: int,
+        minute_tokens: int,
+        user_daily_limit: int,
+        workers: Optional[int] = None,
+        user_refresh_seconds: float = 5.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        workers = max(workers or int(os.getenv("RATE_LIMIT_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))), 1)
+        self.workers = workers
+        self.daily_requests = QuotaBucket(daily_requests // workers)
+        self.minute_requests = SlidingWindow(minute_requests // workers)
+        self.minute_tokens = SlidingWindow(minute_tokens // workers)
+        self.user_daily_limit = user_daily_limit
+        self.user_refresh_seconds = user_refresh_seconds
+        self._clock = clock
+
+        self._user_usage_date: Optional[date] = None
+        self._user_usage: Dict[uuid.UUID, int] = {}
+        # ユーザー別の回数をデータベースから読み込んだ時刻
+        self._user_loaded_at: Dict[uuid.UUID, float] = {}
+        # このプロセスで予約し、まだデータベースに書き込んでいないユーザー別の回数
+        self._user_unflushed: Dict[uuid.UUID, int] = {}
+        # 記録待ちの使用量（日付, 分キー, ユーザーID, Gemini リクエスト数, 推定トークン, 実トークン）
+        self._pending: List[Tuple[date, str, Optional[uuid.UUID], int, int, int]] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _window_keys() -> Tuple[date, str]:
+        """日次（ローカル日付）と分次（UTC、minute_api_usage.minute_keyと同じ形式）の時間枠"""
+        return date.today(), datetime.utcnow().strftime("%Y-%m-%d_%H:%M")
+
+    def _refill(self, today: date):
+        """日付の切り替えと分間の枠の経過を反映（ロック内で呼ぶ）"""
+        now = self._clock()
+        self.daily_requests.refill(today.isoformat())
+        self.minute_requests.expire(now)
+        self.minute_tokens.expire(now)
+        if self._user_usage_date != today:
+            self._user_usage_date = today
+            self._user_usage = {}
+            self._user_unflushed = {}
+            self._user_loaded_at = {}
+
+    def seed(self, daily_requests: int, minute_requests: int, minute_tokens: int):
+        """
+        起動時にデータベースの使用量を反映（再起動で枠がリセットされないようにする）
+        現在の分の使用量は時刻がわからないため、起動時刻の予約として60秒間保持する
+        """
+        today, _ = self._window_keys()
+        with self._lock:
+            self._refill(today)
+            now = self._clock()
+            self.daily_requests.used = max(self.daily_requests.used, daily_requests // self.workers)
+            self.minute_requests.add(minute_requests // self.workers - self.minute_requests.used, now)
+            self.minute_tokens.add(minute_tokens // self.workers - self.minute_tokens.used, now)
+
+    def needs_user_refresh(self, user_id: uuid.UUID) -> bool:
+        """
+        ユーザーの本日の使用回数をデータベースから読み込み直す必要があるか
+        単一ワーカーでは本日初回のみ、複数ワーカーでは他ワーカーの書き込み分を取り込むため
+        前回の読み込みから user_refresh_seconds 秒経過した場合
+        """
+        today, _ = self._window_keys()
+        with self._lock:
+            self._refill(today)
+            loaded_at = self._user_loaded_at.get(user_id)
+            if loaded_at is None:
+                return True
+            return self.workers > 1 and self._clock() - loaded_at >= self.user_refresh_seconds
+
+    def seed_user(self, user_id: uuid.UUID, request_count: int):
+        """ユーザーの本日の使用回数を反映（データベースの回数 + このプロセスの未書き込み分）"""
+        today, _ = self._window_keys()
+        with self._lock:
+            self._refill(today)
+            self._user_usage[user_id] = request_count + self._user_unflushed.get(user_id, 0)
+            self._user_loaded_at[user_id] = self._clock()
+
+    def _reserve_user(self, user_id: uuid.UUID):
+        """ユーザーの日次回数を1回予約（ロック内で呼ぶ）"""
+        self._user_usage[user_id] = self._user_usage.get(user_id, 0) + 1
+        self._user_unflushed[user_id] = self._user_unflushed.get(user_id, 0) + 1
+
+    def _rejection_reason(self, user_id: Optional[uuid.UUID], estimated_tokens: int) -> Optional[str]:
+        """上限超過の理由（ロック内で呼ぶ）。user_id が None のシステム処理はユーザー制限の対象外"""
+        if self.daily_requests.available() < 1:
+            return "Daily request limit exceeded"
+        if self.minute_requests.available() < 1:
+            return "Rate limit exceeded, please try again later"
+        if self.minute_tokens.available() < estimated_tokens:
+            return "Token rate limit exceeded"
+        if user_id is not None and self._user_usage.get(user_id, 0) >= self.user_daily_limit:
+            return "Daily user limit exceeded"
+        return None
+
+    def check(self, user_id: uuid.UUID, estimated_tokens: int) -> Tuple[Optional[str], int]:
+        """利用可否の確認のみ（予約しない）。（拒否理由, ユーザーの残り回数）を返す"""
+        today, _ = self._window_keys()
+        with self._lock:
+            self._refill(today)
+            reason = self._rejection_reason(user_id, estimated_tokens)
+            return reason, self.user_daily_limit - self._user_usage.get(user_id, 0)
+
+    def try_acquire(self, user_id: Optional[uuid.UUID], estimated_tokens: int) -> Tuple[Optional[str], int]:
+        """利用可能なら全バケットから同時に予約。（拒否理由, 予約後のユーザー残り回数）を返す"""
+        today, _ = self._window_keys()
+        with self._lock:
+            self._refill(today)
+            reason = self._rejection_reason(user_id, estimated_tokens)
+            if reason:
+                return reason, 0
+            now = self._clock()
+            self.daily_requests.used += 1
+            self.minute_requests.add(1, now)
+            self.minute_tokens.add(estimated_tokens, now)
+            if user_id is None:
+                return None, 0
+            self._reserve_user(user_id)
+            return None, self.user_daily_limit - self._user_usage[user_id]
+
+    def try_acquire_user(self, user_id: uuid.UUID) -> Optional[str]:
+        """ユーザーの日次回数のみ予約（複数銘柄をまとめた生成で、全体の枠は別途予約する）"""
+        today, _ = self._window_keys()
+        with self._lock:
+            self._refill(today)
+            if self._user_usage.get(user_id, 0) >= self.user_daily_limit:
+                return "Daily user limit exceeded"
+            self._reserve_user(user_id)
+            return None
+
+    def release_user(self, user_id: Optional[uuid.UUID]):
+        """生成に失敗した場合にユーザーの予約を戻す（全体の枠はAPIに到達した可能性があるため戻さない）"""
+        with self._lock:
+            if self._user_usage.get(user_id, 0) > 0:
+                self._user_usage[user_id] -= 1
+            if self._user_unflushed.get(user_id, 0) > 0:
+                self._user_unflushed[user_id] -= 1
+
+    def record(
+        self,
+        user_id: Optional[uuid.UUID],
+        reserved_tokens: int,
+        actual_tokens: int,
+        requests: int = 1,
+        estimated_tokens: Optional[int] = None
+    ):
+        """
+        予約したトークン数を実際のトークン数で補正し、使用量を記録キューに追加
+        requests は Gemini へのリクエスト数（複数銘柄をまとめた生成では2件目以降を0にする）
+        estimated_tokens は記録する見積もり（省略時は予約したトークン数）
+        """
+        today, minute_key = self._window_keys()
+        with self._lock:
+            self.minute_tokens.expire(self._clock())
+            self.minute_tokens.correct(reserved_tokens, actual_tokens)
+            self._pending.append((
+                today, minute_key, user_id, requests,
+                reserved_tokens if estimated_tokens is None else estimated_tokens, actual_tokens
+            ))
+
+    def drain(self) -> List[Tuple[date, str, Optional[uuid.UUID], int, int, int]]:
+        """記録待ちの使用量を取り出す"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            return pending
+
+    def confirm_flushed(self, events: List[Tuple[date, str, Optional[uuid.UUID], int, int, int]]):
+        """データベースへの書き込みが完了した使用量を未書き込み分から除く"""
+        with self._lock:
+            for event_date, _, user_id, _, _, _ in events:
+                if user_id is not None and event_date == self._user_usage_date and self._user_unflushed.get(user_id, 0) > 0:
+                    self._user_unflushed[user_id] -= 1
+
+    def requeue(self, events: List[Tuple[date, str, Optional[uuid.UUID], int, int, int]]):
+        """書き込みに失敗した使用量をキューに戻す"""
+        with self._lock:
+            self._pending[:0] = events
@@ -0,0 +1,134 @@
+"""
+チャートデータ変換サービス
+日足から週足・月足へのリサンプリングと、表示点数を抑えるダウンサンプリングを
+NumPyでベクトル計算する
+"""
+
+from typing import Dict, List
+import numpy as np
+from app.models.stock import StockPriceData, StockPriceResponse
+
+
+class ResampleService:
+    # 対応する足種（yfinanceの表記に合わせる）
+    INTERVALS = ("1d", "1wk", "1mo")
+
+    # ダウンサンプリング方式（ohlc: 区間ごとにローソク足を集約、lttb: 形状を保つ足を選択）
+    DOWNSAMPLE_METHODS = ("ohlc", "lttb")
+
+    @staticmethod
+    def to_columns(price_data: List[StockPriceData]) -> Dict[str, np.ndarray]:
+        """株価データを列ごとの配列に変換（日付を含む）"""
+        count = len(price_data)
+        return {
+            "time": np.array([bar.time for bar in price_data], dtype="datetime64[D]"),
+            "open": np.fromiter((bar.open for bar in price_data), dtype=np.float64, count=count),
+            "high": np.fromiter((bar.high for bar in price_data), dtype=np.float64, count=count),
+            "low": np.fromiter((bar.low for bar in price_data), dtype=np.float64, count=count),
+            "close": np.fromiter((bar.close for bar in price_data), dtype=np.float64, count=count),
+            "volume": np.fromiter((bar.volume or 0 for bar in price_data), dtype=np.int64, count=count),
+        }
+
+    @staticmethod
+    def aggregate_ohlc(columns: Dict[str, np.ndarray], starts: np.ndarray) -> Dict[str, np.ndarray]:
+        """区間の開始位置ごとにOHLCVを集約（始値は先頭、終値は末尾、高安は最大・最小、出来高は合計）"""
+        ends = np.append(starts[1:], columns["close"].shape[-1]) - 1
+        return {
+            "time": columns["time"][starts],
+            "open": columns["open"][starts],
+            "high": np.maximum.reduceat(columns["high"], starts),
+            "low": np.minimum.reduceat(columns["low"], starts),
+            "close": columns["close"][ends],
+            "volume": np.add.reduceat(columns["volume"], starts),
+        }
+
+    @staticmethod
+    def from_columns(columns: Dict[str, np.ndarray]) -> List[StockPriceData]:
+        """列ごとの配列を株価データに戻す"""
+        return [
+            StockPriceData(time=time, open=open_, high=high, low=low, close=close, volume=volume)
+            for time, open_, high, low, close, volume in zip(
+                np.datetime_as_string(columns["time"], unit="D").tolist(),
+                np.round(columns["open"], 2).tolist(),
+                np.round(columns["high"], 2).tolist(),
+                np.round(columns["low"], 2).tolist(),
+                np.round(columns["close"], 2).tolist(),
+                columns["volume"].tolist()
+            )
+        ]
+
+    @staticmethod
+    def resample(price_response: StockPriceResponse, interval: str) -> StockPriceResponse:
+        """日足を週足（月曜始まり）・月足に変換"""
+        if interval == "1d" or not price_response.data:
+            return price_response
+
+        columns = ResampleService.to_columns(price_response.data)
+        days = columns["time"].astype(np.int64)
+        if interval == "1wk":
+            # 1970-01-01は木曜日のため、3日ずらして月曜始まりの週番号にする
+            group_ids = (days + 3) // 7
+        elif interval == "1mo":
+            group_ids = columns["time"].astype("datetime64[M]").astype(np.int64)
+        else:
+            raise ValueError(f"Unsupported interval: {interval}")
+
+        starts = np.flatnonzero(np.diff(group_ids, prepend=group_ids[0] - 1))
+        return price_response.model_copy(update={
+            "data": ResampleService.from_columns(ResampleService.aggregate_ohlc(columns, starts)),
+            "interval": interval
+        })
+
+    @staticmethod
+    def lttb_indices(values: np.ndarray, threshold: int) -> np.ndarray:
+        """Largest-Triangle-Three-Buckets で残す点の位置を選ぶ（x軸は足の並び順）"""
+        length = values.shape[-1]
+        if threshold >= length or threshold < 3:
+            return np.arange(length)
+
+        # 先頭・末尾を除いた点を threshold - 2 個のバケットに分割
+        edges = np.floor(np.linspace(1, length - 1, threshold - 1)).astype(np.int64)
+        selected = np.empty(threshold, dtype=np.int64)
+        selected[0] = 0
+        selected[-1] = length - 1
+
+        previous = 0
+        positions = np.arange(length, dtype=np.float64)
+        for bucket in range(threshold - 2):
+            start, end = edges[bucket], edges[bucket + 1]
+            # 次のバケットの平均点（最後のバケットは末尾の点）
+            next_start = end
+            next_end = edges[bucket + 2] if bucket + 2 < len(edges) else length
+            average_x = positions[next_start:next_end].mean()
+            average_y = values[next_start:next_end].mean()
+
+            # 直前に選んだ点・次バケットの平均点と作る三角形の面積が最大の点を選ぶ
+            areas = np.abs(
+                (positions[previous] - average_x) * (values[start:end] - values[previous])
+                - (positions[previous] - positions[start:end]) * (average_y - values[previous])
+            )
+            previous = start + int(np.argmax(areas))
+            selected[bucket + 1] = previous
+
+        return selected
+
+    @staticmethod
+    def downsample(price_response: StockPriceResponse, max_points: int, method: str = "ohlc") -> StockPriceResponse:
+        """表示点数を max_points 以下に削減"""
+        length = len(price_response.data)
+        if max_points <= 0 or length <= max_points:
+            return price_response
+
+        if method == "lttb":
+            closes = np.fromiter((bar.close for bar in price_response.data), dtype=np.float64, count=length)
+            indices = ResampleService.lttb_indices(closes, max_points).tolist()
+            data = [price_response.data[index] for index in indices]
+        elif method == "ohlc":
+            # 均等な区間に分け、各区間を1本のローソク足に集約（高値・安値を失わない）
+            starts = np.unique(np.floor(np.arange(max_points) * length / max_points).astype(np.int64))
+            columns = ResampleService.to_columns(price_response.data)
+            data = ResampleService.from_columns(ResampleService.aggregate_ohlc(columns, starts))
+        else:
+            raise ValueError(f"Unsupported downsample method: {method}")
+
+        return price_response.model_copy(update={"data": data})
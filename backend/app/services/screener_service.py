@@ -0,0 +1,223 @@
+"""
+銘柄スクリーニングサービス
+全銘柄の最新テクニカル指標をメモリ上の行列に保持し、条件で絞り込む
+
+行列の更新はバックグラウンドのバッチ（run_refresh_loop）で行い、検索時は株価データを取得しない。
+株価のダウンロードはアドバイザリロックを取得した1ワーカーのみが行い、
+他のワーカーは株価キャッシュ（stock_price_cache）から行列を作る。
+"""
+
+from typing import Dict, Optional, Any
+from datetime import datetime
+import asyncio
+import threading
+import numpy as np
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal, try_advisory_lock, release_advisory_lock
+from app.models.database import Stock
+from app.models.stock import ScreenerCondition, ScreenerResult, ScreenerResponse
+from app.services.indicator_service import IndicatorService
+from app.services.stock_service import StockService
+from app.services.cache_service import CacheService
+
+
+class ScreenerService:
+    # 指標計算に使う表示期間（6ヶ月分の履歴を1W/1M/3Mとキャッシュ共有）
+    SCREENING_PERIOD = "3M"
+
+    # 一括取得の1回あたりの銘柄数
+    REFRESH_CHUNK_SIZE = 200
+
+    # 行列の更新間隔（秒）。ダウンロードは株価キャッシュの有効期間に合わせ、
+    # キャッシュからの作成は1クエリ/チャンクで済むため短い間隔でダウンロード側の更新に追従する
+    REFRESH_INTERVAL_SECONDS = 1800
+    CACHE_RELOAD_INTERVAL_SECONDS = 300
+    RETRY_INTERVAL_SECONDS = 60
+    # 起動直後の更新の待ち時間（起動処理やリクエストとダウンロードが重ならないようにする）
+    INITIAL_DELAY_SECONDS = 120
+
+    # 最新の指標行列（更新時に丸ごと差し替える）
+    _snapshot: Optional[Dict[str, Any]] = None
+    _refresh_lock = threading.Lock()
+
+    @staticmethod
+    def refresh(db: Session) -> Optional[int]:
+        """全銘柄の指標行列を再計算（他の更新が実行中なら何もせず None を返す）"""
+        if not ScreenerService._refresh_lock.acquire(blocking=False):
+            return None
+        try:
+            return ScreenerService._refresh(db)
+        finally:
+            ScreenerService._refresh_lock.release()
+
+    @staticmethod
+    def _refresh(db: Session) -> int:
+        """
+        全銘柄の指標行列を再計算
+        ロックを取得したワーカーは不足分をダウンロードしてキャッシュに保存し、
+        他のワーカーはキャッシュのみから作成する（キャッシュが空なら行列を差し替えない）
+        """
+        stocks = db.query(Stock).filter(Stock.is_active == True).order_by(Stock.code).all()
+        if not stocks:
+            stocks = StockService.get_popular_stocks(db, len(StockService.POPULAR_STOCKS))
+        all_codes = [stock.code for stock in stocks]
+
+        acquired, connection = try_advisory_lock(db.get_bind(), "screener_refresh")
+        try:
+            histories = ScreenerService._load_histories(db, all_codes, download=acquired)
+        finally:
+            release_advisory_lock(connection, "screener_refresh")
+
+        # 取得できなかった銘柄はフォールバックデータ（実在しない値）で条件に合わないよう除く
+        stocks = [stock for stock in stocks if stock.code in histories]
+        codes = [stock.code for stock in stocks]
+        if not codes and not acquired:
+            print("Screener refresh skipped: stock price cache is not ready")
+            return 0
+
+        columns = IndicatorService.stack_arrays([
+            IndicatorService.to_arrays(histories[code].data) for code in codes
+        ])
+        ScreenerService._snapshot = {
+            "codes": codes,
+            "names": [stock.name for stock in stocks],
+            "sectors": [stock.sector for stock in stocks],
+            "columns": ScreenerService._build_columns(columns) if codes else {},
+            "refreshed_at": datetime.utcnow(),
+            "downloaded": acquired,
+        }
+
+        print(f"Screener refreshed: {len(codes)} of {len(all_codes)} stocks ({'download' if acquired else 'cache'})")
+        return len(codes)
+
+    @staticmethod
+    def _load_histories(db: Session, codes: list, download: bool) -> Dict[str, Any]:
+        """
+        指標計算用の株価履歴をチャンク単位で取得
+        download=False の場合はキャッシュのみ（ダウンロード側の更新間隔より古いものも使う）
+        """
+        histories = {}
+        yf_period = StockService.HISTORY_PERIODS.get(ScreenerService.SCREENING_PERIOD, "6mo")
+        for start in range(0, len(codes), ScreenerService.REFRESH_CHUNK_SIZE):
+            chunk = codes[start:start + ScreenerService.REFRESH_CHUNK_SIZE]
+            if download:
+                histories.update(StockService.get_stock_histories_bulk(
+                    db, chunk, ScreenerService.SCREENING_PERIOD, fallback=False
+                ))
+            else:
+                histories.update(CacheService.get_stock_price_caches(db, chunk, yf_period, include_expired=True))
+        return histories
+
+    @staticmethod
+    def refresh_with_session() -> Optional[int]:
+        """専用セッションで行列を更新"""
+        db = SessionLocal()
+        try:
+            return ScreenerService.refresh(db)
+        finally:
+            db.close()
+
+    @staticmethod
+    async def run_refresh_loop():
+        """起動の INITIAL_DELAY_SECONDS 秒後から一定間隔で行列を更新するバックグラウンドタスク（更新はスレッドで実行）"""
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(ScreenerService.INITIAL_DELAY_SECONDS)
+        while True:
+            try:
+                await loop.run_in_executor(None, ScreenerService.refresh_with_session)
+                snapshot = ScreenerService._snapshot
+                if snapshot is None:
+                    interval = ScreenerService.RETRY_INTERVAL_SECONDS
+                elif snapshot["downloaded"]:
+                    interval = ScreenerService.REFRESH_INTERVAL_SECONDS
+                else:
+                    interval = ScreenerService.CACHE_RELOAD_INTERVAL_SECONDS
+            except Exception as e:
+                print(f"Screener refresh error: {str(e)}")
+                interval = ScreenerService.RETRY_INTERVAL_SECONDS
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    def _build_columns(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """指標系列から検索用の最新値の列を作成"""
+        series = IndicatorService.calculate_series(columns)
+        latest = {name: values[:, -1] for name, values in series.items()}
+
+        close = columns["close"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            latest["close"] = close[:, -1]
+            latest["change_pct"] = (close[:, -1] / close[:, -2] - 1.0) * 100.0 if close.shape[-1] >= 2 else np.full(close.shape[0], np.nan)
+            latest["volume_ratio"] = columns["volume"][:, -1] / series["volume_sma_25"][:, -1]
+
+        # ゴールデンクロス・デッドクロス（SMA25がSMA75を上抜け・下抜け）からの経過日数
+        above = series["sma_25"] > series["sma_75"]
+        comparable = ~np.isnan(series["sma_25"]) & ~np.isnan(series["sma_75"])
+        previous_comparable = np.zeros_like(comparable)
+        previous_comparable[:, 1:] = comparable[:, :-1]
+        previous_above = np.zeros_like(above)
+        previous_above[:, 1:] = above[:, :-1]
+        both = comparable & previous_comparable
+        latest["days_since_golden_cross"] = ScreenerService._days_since(both & above & ~previous_above)
+        latest["days_since_dead_cross"] = ScreenerService._days_since(both & ~above & previous_above)
+        return latest
+
+    @staticmethod
+    def _days_since(events: np.ndarray) -> np.ndarray:
+        """各行の最後のイベントからの経過本数（イベントなしはNaN）"""
+        length = events.shape[-1]
+        last_from_end = np.argmax(events[:, ::-1], axis=-1).astype(np.float64)
+        return np.where(events.any(axis=-1), last_from_end, np.nan) if length else np.full(events.shape[0], np.nan)
+
+    @staticmethod
+    def screen(db: Session, condition: ScreenerCondition) -> ScreenerResponse:
+        """条件に合う銘柄を検索（最初の更新が終わるまでは 503）"""
+        snapshot = ScreenerService._snapshot
+        if snapshot is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Screener is being prepared, please try again later"
+            )
+        columns = snapshot["columns"]
+
+        mask = np.ones(len(snapshot["codes"]), dtype=bool)
+        with np.errstate(invalid="ignore"):
+            if condition.rsi_below is not None:
+                mask &= columns["rsi_14"] < condition.rsi_below
+            if condition.rsi_above is not None:
+                mask &= columns["rsi_14"] > condition.rsi_above
+            if condition.golden_cross_within is not None:
+                mask &= columns["days_since_golden_cross"] <= condition.golden_cross_within
+            if condition.dead_cross_within is not None:
+                mask &= columns["days_since_dead_cross"] <= condition.dead_cross_within
+            if condition.volume_ratio_above is not None:
+                mask &= columns["volume_ratio"] > condition.volume_ratio_above
+            if condition.deviation_rate_below is not None:
+                mask &= columns["deviation_rate_25"] < condition.deviation_rate_below
+            if condition.deviation_rate_above is not None:
+                mask &= columns["deviation_rate_25"] > condition.deviation_rate_above
+        if condition.sector is not None:
+            mask &= np.array([sector == condition.sector for sector in snapshot["sectors"]], dtype=bool)
+
+        matched = np.flatnonzero(mask)
+        return ScreenerResponse(
+            total_count=len(snapshot["codes"]),
+            matched_count=len(matched),
+            results=[ScreenerService._to_result(snapshot, index) for index in matched[:condition.limit]],
+            refreshed_at=snapshot["refreshed_at"]
+        )
+
+    @staticmethod
+    def _to_result(snapshot: Dict[str, Any], index: int) -> ScreenerResult:
+        """行列の1行を検索結果に変換"""
+        values = {}
+        for name in ScreenerResult.model_fields:
+            if name in snapshot["columns"]:
+                value = float(snapshot["columns"][name][index])
+                values[name] = None if np.isnan(value) else value
+        return ScreenerResult(
+            code=snapshot["codes"][index],
+            name=snapshot["names"][index],
+            sector=snapshot["sectors"][index],
+            **values
+        )
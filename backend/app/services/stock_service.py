@@ -1,10 +1,11 @@
 import yfinance as yf
 import pandas as pd
-from typing import List, Optional
+from typing import List, Optional, Dict
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from app.models.database import Stock, StockPriceCache
-from app.models.stock import StockPriceData, StockPriceResponse, TechnicalIndicators
+from app.models.stock import StockPriceData, StockPriceResponse, TechnicalIndicators, TechnicalIndicatorSeriesResponse
+from app.services.indicator_service import IndicatorService
 import json
 
 class StockService:
@@ -32,6 +33,25 @@ class StockService:
         {"code": "8802", "name": "三菱地所", "sector": "不動産業"}
     ]
     
+    # 期間マッピング（テクニカル指標計算のため十分なデータを確保）
+    # 90日では営業日が約60本しかなくSMA75日が計算できないため、短期も6ヶ月分を取得する
+    HISTORY_PERIODS = {
+        "1W": "6mo",   # 1週間でも過去データを含めて6ヶ月分
+        "1M": "6mo",   # 1ヶ月で6ヶ月分
+        "3M": "6mo",   # 3ヶ月で6ヶ月分
+        "6M": "1y",    # 6ヶ月で1年分
+        "1Y": "2y"     # 1年で2年分
+    }
+    
+    # 表示期間ごとの本数（直近から絞り込み）
+    DISPLAY_BARS = {
+        "1W": 7,
+        "1M": 30,
+        "3M": 90,
+        "6M": 180,
+        "1Y": 365
+    }
+    
     @staticmethod
     def search_stocks(query: str, limit: int = 10) -> List[Stock]:
         """銘柄検索（データベース+静的リスト）"""
@@ -178,18 +198,16 @@ class StockService:
     @staticmethod
     def get_stock_price_data(stock_code: str, period: str = "1M") -> StockPriceResponse:
         """株価データ取得（実際のyfinanceデータ）"""
+        # 取得した全期間のデータで指標を計算し、表示期間に絞り込む
+        history = StockService.get_stock_history(stock_code, period)
+        return StockService.build_display_response(history, period)
+    
+    @staticmethod
+    def get_stock_history(stock_code: str, period: str = "1M") -> StockPriceResponse:
+        """表示期間より長い株価履歴の取得（テクニカル指標計算用）"""
+        yf_period = StockService.HISTORY_PERIODS.get(period, "6mo")
+        
         try:
-            # 期間マッピング（テクニカル指標計算のため十分なデータを確保）
-            period_mapping = {
-                "1W": "90d",   # 1週間でも過去データを含めて90日分
-                "1M": "90d",   # 1ヶ月で90日分
-                "3M": "6mo",   # 3ヶ月で6ヶ月分
-                "6M": "1y",    # 6ヶ月で1年分
-                "1Y": "2y"     # 1年で2年分
-            }
-            
-            yf_period = period_mapping.get(period, "90d")
-            
             # 日本株の場合、".T"を追加
             ticker_symbol = f"{stock_code}.T"
             
@@ -199,54 +217,134 @@ class StockService:
             
             if hist.empty:
                 # データが取得できない場合はフォールバック
-                return StockService._get_fallback_data(stock_code, period)
-            
-            # DataFrameをStockPriceDataに変換
-            price_data = []
-            for date, row in hist.iterrows():
-                price_data.append(StockPriceData(
-                    time=date.strftime("%Y-%m-%d"),
-                    open=round(float(row['Open']), 2),
-                    high=round(float(row['High']), 2),
-                    low=round(float(row['Low']), 2),
-                    close=round(float(row['Close']), 2),
-                    volume=int(row['Volume']) if pd.notna(row['Volume']) else 0
-                ))
-            
-            # 期間に応じてデータを絞り込み
-            if period == "1W":
-                price_data = price_data[-7:]  # 直近7日分
-            elif period == "1M":
-                price_data = price_data[-30:]  # 直近30日分
-            elif period == "3M":
-                price_data = price_data[-90:]  # 直近90日分
-            elif period == "6M":
-                price_data = price_data[-180:]  # 直近180日分
-            elif period == "1Y":
-                price_data = price_data[-365:]  # 直近365日分
+                return StockService._get_fallback_data(stock_code, yf_period)
             
             return StockPriceResponse(
                 stock_code=stock_code,
-                period=period,
-                data=price_data,
+                period=yf_period,
+                data=StockService._convert_history(hist),
                 last_updated=datetime.utcnow()
             )
             
         except Exception as e:
             print(f"yfinance error for {stock_code}: {str(e)}")
             # エラーの場合はフォールバックデータを使用
-            return StockService._get_fallback_data(stock_code, period)
+            return StockService._get_fallback_data(stock_code, yf_period)
+    
+    @staticmethod
+    def get_stock_histories_bulk(
+        db: Session,
+        stock_codes: List[str],
+        period: str = "1M",
+        fallback: bool = True
+    ) -> Dict[str, StockPriceResponse]:
+        """
+        複数銘柄の株価履歴を一括取得（キャッシュは1クエリ、不足分は1回のダウンロード）
+        取得できなかった銘柄は fallback=True ならフォールバックデータ（キャッシュしない）、False なら結果から除く
+        """
+        from app.services.cache_service import CacheService
+        
+        stock_codes = list(dict.fromkeys(stock_codes))
+        yf_period = StockService.HISTORY_PERIODS.get(period, "6mo")
+        
+        histories = CacheService.get_stock_price_caches(db, stock_codes, yf_period)
+        missing_codes = [code for code in stock_codes if code not in histories]
+        if missing_codes:
+            fetched = StockService._download_histories(missing_codes, yf_period)
+            CacheService.set_stock_price_caches(db, yf_period, fetched)
+            histories.update(fetched)
+        
+        if fallback:
+            for code in stock_codes:
+                if code not in histories:
+                    histories[code] = StockService._get_fallback_data(code, yf_period)
+        
+        return {code: histories[code] for code in stock_codes if code in histories}
+    
+    @staticmethod
+    def _download_histories(stock_codes: List[str], yf_period: str) -> Dict[str, StockPriceResponse]:
+        """yfinanceで複数銘柄の履歴をまとめてダウンロード（取得できなかった銘柄は含めない）"""
+        results = {}
+        symbols = {code: f"{code}.T" for code in stock_codes}
+        
+        try:
+            hist = yf.download(
+                list(symbols.values()),
+                period=yf_period,
+                group_by="ticker",
+                auto_adjust=True,
+                progress=False,
+                threads=True
+            )
+        except Exception as e:
+            print(f"yfinance bulk download error: {str(e)}")
+            hist = pd.DataFrame()
+        
+        last_updated = datetime.utcnow()
+        for code, symbol in symbols.items():
+            try:
+                if hist.empty:
+                    break
+                frame = hist[symbol] if isinstance(hist.columns, pd.MultiIndex) else hist
+                frame = frame.dropna(how="all")
+                if frame.empty:
+                    continue
+                results[code] = StockPriceResponse(
+                    stock_code=code,
+                    period=yf_period,
+                    data=StockService._convert_history(frame),
+                    last_updated=last_updated
+                )
+            except Exception as e:
+                print(f"yfinance error for {code}: {str(e)}")
+        
+        return results
+    
+    @staticmethod
+    def _convert_history(hist: pd.DataFrame) -> List[StockPriceData]:
+        """yfinanceのDataFrameをStockPriceDataに変換"""
+        price_data = []
+        for date, row in hist.iterrows():
+            price_data.append(StockPriceData(
+                time=date.strftime("%Y-%m-%d"),
+                open=round(float(row['Open']), 2),
+                high=round(float(row['High']), 2),
+                low=round(float(row['Low']), 2),
+                close=round(float(row['Close']), 2),
+                volume=int(row['Volume']) if pd.notna(row['Volume']) else 0
+            ))
+        return price_data
+    
+    @staticmethod
+    def build_display_response(history: StockPriceResponse, period: str) -> StockPriceResponse:
+        """株価履歴から表示用レスポンスを作成（指標は履歴全体で計算して添付）"""
+        indicators = StockService.get_technical_indicators_with_cache(history.stock_code, history.data)
+        
+        # 期間に応じてデータを絞り込み
+        display_bars = StockService.DISPLAY_BARS.get(period)
+        price_data = history.data[-display_bars:] if display_bars else history.data
+        
+        return StockPriceResponse(
+            stock_code=history.stock_code,
+            period=period,
+            data=price_data,
+            last_updated=history.last_updated,
+            indicators=indicators
+        )
     
     @staticmethod
     def _get_fallback_data(stock_code: str, period: str) -> StockPriceResponse:
         """フォールバック用のモックデータ生成"""
-        # 期間マッピング
+        # 期間マッピング（表示期間・履歴期間の両方に対応）
         period_mapping = {
             "1W": 7,
             "1M": 30,
             "3M": 90,
             "6M": 180,
-            "1Y": 365
+            "1Y": 365,
+            "6mo": 180,
+            "1y": 365,
+            "2y": 730
         }
         
         days = period_mapping.get(period, 30)
@@ -305,68 +403,137 @@ class StockService:
     @staticmethod
     def calculate_technical_indicators(price_data: List[StockPriceData]) -> TechnicalIndicators:
         """テクニカル指標計算"""
-        if len(price_data) < 75:  # 75日分のデータが必要
+        if not price_data:
             return TechnicalIndicators()
-        
-        # DataFrameに変換
-        df = pd.DataFrame([{
-            'close': data.close,
-            'volume': data.volume or 0
-        } for data in price_data])
-        
-        indicators = TechnicalIndicators()
-        
+
         try:
-            # SMA計算
-            if len(df) >= 25:
-                indicators.sma_25 = float(df['close'].rolling(25).mean().iloc[-1])
-            if len(df) >= 75:
-                indicators.sma_75 = float(df['close'].rolling(75).mean().iloc[-1])
-            
-            # RSI計算（14日）
-            if len(df) >= 14:
-                delta = df['close'].diff()
-                gain = (delta.where(delta > 0, 0)).rolling(14).mean()
-                loss = (-delta.where(delta < 0, 0)).rolling(14).mean()
-                rs = gain / loss
-                rsi = 100 - (100 / (1 + rs))
-                indicators.rsi_14 = float(rsi.iloc[-1])
-            
-            # MACD計算
-            if len(df) >= 26:
-                ema12 = df['close'].ewm(span=12).mean()
-                ema26 = df['close'].ewm(span=26).mean()
-                macd_line = ema12 - ema26
-                signal_line = macd_line.ewm(span=9).mean()
-                histogram = macd_line - signal_line
-                
-                indicators.macd_line = float(macd_line.iloc[-1])
-                indicators.macd_signal = float(signal_line.iloc[-1])
-                indicators.macd_histogram = float(histogram.iloc[-1])
-            
-            # 出来高SMA
-            if len(df) >= 25:
-                indicators.volume_sma_25 = float(df['volume'].rolling(25).mean().iloc[-1])
-                
+            # NumPyカーネルで全系列を計算し、最新値を返す（期間不足の指標はNone）
+            series = IndicatorService.calculate_series(IndicatorService.to_arrays(price_data))
+            return IndicatorService.latest(series)
+
         except Exception as e:
             print(f"Error calculating indicators: {e}")
+            return TechnicalIndicators()
+
+    @staticmethod
+    def calculate_technical_indicators_batch(histories: Dict[str, StockPriceResponse]) -> Dict[str, TechnicalIndicators]:
+        """複数銘柄のテクニカル指標を2次元配列でまとめて計算"""
+        if not histories:
+            return {}
+        
+        stacked = IndicatorService.stack_arrays([
+            IndicatorService.to_arrays(history.data) for history in histories.values()
+        ])
+        series = IndicatorService.calculate_series(stacked)
+        return dict(zip(histories.keys(), IndicatorService.latest_batch(series)))
+    
+    @staticmethod
+    def calculate_indicator_series(history: StockPriceResponse, period: str) -> TechnicalIndicatorSeriesResponse:
+        """テクニカル指標の時系列計算（株価データと同じ並びの列形式）"""
+        # 履歴全体で計算してから表示期間に絞り込む（先頭の欠損を避ける）
+        series = IndicatorService.calculate_series(IndicatorService.to_arrays(history.data))
+        display_bars = StockService.DISPLAY_BARS.get(period) or len(history.data)
+        
+        return TechnicalIndicatorSeriesResponse(
+            stock_code=history.stock_code,
+            period=period,
+            time=[data.time for data in history.data[-display_bars:]],
+            last_updated=history.last_updated,
+            **{name: IndicatorService.to_json_list(values[-display_bars:]) for name, values in series.items()}
+        )
+    
+    @staticmethod
+    def get_technical_indicators_with_cache(stock_code: str, price_data: List[StockPriceData]) -> TechnicalIndicators:
+        """キャッシュを使用したテクニカル指標取得"""
+        from app.services.cache_service import CacheService
+        
+        # 同じ株価データから計算済みの指標があれば再利用
+        cached_indicators = CacheService.get_technical_indicators_cache(stock_code, "latest", price_data)
+        if cached_indicators is not None:
+            return cached_indicators
+        
+        indicators = StockService.calculate_technical_indicators(price_data)
+        CacheService.set_technical_indicators_cache(stock_code, "latest", price_data, indicators)
         
         return indicators
     
     @staticmethod
-    def get_stock_with_cache(db: Session, stock_code: str, period: str = "1M") -> StockPriceResponse:
+    def get_indicator_series_with_cache(db: Session, stock_code: str, period: str = "1M") -> TechnicalIndicatorSeriesResponse:
+        """キャッシュを使用したテクニカル指標の時系列取得"""
+        from app.services.cache_service import CacheService
+        
+        history = StockService.get_stock_history_with_cache(db, stock_code, period)
+        
+        kind = f"series:{period}"
+        cached_series = CacheService.get_technical_indicators_cache(stock_code, kind, history.data)
+        if cached_series is not None:
+            return cached_series
+        
+        series = StockService.calculate_indicator_series(history, period)
+        CacheService.set_technical_indicators_cache(stock_code, kind, history.data, series)
+        
+        return series
+    
+    @staticmethod
+    def get_stock_with_cache(db: Session, stock_code: str, period: str = "1M", interval: str = "1d") -> StockPriceResponse:
         """キャッシュを使用した株価データ取得"""
         from app.services.cache_service import CacheService
         
+        if interval != "1d":
+            return StockService._get_resampled_with_cache(db, stock_code, period, interval)
+        
         # キャッシュからデータを取得
         cached_data = CacheService.get_stock_price_cache(db, stock_code, period)
         if cached_data:
             return cached_data
         
-        # キャッシュにない場合は新しいデータを取得
-        fresh_data = StockService.get_stock_price_data(stock_code, period)
+        # キャッシュにない場合は履歴（キャッシュ共有）から表示用データを作成
+        history = StockService.get_stock_history_with_cache(db, stock_code, period)
+        fresh_data = StockService.build_display_response(history, period)
         
         # キャッシュに保存
         CacheService.set_stock_price_cache(db, stock_code, period, fresh_data)
         
-        return fresh_data
\ No newline at end of file
+        return fresh_data
+    
+    @staticmethod
+    def _get_resampled_with_cache(db: Session, stock_code: str, period: str, interval: str) -> StockPriceResponse:
+        """キャッシュを使用した週足・月足データ取得（日足の表示データから作成）"""
+        from app.services.cache_service import CacheService
+        from app.services.resample_service import ResampleService
+        
+        cached_data = CacheService.get_stock_price_cache(db, stock_code, period, interval)
+        if cached_data:
+            return cached_data
+        
+        daily_data = StockService.get_stock_with_cache(db, stock_code, period)
+        resampled = ResampleService.resample(daily_data, interval)
+        CacheService.set_stock_price_cache(db, stock_code, period, resampled, interval)
+        
+        return resampled
+    
+    @staticmethod
+    def get_stock_history_with_cache(db: Session, stock_code: str, period: str = "1M") -> StockPriceResponse:
+        """キャッシュを使用した株価履歴取得（同じ取得期間の表示期間で共有）"""
+        from app.services.cache_service import CacheService
+        
+        yf_period = StockService.HISTORY_PERIODS.get(period, "6mo")
+        cached_history = CacheService.get_stock_price_cache(db, stock_code, yf_period)
+        if cached_history:
+            return cached_history
+        
+        history = StockService.get_stock_history(stock_code, period)
+        CacheService.set_stock_price_cache(db, stock_code, yf_period, history)
+        
+        return history
+    
+    @staticmethod
+    def get_technical_indicators_for_period(db: Session, stock_code: str, period: str = "1M") -> TechnicalIndicators:
+        """表示期間のテクニカル指標取得（履歴全体で計算済みの値）"""
+        price_data = StockService.get_stock_with_cache(db, stock_code, period)
+        if price_data.indicators is not None:
+            return price_data.indicators
+        
+        # 指標が添付されていない古いキャッシュの場合は履歴から計算
+        history = StockService.get_stock_history_with_cache(db, stock_code, period)
+        return StockService.get_technical_indicators_with_cache(stock_code, history.data)
\ No newline at end of file
@@ -0,0 +1,64 @@
+"""
+AI解説のトークン数見積もり
+プロンプトの文字数と想定出力から基準値を求め、実績（実トークン数 / 基準値）の比率を学習して補正する。
+分間トークンの予約には比率のばらつきを加えた値を使い、上限を超えない範囲で枠を使い切る。
+"""
+
+from typing import Tuple
+import math
+import threading
+
+
+class TokenEstimator:
+    # 基準値の算出（日本語主体のプロンプトは1トークンあたり約1.5文字、解説1件の出力は約250トークン）
+    CHARS_PER_TOKEN = 1.5
+    OUTPUT_TOKENS = 250
+
+    # 比率の学習（指数移動平均）と予約時の安全係数（平均 + 偏差 × 係数）
+    SMOOTHING = 0.1
+    SAFETY_DEVIATIONS = 2.0
+    INITIAL_DEVIATION = 0.25
+    MIN_RATIO = 0.5
+    MAX_RATIO = 3.0
+
+    def __init__(self, default_tokens: int):
+        self.ratio = 1.0
+        self.deviation = self.INITIAL_DEVIATION
+        self._typical_tokens = float(default_tokens)
+        self._lock = threading.Lock()
+
+    def _clamp(self, ratio: float) -> float:
+        return min(max(ratio, self.MIN_RATIO), self.MAX_RATIO)
+
+    def base_estimate(self, prompt: str, outputs: int = 1) -> int:
+        """プロンプトの文字数と出力件数からの基準値（使用量の estimated_tokens として記録する値）"""
+        return math.ceil(len(prompt) / self.CHARS_PER_TOKEN) + self.OUTPUT_TOKENS * outputs
+
+    def estimate(self, prompt: str, outputs: int = 1) -> Tuple[int, int]:
+        """（基準値, 予約するトークン数）を返す"""
+        base = self.base_estimate(prompt, outputs)
+        with self._lock:
+            reserved = math.ceil(base * (self.ratio + self.SAFETY_DEVIATIONS * self.deviation))
+            self._typical_tokens += self.SMOOTHING * (reserved / outputs - self._typical_tokens)
+        return base, reserved
+
+    def typical(self) -> int:
+        """解説1件あたりの予約トークン数の目安（プロンプトを作成する前の利用可否確認用）"""
+        with self._lock:
+            return math.ceil(self._typical_tokens)
+
+    def observe(self, base_tokens: int, actual_tokens: int):
+        """実トークン数から比率とばらつきを更新"""
+        if base_tokens <= 0 or actual_tokens <= 0:
+            return
+        ratio = self._clamp(actual_tokens / base_tokens)
+        with self._lock:
+            self.deviation += self.SMOOTHING * (abs(ratio - self.ratio) - self.deviation)
+            self.ratio += self.SMOOTHING * (ratio - self.ratio)
+
+    def seed(self, estimated_tokens: int, actual_tokens: int):
+        """起動時に過去の使用量（見積もり・実績の合計）から比率を設定"""
+        if estimated_tokens <= 0 or actual_tokens <= 0:
+            return
+        with self._lock:
+            self.ratio = self._clamp(actual_tokens / estimated_tokens)
@@ -0,0 +1,262 @@
+"""
+API使用量記録サービス
+日次・分次の使用量はシャード行に分散して加算し、参照時に合計する
+（全ワーカーが同じ行を更新して行ロック待ちになるのを避ける）
+
+古い使用量は定期メンテナンスで 分→時間 に集約し、過去日のシャードを1行にまとめ、
+保持期間を過ぎた行をバッチ単位で削除する。
+"""
+
+from typing import Dict, List, Optional, Tuple
+from datetime import date, datetime, timedelta
+import asyncio
+import os
+import random
+import uuid
+from sqlalchemy.orm import Session
+from sqlalchemy import func, text
+from app.core.database import SessionLocal
+from app.models.database import DailyAPIUsage, MinuteAPIUsage
+
+
+class UsageService:
+    # 日次・分次カウンタのシャード数
+    COUNTER_SHARDS = 8
+
+    # 保持期間（分次は時間別に集約してから削除、時間別・ユーザー別は期間経過後に削除）
+    MINUTE_RETENTION = timedelta(hours=int(os.getenv("MINUTE_USAGE_RETENTION_HOURS", "2")))
+    HOURLY_RETENTION = timedelta(days=int(os.getenv("HOURLY_USAGE_RETENTION_DAYS", "30")))
+    USER_USAGE_RETENTION = timedelta(days=int(os.getenv("USER_USAGE_RETENTION_DAYS", "90")))
+
+    # 1回の削除で扱う行数と、定期メンテナンスの間隔（秒）
+    MAINTENANCE_BATCH_SIZE = 5000
+    MAINTENANCE_INTERVAL_SECONDS = 600
+
+    # 使用量を1文で加算（日次・分次・ユーザー別を同じ文で書き込む）
+    RECORD_USAGE_SQL = text("""
+        WITH daily AS (
+            INSERT INTO daily_api_usage AS usage
+                (usage_date, shard, total_requests, total_tokens, estimated_tokens, actual_tokens)
+            SELECT * FROM unnest(
+                CAST(:daily_dates AS date[]), CAST(:daily_shards AS integer[]),
+                CAST(:daily_requests AS integer[]), CAST(:daily_actual_tokens AS integer[]),
+                CAST(:daily_estimated_tokens AS integer[]), CAST(:daily_actual_tokens AS integer[])
+            )
+            ON CONFLICT (usage_date, shard) DO UPDATE SET
+                total_requests = usage.total_requests + EXCLUDED.total_requests,
+                total_tokens = usage.total_tokens + EXCLUDED.total_tokens,
+                estimated_tokens = usage.estimated_tokens + EXCLUDED.estimated_tokens,
+                actual_tokens = usage.actual_tokens + EXCLUDED.actual_tokens
+        ), minute AS (
+            INSERT INTO minute_api_usage AS usage (minute_key, shard, requests, tokens)
+            SELECT * FROM unnest(
+                CAST(:minute_keys AS varchar[]), CAST(:minute_shards AS integer[]),
+                CAST(:minute_requests AS integer[]), CAST(:minute_tokens AS integer[])
+            )
+            ON CONFLICT (minute_key, shard) DO UPDATE SET
+                requests = usage.requests + EXCLUDED.requests,
+                tokens = usage.tokens + EXCLUDED.tokens
+        )
+        INSERT INTO user_daily_usage AS usage (user_id, usage_date, request_count, token_count)
+        SELECT * FROM unnest(
+            CAST(:user_ids AS uuid[]), CAST(:user_dates AS date[]),
+            CAST(:user_requests AS integer[]), CAST(:user_tokens AS integer[])
+        )
+        ON CONFLICT (user_id, usage_date) DO UPDATE SET
+            request_count = usage.request_count + EXCLUDED.request_count,
+            token_count = usage.token_count + EXCLUDED.token_count
+    """)
+
+    # 保持期間を過ぎた分次使用量を時間別に加算して削除（1バッチ分、削除件数を返す）
+    ROLLUP_MINUTE_SQL = text("""
+        WITH expired AS (
+            SELECT minute_key, shard FROM minute_api_usage
+            WHERE minute_key < :cutoff
+            ORDER BY minute_key
+            LIMIT :batch_size
+            FOR UPDATE SKIP LOCKED
+        ), deleted AS (
+            DELETE FROM minute_api_usage AS usage USING expired
+            WHERE usage.minute_key = expired.minute_key AND usage.shard = expired.shard
+            RETURNING usage.minute_key, usage.requests, usage.tokens
+        ), rolled AS (
+            INSERT INTO hourly_api_usage AS usage (hour_key, requests, tokens)
+            SELECT left(minute_key, 13), SUM(requests), SUM(tokens) FROM deleted
+            GROUP BY left(minute_key, 13)
+            ON CONFLICT (hour_key) DO UPDATE SET
+                requests = usage.requests + EXCLUDED.requests,
+                tokens = usage.tokens + EXCLUDED.tokens
+        )
+        SELECT COUNT(*) FROM deleted
+    """)
+
+    # 過去日の日次シャードを shard = 0 の1行にまとめる
+    COMPACT_DAILY_SQL = text("""
+        WITH merged AS (
+            DELETE FROM daily_api_usage
+            WHERE usage_date < :today AND shard <> 0
+            RETURNING usage_date, total_requests, total_tokens, estimated_tokens, actual_tokens
+        )
+        INSERT INTO daily_api_usage AS usage
+            (usage_date, shard, total_requests, total_tokens, estimated_tokens, actual_tokens)
+        SELECT usage_date, 0, SUM(total_requests), SUM(total_tokens), SUM(estimated_tokens), SUM(actual_tokens)
+        FROM merged GROUP BY usage_date
+        ON CONFLICT (usage_date, shard) DO UPDATE SET
+            total_requests = usage.total_requests + EXCLUDED.total_requests,
+            total_tokens = usage.total_tokens + EXCLUDED.total_tokens,
+            estimated_tokens = usage.estimated_tokens + EXCLUDED.estimated_tokens,
+            actual_tokens = usage.actual_tokens + EXCLUDED.actual_tokens
+    """)
+
+    # 保持期間を過ぎた時間別・ユーザー別使用量の削除（1バッチ分）
+    PURGE_HOURLY_SQL = text("""
+        DELETE FROM hourly_api_usage WHERE hour_key IN (
+            SELECT hour_key FROM hourly_api_usage WHERE hour_key < :cutoff LIMIT :batch_size
+        )
+    """)
+    PURGE_USER_USAGE_SQL = text("""
+        DELETE FROM user_daily_usage WHERE ctid IN (
+            SELECT ctid FROM user_daily_usage WHERE usage_date < :cutoff LIMIT :batch_size
+        )
+    """)
+
+    @staticmethod
+    def aggregate(events: List[Tuple[date, str, Optional[uuid.UUID], int, int, int]]) -> Dict[str, list]:
+        """
+        使用量イベント（日付, 分キー, ユーザーID, Geminiリクエスト数, 推定トークン, 実トークン）を書き込み単位に集計
+        ユーザー別の回数は解説1件につき1回として数える
+        """
+        daily: Dict[date, List[int]] = {}
+        minute: Dict[str, List[int]] = {}
+        user: Dict[Tuple[uuid.UUID, date], List[int]] = {}
+        for usage_date, minute_key, user_id, requests, estimated_tokens, actual_tokens in events:
+            daily_totals = daily.setdefault(usage_date, [0, 0, 0])
+            daily_totals[0] += requests
+            daily_totals[1] += estimated_tokens
+            daily_totals[2] += actual_tokens
+            minute_totals = minute.setdefault(minute_key, [0, 0])
+            minute_totals[0] += requests
+            minute_totals[1] += actual_tokens
+            if user_id is not None:
+                user_totals = user.setdefault((user_id, usage_date), [0, 0])
+                user_totals[0] += 1
+                user_totals[1] += actual_tokens
+
+        return {
+            "daily_dates": list(daily),
+            "daily_shards": [random.randrange(UsageService.COUNTER_SHARDS) for _ in daily],
+            "daily_requests": [totals[0] for totals in daily.values()],
+            "daily_estimated_tokens": [totals[1] for totals in daily.values()],
+            "daily_actual_tokens": [totals[2] for totals in daily.values()],
+            "minute_keys": list(minute),
+            "minute_shards": [random.randrange(UsageService.COUNTER_SHARDS) for _ in minute],
+            "minute_requests": [totals[0] for totals in minute.values()],
+            "minute_tokens": [totals[1] for totals in minute.values()],
+            "user_ids": [str(user_id) for user_id, _ in user],
+            "user_dates": [usage_date for _, usage_date in user],
+            "user_requests": [totals[0] for totals in user.values()],
+            "user_tokens": [totals[1] for totals in user.values()],
+        }
+
+    @staticmethod
+    def record(db: Session, events: List[Tuple[date, str, Optional[uuid.UUID], int, int, int]]) -> bool:
+        """使用量をまとめて加算（行の読み取りなしのアトミックな加算）"""
+        if not events:
+            return True
+        try:
+            db.execute(UsageService.RECORD_USAGE_SQL, UsageService.aggregate(events))
+            db.commit()
+            return True
+        except Exception as e:
+            print(f"Usage record error: {str(e)}")
+            db.rollback()
+            return False
+
+    @staticmethod
+    def get_daily_usage(db: Session, usage_date: date) -> Dict[str, int]:
+        """日次使用量（全シャードの合計）"""
+        requests, tokens = db.query(
+            func.coalesce(func.sum(DailyAPIUsage.total_requests), 0),
+            func.coalesce(func.sum(DailyAPIUsage.total_tokens), 0)
+        ).filter(DailyAPIUsage.usage_date == usage_date).one()
+        return {"requests": int(requests), "tokens": int(tokens)}
+
+    @staticmethod
+    def get_token_totals(db: Session, since: date) -> Dict[str, int]:
+        """指定日以降の見積もりトークン数と実トークン数の合計（見積もりの補正比率の学習用）"""
+        estimated, actual = db.query(
+            func.coalesce(func.sum(DailyAPIUsage.estimated_tokens), 0),
+            func.coalesce(func.sum(DailyAPIUsage.actual_tokens), 0)
+        ).filter(DailyAPIUsage.usage_date >= since).one()
+        return {"estimated_tokens": int(estimated), "actual_tokens": int(actual)}
+
+    @staticmethod
+    def get_minute_usage(db: Session, minute_key: str) -> Dict[str, int]:
+        """分次使用量（全シャードの合計）"""
+        requests, tokens = db.query(
+            func.coalesce(func.sum(MinuteAPIUsage.requests), 0),
+            func.coalesce(func.sum(MinuteAPIUsage.tokens), 0)
+        ).filter(MinuteAPIUsage.minute_key == minute_key).one()
+        return {"requests": int(requests), "tokens": int(tokens)}
+
+    @staticmethod
+    def _run_batches(db: Session, statement, params: Dict, count_rows) -> int:
+        """削除件数が0になるまでバッチ単位で実行（バッチごとにコミットしてロックを短くする）"""
+        total = 0
+        while True:
+            result = db.execute(statement, {**params, "batch_size": UsageService.MAINTENANCE_BATCH_SIZE})
+            count = count_rows(result)
+            db.commit()
+            total += count
+            if count < UsageService.MAINTENANCE_BATCH_SIZE:
+                return total
+
+    @staticmethod
+    def run_maintenance(db: Session) -> Dict[str, int]:
+        """使用量の集約と保持期間を過ぎた行の削除"""
+        now = datetime.utcnow()
+        stats = {}
+        try:
+            stats["minute_rows_rolled_up"] = UsageService._run_batches(
+                db, UsageService.ROLLUP_MINUTE_SQL,
+                {"cutoff": (now - UsageService.MINUTE_RETENTION).strftime("%Y-%m-%d_%H:%M")},
+                lambda result: result.scalar()
+            )
+
+            stats["daily_shards_compacted"] = db.execute(
+                UsageService.COMPACT_DAILY_SQL, {"today": date.today()}
+            ).rowcount
+            db.commit()
+
+            stats["hourly_rows_deleted"] = UsageService._run_batches(
+                db, UsageService.PURGE_HOURLY_SQL,
+                {"cutoff": (now - UsageService.HOURLY_RETENTION).strftime("%Y-%m-%d_%H")},
+                lambda result: result.rowcount
+            )
+            stats["user_usage_rows_deleted"] = UsageService._run_batches(
+                db, UsageService.PURGE_USER_USAGE_SQL,
+                {"cutoff": date.today() - UsageService.USER_USAGE_RETENTION},
+                lambda result: result.rowcount
+            )
+            print(f"Usage maintenance: {stats}")
+        except Exception as e:
+            print(f"Usage maintenance error: {str(e)}")
+            db.rollback()
+        return stats
+
+    @staticmethod
+    def _run_maintenance_with_session() -> Dict[str, int]:
+        """専用セッションでメンテナンスを実行"""
+        db = SessionLocal()
+        try:
+            return UsageService.run_maintenance(db)
+        finally:
+            db.close()
+
+    @staticmethod
+    async def run_maintenance_loop():
+        """使用量メンテナンスを定期実行するバックグラウンドタスク"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(UsageService.MAINTENANCE_INTERVAL_SECONDS)
+            await loop.run_in_executor(None, UsageService._run_maintenance_with_session)
@@ -1,12 +1,17 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+import asyncio
 import os
 
 # ルーターをインポート
 from app.routers import auth, stocks, ai
-from app.core.database import engine
+from app.core.database import engine, SessionLocal
 from app.models.database import Base
+from app.services.usage_service import UsageService
+from app.services.prefetch_service import PrefetchService
+from app.services.job_service import AIJobService
+from app.services.screener_service import ScreenerService
 
 # 環境変数を読み込み
 load_dotenv()
@@ -34,6 +39,43 @@ app.include_router(auth.router)
 app.include_router(stocks.router)
 app.include_router(ai.router)
 
+@app.on_event("startup")
+async def start_background_tasks():
+    """バックグラウンドタスク開始"""
+    # 再起動でAPI利用枠がリセットされないよう、本日の使用量を読み込む
+    db = SessionLocal()
+    try:
+        ai.ai_service.seed_usage(db)
+    except Exception as e:
+        print(f"Usage seed error: {str(e)}")
+    finally:
+        db.close()
+    
+    app.state.usage_recorder = asyncio.create_task(ai.ai_service.run_usage_recorder())
+    # 使用量テーブルの集約・保持期間を過ぎた行の削除
+    app.state.usage_maintenance = asyncio.create_task(UsageService.run_maintenance_loop())
+    # 大引け後のAI解説事前生成
+    app.state.ai_prefetch = asyncio.create_task(PrefetchService.run_prefetch_loop(ai.ai_service))
+    # 利用枠の範囲でAI解説の生成ジョブを処理
+    app.state.ai_jobs = asyncio.create_task(AIJobService.run_worker(ai.ai_service))
+    # スクリーニング用指標行列の定期更新
+    app.state.screener_refresh = asyncio.create_task(ScreenerService.run_refresh_loop())
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    """バックグラウンドタスク停止（未記録の使用量を書き込む）"""
+    app.state.usage_recorder.cancel()
+    app.state.usage_maintenance.cancel()
+    app.state.ai_prefetch.cancel()
+    app.state.ai_jobs.cancel()
+    app.state.screener_refresh.cancel()
+    db = SessionLocal()
+    try:
+        PrefetchService.flush_demand(db)
+        ai.ai_service.flush_usage(db)
+    finally:
+        db.close()
+
 @app.get("/")
 async def root():
     return {
@@ -47,6 +89,7 @@ async def health_check():
     return {
         "status": "healthy",
         "gemini_api_configured": bool(os.getenv("GEMINI_API_KEY")),
+        "llm_backend": ai.ai_service.backend,
         "supabase_configured": bool(os.getenv("SUPABASE_URL"))
     }
 
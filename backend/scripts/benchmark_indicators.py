@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+テクニカル指標カーネルのベンチマーク
+- 合成データ（銘柄数 × 本数）で各カーネルの処理時間を計測
+- ネットワーク・データベース不要
+"""
+
+import sys
+import os
+import argparse
+import time
+
+# モジュールパスを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from app.services import indicator_service as kernels
+from app.services.indicator_service import IndicatorService
+
+def generate_ohlcv(tickers: int, bars: int, seed: int = 0) -> dict:
+    """ランダムウォークで合成OHLCVデータを生成（銘柄 × 本数の2次元配列）"""
+    rng = np.random.default_rng(seed)
+    base = rng.uniform(500, 50000, size=(tickers, 1))
+    close = base * np.exp(np.cumsum(rng.normal(0, 0.02, size=(tickers, bars)), axis=1))
+    spread = rng.uniform(0, 0.02, size=(tickers, bars))
+    return {
+        "high": close * (1 + spread),
+        "low": close * (1 - spread),
+        "close": close,
+        "volume": rng.integers(100000, 5000000, size=(tickers, bars)).astype(np.float64),
+    }
+
+def get_kernels(columns: dict) -> dict:
+    """計測対象のカーネル一覧"""
+    high, low, close, volume = columns["high"], columns["low"], columns["close"], columns["volume"]
+    return {
+        "sma_25": lambda: kernels.rolling_mean(close, 25),
+        "sma_75": lambda: kernels.rolling_mean(close, 75),
+        "ema_12": lambda: kernels.ema(close, span=12),
+        "rsi_14": lambda: kernels.rsi(close, 14),
+        "macd": lambda: kernels.macd(close),
+        "volume_sma_25": lambda: kernels.rolling_mean(volume, 25),
+        "bollinger_bands": lambda: kernels.bollinger_bands(close),
+        "atr_14": lambda: kernels.atr(high, low, close, 14),
+        "stochastics": lambda: kernels.stochastics(high, low, close),
+        "ichimoku": lambda: kernels.ichimoku(high, low, close),
+        "deviation_rate_25": lambda: kernels.deviation_rate(close, 25),
+        "all_indicators": lambda: IndicatorService.calculate_series(columns),
+    }
+
+def measure(func, repeat: int) -> float:
+    """最速の実行時間（秒）を返す"""
+    func()  # ウォームアップ
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run_benchmarks(tickers: int, bars: int, repeat: int) -> list:
+    """全カーネルのベンチマーク実行"""
+    columns = generate_ohlcv(tickers, bars)
+    results = []
+    for name, func in get_kernels(columns).items():
+        seconds = measure(func, repeat)
+        results.append({
+            "kernel": name,
+            "tickers": tickers,
+            "bars": bars,
+            "seconds": seconds,
+            "bars_per_second": tickers * bars / seconds if seconds > 0 else float("inf"),
+        })
+    return results
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="テクニカル指標カーネルのベンチマーク")
+    parser.add_argument("--tickers", type=int, default=4000, help="銘柄数")
+    parser.add_argument("--bars", type=int, default=500, help="1銘柄あたりの本数")
+    parser.add_argument("--repeat", type=int, default=5, help="計測回数（最速値を採用）")
+    args = parser.parse_args()
+
+    print("=== テクニカル指標カーネル ベンチマーク ===")
+    print(f"銘柄数: {args.tickers} / 本数: {args.bars} / 計測回数: {args.repeat}")
+    print(f"{'カーネル':<20} {'時間(ms)':>12} {'本/秒':>16}")
+    print("-" * 50)
+
+    for result in run_benchmarks(args.tickers, args.bars, args.repeat):
+        print(f"{result['kernel']:<20} {result['seconds'] * 1000:>12.2f} {result['bars_per_second']:>16,.0f}")
+
+if __name__ == "__main__":
+    main()
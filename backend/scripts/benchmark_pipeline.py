@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+株価データパイプラインのベンチマーク
+- 合成データ（銘柄数 × 本数）で各処理段階の ops/秒 とメモリ割り当てを計測
+- 計測段階: yfinance DataFrame変換、テクニカル指標計算、キャッシュ往復、レスポンスのシリアライズ
+- ネットワーク・PostgreSQL不要（キャッシュ往復はインメモリSQLiteで計測）
+- 結果をJSONに保存し、前回の結果と比較可能
+"""
+
+import sys
+import os
+import argparse
+import json
+import tracemalloc
+from datetime import datetime
+
+# モジュールパスを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+from app.models.database import StockPriceCache
+from app.models.stock import StockPriceResponse
+from app.services.cache_service import CacheService
+from app.services.stock_service import StockService
+from benchmark_indicators import generate_ohlcv, measure
+
+# SQLiteではJSONB型をJSONとして作成する（ベンチマーク専用）
+@compiles(JSONB, "sqlite")
+def compile_jsonb_sqlite(type_, compiler, **kwargs):
+    return "JSON"
+
+def generate_frames(tickers: int, bars: int) -> list:
+    """yfinanceの history() と同じ形式の DataFrame を銘柄数分生成"""
+    columns = generate_ohlcv(tickers, bars)
+    index = pd.bdate_range(end=datetime.utcnow().date(), periods=bars, name="Date")
+    frames = []
+    for row in range(tickers):
+        close = columns["close"][row]
+        frames.append(pd.DataFrame({
+            "Open": np.concatenate(([close[0]], close[:-1])),
+            "High": columns["high"][row],
+            "Low": columns["low"][row],
+            "Close": close,
+            "Volume": columns["volume"][row],
+        }, index=index))
+    return frames
+
+def create_cache_session():
+    """株価キャッシュテーブルのみを持つインメモリSQLiteセッション"""
+    engine = create_engine("sqlite://")
+    StockPriceCache.__table__.create(engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+def get_stages(tickers: int, bars: int) -> dict:
+    """計測対象の処理段階（1回の実行で全銘柄を処理する）"""
+    frames = generate_frames(tickers, bars)
+    codes = [str(1000 + row) for row in range(tickers)]
+    histories = {
+        code: StockPriceResponse(
+            stock_code=code,
+            period="1Y",
+            data=StockService._convert_history(frame),
+            last_updated=datetime.utcnow()
+        )
+        for code, frame in zip(codes, frames)
+    }
+    payloads = {code: history.model_dump_json() for code, history in histories.items()}
+    db = create_cache_session()
+    for code, history in histories.items():
+        CacheService.set_stock_price_cache(db, code, "1Y", history)
+
+    return {
+        "convert_history": lambda: [StockService._convert_history(frame) for frame in frames],
+        "technical_indicators": lambda: [
+            StockService.calculate_technical_indicators(history.data) for history in histories.values()
+        ],
+        "technical_indicators_batch": lambda: StockService.calculate_technical_indicators_batch(histories),
+        "cache_set": lambda: [
+            CacheService.set_stock_price_cache(db, code, "1Y", history) for code, history in histories.items()
+        ],
+        "cache_get": lambda: [CacheService.get_stock_price_cache(db, code, "1Y") for code in codes],
+        "serialize_response": lambda: [history.model_dump_json() for history in histories.values()],
+        "validate_response": lambda: [
+            StockPriceResponse.model_validate_json(payload) for payload in payloads.values()
+        ],
+    }
+
+def measure_allocations(func) -> dict:
+    """1回の実行で確保したメモリ（ピーク）と実行後に残ったメモリを計測"""
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+    return {"peak_bytes": peak - before, "retained_bytes": current - before}
+
+def run_benchmarks(tickers: int, bars: int, repeat: int) -> list:
+    """全段階のベンチマーク実行"""
+    results = []
+    for name, func in get_stages(tickers, bars).items():
+        seconds = measure(func, repeat)
+        allocations = measure_allocations(func)
+        results.append({
+            "stage": name,
+            "tickers": tickers,
+            "bars": bars,
+            "seconds": seconds,
+            "ops_per_second": tickers / seconds if seconds > 0 else float("inf"),
+            "bars_per_second": tickers * bars / seconds if seconds > 0 else float("inf"),
+            "peak_bytes_per_op": allocations["peak_bytes"] / tickers,
+            "retained_bytes_per_op": allocations["retained_bytes"] / tickers,
+        })
+    return results
+
+def load_baseline(path: str) -> dict:
+    """比較対象の結果ファイルを読み込み（段階名 → 結果）"""
+    with open(path, encoding="utf-8") as file:
+        return {result["stage"]: result for result in json.load(file)["results"]}
+
+def save_results(path: str, args: argparse.Namespace, results: list):
+    """結果をJSONに保存"""
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({
+            "created_at": datetime.utcnow().isoformat(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "config": {"tickers": args.tickers, "bars": args.bars, "repeat": args.repeat},
+            "results": results,
+        }, file, ensure_ascii=False, indent=2)
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="株価データパイプラインのベンチマーク")
+    parser.add_argument("--tickers", type=int, default=50, help="銘柄数")
+    parser.add_argument("--bars", type=int, default=500, help="1銘柄あたりの本数")
+    parser.add_argument("--repeat", type=int, default=5, help="計測回数（最速値を採用）")
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--compare", help="比較する前回の結果JSONファイル")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.compare) if args.compare else {}
+
+    print("=== 株価データパイプライン ベンチマーク ===")
+    print(f"銘柄数: {args.tickers} / 本数: {args.bars} / 計測回数: {args.repeat}")
+    print(f"{'段階':<28} {'ops/秒':>12} {'ピーク(KiB/op)':>16} {'残存(KiB/op)':>14} {'前回比':>8}")
+    print("-" * 82)
+
+    results = run_benchmarks(args.tickers, args.bars, args.repeat)
+    for result in results:
+        previous = baseline.get(result["stage"])
+        ratio = f"{result['ops_per_second'] / previous['ops_per_second']:>7.2f}x" if previous else f"{'-':>8}"
+        print(
+            f"{result['stage']:<28} {result['ops_per_second']:>12,.1f} "
+            f"{result['peak_bytes_per_op'] / 1024:>16,.1f} {result['retained_bytes_per_op'] / 1024:>14,.1f} {ratio}"
+        )
+
+    if args.output:
+        save_results(args.output, args, results)
+        print(f"\n結果を保存しました: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Gemini API のスタンドインサーバー（負荷試験用）
+- Gemini REST API 互換の generateContent / streamGenerateContent（alt=sse）を提供
+- 遅延・出力トークン数・エラー率を指定可能（エラーは Gemini と同じ形式の 429 / 500）
+- バックエンドを LLM_BACKEND=http LLM_STUB_URL=http://localhost:8090 で起動すると、
+  本番と同じ経路（キャッシュ・利用枠・同時実行制御）のまま Gemini の代わりに呼び出される
+"""
+
+import sys
+import os
+import argparse
+import asyncio
+import json
+
+# モジュールパスを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.services.llm_client import StubLLMClient
+
+def create_app(stub: StubLLMClient, rate_limit_share: float) -> FastAPI:
+    """スタンドインのアプリケーション作成"""
+    app = FastAPI(title="Gemini stand-in")
+    app.state.stats = {"requests": 0, "errors": 0, "tokens": 0}
+
+    def error_response() -> JSONResponse:
+        """設定したエラー率のうち rate_limit_share の割合を 429、残りを 500 で返す"""
+        app.state.stats["errors"] += 1
+        if stub._random.random() < rate_limit_share:
+            code, status = 429, "RESOURCE_EXHAUSTED"
+        else:
+            code, status = 500, "INTERNAL"
+        return JSONResponse(status_code=code, content={
+            "error": {"code": code, "message": "Simulated error", "status": status}
+        })
+
+    def payload(text: str, usage=None) -> dict:
+        """Gemini REST API 形式のレスポンス"""
+        body = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}]}
+        if usage is not None:
+            body["usageMetadata"] = {
+                "promptTokenCount": usage.prompt_token_count,
+                "candidatesTokenCount": usage.candidates_token_count,
+                "totalTokenCount": usage.total_token_count,
+            }
+        return body
+
+    async def read_prompt(request: Request) -> str:
+        """リクエストのプロンプト（全パートの文章）"""
+        body = await request.json()
+        return "".join(
+            part.get("text", "")
+            for content in body.get("contents", [])
+            for part in content.get("parts", [])
+        )
+
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def generate_content(model: str, request: Request):
+        app.state.stats["requests"] += 1
+        prompt = await read_prompt(request)
+        await asyncio.sleep(stub.sample_latency())
+        if stub.should_fail():
+            return error_response()
+        usage = stub.create_usage(prompt)
+        app.state.stats["tokens"] += usage.total_token_count
+        return payload(stub.create_text(prompt), usage)
+
+    @app.post("/v1beta/models/{model}:streamGenerateContent")
+    async def stream_generate_content(model: str, request: Request):
+        app.state.stats["requests"] += 1
+        prompt = await read_prompt(request)
+        if stub.should_fail():
+            await asyncio.sleep(stub.sample_latency())
+            return error_response()
+
+        parts = stub.split_text(stub.create_text(prompt))
+        latency = stub.sample_latency()
+        usage = stub.create_usage(prompt)
+        app.state.stats["tokens"] += usage.total_token_count
+
+        async def events():
+            for index, part in enumerate(parts):
+                await asyncio.sleep(latency / len(parts))
+                chunk = payload(part, usage if index == len(parts) - 1 else None)
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        """受け付けたリクエスト数・エラー数・トークン数"""
+        return app.state.stats
+
+    return app
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="Gemini API のスタンドインサーバー")
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けアドレス")
+    parser.add_argument("--port", type=int, default=8090, help="待ち受けポート")
+    parser.add_argument("--latency-ms", type=float, default=800, help="応答までの遅延（ミリ秒）")
+    parser.add_argument("--jitter-ms", type=float, default=300, help="遅延のばらつき（±ミリ秒）")
+    parser.add_argument("--output-tokens", type=int, default=200, help="1回の応答の出力トークン数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="エラーを返す割合（0〜1）")
+    parser.add_argument("--rate-limit-share", type=float, default=0.5, help="エラーのうち429を返す割合（0〜1）")
+    parser.add_argument("--seed", type=int, help="乱数シード")
+    args = parser.parse_args()
+
+    stub = StubLLMClient(
+        latency_seconds=args.latency_ms / 1000,
+        latency_jitter_seconds=args.jitter_ms / 1000,
+        output_tokens=args.output_tokens,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    print(f"Gemini stand-in: http://{args.host}:{args.port} (latency {args.latency_ms}±{args.jitter_ms}ms, error rate {args.error_rate})")
+    uvicorn.run(create_app(stub, args.rate_limit_share), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
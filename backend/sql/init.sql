@@ -43,10 +43,52 @@ CREATE TABLE ai_explanations (
     technical_data JSONB,
     created_at TIMESTAMP DEFAULT NOW(),
     expires_at TIMESTAMP DEFAULT (NOW() + INTERVAL '1 hour'),
-    UNIQUE(stock_code, chart_period, DATE(created_at))
+    UNIQUE(stock_code, chart_period)
 );
 CREATE INDEX idx_ai_expires ON ai_explanations (expires_at);
-CREATE INDEX idx_ai_stock_period ON ai_explanations (stock_code, chart_period);
+
+-- テクニカル状態別のAI解説テンプレート（同じ状態の銘柄で共有）
+CREATE TABLE ai_explanation_templates (
+    state_key VARCHAR(100) PRIMARY KEY,
+    chart_period VARCHAR(20) NOT NULL,
+    technical_state JSONB,
+    template_text TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL
+);
+CREATE INDEX idx_ai_template_expires ON ai_explanation_templates (expires_at);
+
+-- AI解説の需要（事前生成の対象選定用）
+CREATE TABLE ai_explanation_demand (
+    stock_code VARCHAR(10),
+    chart_period VARCHAR(20),
+    demand_date DATE,
+    request_count INTEGER DEFAULT 0,
+    PRIMARY KEY(stock_code, chart_period, demand_date)
+);
+CREATE INDEX idx_ai_demand_date ON ai_explanation_demand (demand_date);
+
+-- AI解説の生成ジョブ（利用枠の範囲で順次生成、同じ銘柄・期間の未完了ジョブは1件にまとめる）
+CREATE TABLE ai_explanation_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    stock_code VARCHAR(10) NOT NULL,
+    chart_period VARCHAR(20) NOT NULL,
+    user_id UUID REFERENCES users(id) ON DELETE SET NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    priority INTEGER DEFAULT 0,
+    request_count INTEGER DEFAULT 1,
+    attempts INTEGER DEFAULT 0,
+    explanation_id UUID,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    available_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+CREATE UNIQUE INDEX uq_ai_job_active
+    ON ai_explanation_jobs (stock_code, chart_period) WHERE status IN ('queued', 'running');
+CREATE INDEX idx_ai_job_queue
+    ON ai_explanation_jobs (priority DESC, request_count DESC, created_at) WHERE status = 'queued';
 
 -- 銘柄マスタテーブル
 CREATE TABLE stocks (
@@ -69,18 +111,30 @@ CREATE TABLE stock_price_cache (
 CREATE INDEX idx_stock_expires ON stock_price_cache (expires_at);
 
 -- 日次API利用状況
+-- 同時更新を分散するためシャード行に加算し、参照時に合計する
 CREATE TABLE daily_api_usage (
-    usage_date DATE PRIMARY KEY,
+    usage_date DATE,
+    shard INTEGER DEFAULT 0,
     total_requests INTEGER DEFAULT 0,
     total_tokens INTEGER DEFAULT 0,
     estimated_tokens INTEGER DEFAULT 0,
-    actual_tokens INTEGER DEFAULT 0
+    actual_tokens INTEGER DEFAULT 0,
+    PRIMARY KEY(usage_date, shard)
 );
 CREATE INDEX idx_daily_usage_date ON daily_api_usage (usage_date DESC);
 
 -- 分次API利用状況（レート制限）
 CREATE TABLE minute_api_usage (
-    minute_key VARCHAR(20) PRIMARY KEY,
+    minute_key VARCHAR(20),
+    shard INTEGER DEFAULT 0,
+    requests INTEGER DEFAULT 0,
+    tokens INTEGER DEFAULT 0,
+    PRIMARY KEY(minute_key, shard)
+);
+
+-- 時間別API利用状況（保持期間を過ぎた分次利用状況を集約）
+CREATE TABLE hourly_api_usage (
+    hour_key VARCHAR(16) PRIMARY KEY,
     requests INTEGER DEFAULT 0,
     tokens INTEGER DEFAULT 0
 );
@@ -0,0 +1,15 @@
+-- API使用量カウンタのシャード化
+-- daily_api_usage / minute_api_usage の主キーに shard を追加する
+-- 既存の行は shard = 0 として残る（参照時は全シャードを合計する）
+
+BEGIN;
+
+ALTER TABLE daily_api_usage ADD COLUMN IF NOT EXISTS shard INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE daily_api_usage DROP CONSTRAINT IF EXISTS daily_api_usage_pkey;
+ALTER TABLE daily_api_usage ADD PRIMARY KEY (usage_date, shard);
+
+ALTER TABLE minute_api_usage ADD COLUMN IF NOT EXISTS shard INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE minute_api_usage DROP CONSTRAINT IF EXISTS minute_api_usage_pkey;
+ALTER TABLE minute_api_usage ADD PRIMARY KEY (minute_key, shard);
+
+COMMIT;
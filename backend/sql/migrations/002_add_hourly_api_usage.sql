@@ -0,0 +1,12 @@
+-- 時間別API利用状況テーブルの追加
+-- 保持期間を過ぎた minute_api_usage の行は時間単位に集約してから削除する
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS hourly_api_usage (
+    hour_key VARCHAR(16) PRIMARY KEY,
+    requests INTEGER DEFAULT 0,
+    tokens INTEGER DEFAULT 0
+);
+
+COMMIT;
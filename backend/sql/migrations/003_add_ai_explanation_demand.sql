@@ -0,0 +1,15 @@
+-- AI解説の需要テーブルの追加
+-- 大引け後の事前生成で、需要の高い（銘柄, 期間）を選ぶために使う
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS ai_explanation_demand (
+    stock_code VARCHAR(10),
+    chart_period VARCHAR(20),
+    demand_date DATE,
+    request_count INTEGER DEFAULT 0,
+    PRIMARY KEY(stock_code, chart_period, demand_date)
+);
+CREATE INDEX IF NOT EXISTS idx_ai_demand_date ON ai_explanation_demand (demand_date);
+
+COMMIT;
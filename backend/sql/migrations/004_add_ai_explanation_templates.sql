@@ -0,0 +1,16 @@
+-- テクニカル状態別のAI解説テンプレートテーブルの追加
+-- AI_STATE_CACHE_ENABLED=true の場合に、同じ状態の銘柄で解説テンプレートを共有する
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS ai_explanation_templates (
+    state_key VARCHAR(100) PRIMARY KEY,
+    chart_period VARCHAR(20) NOT NULL,
+    technical_state JSONB,
+    template_text TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+    expires_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ai_template_expires ON ai_explanation_templates (expires_at);
+
+COMMIT;
@@ -0,0 +1,28 @@
+-- AI解説の生成ジョブテーブルの追加
+-- 利用枠の上限に達したリクエストをジョブとして受け付け、ワーカーが順次生成する
+-- 同じ（銘柄, 期間）の未完了ジョブは部分ユニークインデックスで1件にまとめる
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS ai_explanation_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    stock_code VARCHAR(10) NOT NULL,
+    chart_period VARCHAR(20) NOT NULL,
+    user_id UUID REFERENCES users(id) ON DELETE SET NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    priority INTEGER DEFAULT 0,
+    request_count INTEGER DEFAULT 1,
+    attempts INTEGER DEFAULT 0,
+    explanation_id UUID,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    available_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_ai_job_active
+    ON ai_explanation_jobs (stock_code, chart_period) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS idx_ai_job_queue
+    ON ai_explanation_jobs (priority DESC, request_count DESC, created_at) WHERE status = 'queued';
+
+COMMIT;
@@ -0,0 +1,23 @@
+-- AI解説を銘柄・期間ごとに1行にする
+-- 生成のたびに行が追加されていたため、最新の行のみ残して一意制約を追加する
+-- （一意制約のインデックスで参照するため、銘柄・期間のインデックスは削除）
+
+BEGIN;
+
+LOCK TABLE ai_explanations IN SHARE ROW EXCLUSIVE MODE;
+
+DELETE FROM ai_explanations AS explanation
+USING (
+    SELECT id, ROW_NUMBER() OVER (
+        PARTITION BY stock_code, chart_period
+        ORDER BY expires_at DESC, created_at DESC, id
+    ) AS row_number
+    FROM ai_explanations
+) AS ranked
+WHERE explanation.id = ranked.id AND ranked.row_number > 1;
+
+ALTER TABLE ai_explanations
+    ADD CONSTRAINT ai_explanations_stock_code_chart_period_key UNIQUE (stock_code, chart_period);
+DROP INDEX IF EXISTS idx_ai_stock_period;
+
+COMMIT;
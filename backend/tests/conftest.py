@@ -0,0 +1,9 @@
+"""
+バックエンドのユニットテスト共通設定
+"""
+
+import sys
+import os
+
+# モジュールパスを追加（backend/ 以外から pytest を実行しても app を読み込めるようにする）
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,168 @@
+"""
+テクニカル指標カーネルのテスト
+固定の株価データで pandas の計算と一致すること、複数銘柄の一括計算が銘柄ごとの計算と一致することを確認する
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from app.models.stock import StockPriceData
+from app.services import indicator_service as kernels
+from app.services.indicator_service import IndicatorService
+
+
+def make_prices(length: int, seed: int) -> dict:
+    """乱数のランダムウォークから作る固定のOHLCV"""
+    rng = np.random.default_rng(seed)
+    close = 1000.0 + np.cumsum(rng.normal(0.0, 10.0, length))
+    high = close + rng.uniform(0.0, 15.0, length)
+    low = close - rng.uniform(0.0, 15.0, length)
+    volume = rng.integers(10_000, 100_000, length).astype(np.float64)
+    return {"high": high, "low": low, "close": close, "volume": volume}
+
+
+def to_price_data(columns: dict) -> list:
+    return [
+        StockPriceData(time=f"2026-01-{index % 28 + 1:02d}", open=close, high=high, low=low, close=close, volume=int(volume))
+        for index, (high, low, close, volume) in enumerate(
+            zip(columns["high"], columns["low"], columns["close"], columns["volume"])
+        )
+    ]
+
+
+def assert_series_equal(actual: np.ndarray, expected) -> None:
+    np.testing.assert_allclose(actual, np.asarray(expected, dtype=np.float64), rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+PRICES = make_prices(300, seed=0)
+CLOSE = pd.Series(PRICES["close"])
+
+
+@pytest.mark.parametrize("window", [1, 5, 25, 75])
+def test_rolling_mean_matches_pandas(window):
+    assert_series_equal(kernels.rolling_mean(PRICES["close"], window), CLOSE.rolling(window).mean())
+
+
+@pytest.mark.parametrize("window", [5, 20])
+def test_rolling_std_matches_pandas(window):
+    assert_series_equal(kernels.rolling_std(PRICES["close"], window), CLOSE.rolling(window).std(ddof=0))
+
+
+@pytest.mark.parametrize("window", [1, 9, 26, 52])
+def test_rolling_extremes_match_pandas(window):
+    assert_series_equal(kernels.rolling_max(PRICES["high"], window), pd.Series(PRICES["high"]).rolling(window).max())
+    assert_series_equal(kernels.rolling_min(PRICES["low"], window), pd.Series(PRICES["low"]).rolling(window).min())
+
+
+@pytest.mark.parametrize("span", [9, 12, 26])
+def test_ema_matches_pandas(span):
+    assert_series_equal(kernels.ema(PRICES["close"], span=span), CLOSE.ewm(span=span, adjust=True).mean())
+
+
+def test_ema_ignores_leading_nan():
+    padded = np.concatenate([np.full(10, np.nan), PRICES["close"]])
+    result = kernels.ema(padded, span=12)
+    assert np.isnan(result[:10]).all()
+    assert_series_equal(result[10:], CLOSE.ewm(span=12, adjust=True).mean())
+
+
+def test_rsi_matches_pandas():
+    # 従来の pandas 実装と同じ定義（先頭の差分なしは0として扱う）
+    delta = CLOSE.diff()
+    average_gain = delta.where(delta > 0, 0).rolling(14).mean()
+    average_loss = (-delta.where(delta < 0, 0)).rolling(14).mean()
+    expected = 100.0 - 100.0 / (1.0 + average_gain / average_loss)
+    assert_series_equal(kernels.rsi(PRICES["close"], 14), expected)
+
+
+def test_macd_matches_pandas():
+    macd_line = CLOSE.ewm(span=12, adjust=True).mean() - CLOSE.ewm(span=26, adjust=True).mean()
+    signal_line = macd_line.ewm(span=9, adjust=True).mean()
+    result = kernels.macd(PRICES["close"])
+    assert_series_equal(result["macd_line"], macd_line)
+    assert_series_equal(result["macd_signal"], signal_line)
+    assert_series_equal(result["macd_histogram"], macd_line - signal_line)
+
+
+def test_bollinger_bands_match_pandas():
+    middle = CLOSE.rolling(20).mean()
+    deviation = 2.0 * CLOSE.rolling(20).std(ddof=0)
+    result = kernels.bollinger_bands(PRICES["close"])
+    assert_series_equal(result["bb_middle"], middle)
+    assert_series_equal(result["bb_upper"], middle + deviation)
+    assert_series_equal(result["bb_lower"], middle - deviation)
+
+
+def test_atr_matches_pandas():
+    high, low = pd.Series(PRICES["high"]), pd.Series(PRICES["low"])
+    previous_close = CLOSE.shift(1)
+    true_range = pd.concat(
+        [high - low, (high - previous_close).abs(), (low - previous_close).abs()], axis=1
+    ).max(axis=1)
+    expected = true_range.ewm(alpha=1.0 / 14, adjust=True, min_periods=14).mean()
+    assert_series_equal(kernels.atr(PRICES["high"], PRICES["low"], PRICES["close"], 14), expected)
+
+
+def test_stochastics_match_pandas():
+    lowest = pd.Series(PRICES["low"]).rolling(14).min()
+    highest = pd.Series(PRICES["high"]).rolling(14).max()
+    percent_k = (CLOSE - lowest) / (highest - lowest) * 100.0
+    percent_d = percent_k.rolling(3).mean()
+    result = kernels.stochastics(PRICES["high"], PRICES["low"], PRICES["close"])
+    assert_series_equal(result["stoch_k"], percent_k)
+    assert_series_equal(result["stoch_d"], percent_d)
+    assert_series_equal(result["stoch_slow_d"], percent_d.rolling(3).mean())
+
+
+def test_ichimoku_matches_pandas():
+    high, low = pd.Series(PRICES["high"]), pd.Series(PRICES["low"])
+    tenkan = (high.rolling(9).max() + low.rolling(9).min()) / 2.0
+    kijun = (high.rolling(26).max() + low.rolling(26).min()) / 2.0
+    senkou_b = (high.rolling(52).max() + low.rolling(52).min()) / 2.0
+    result = kernels.ichimoku(PRICES["high"], PRICES["low"], PRICES["close"])
+    assert_series_equal(result["ichimoku_tenkan"], tenkan)
+    assert_series_equal(result["ichimoku_kijun"], kijun)
+    assert_series_equal(result["ichimoku_senkou_a"], ((tenkan + kijun) / 2.0).shift(25))
+    assert_series_equal(result["ichimoku_senkou_b"], senkou_b.shift(25))
+    assert_series_equal(result["ichimoku_chikou"], CLOSE.shift(-25))
+
+
+def test_deviation_rate_matches_pandas():
+    average = CLOSE.rolling(25).mean()
+    assert_series_equal(kernels.deviation_rate(PRICES["close"], 25), (CLOSE - average) / average * 100.0)
+
+
+def test_short_and_empty_input_returns_nan_without_warnings():
+    with np.errstate(all="raise"):
+        assert np.isnan(kernels.rolling_mean(PRICES["close"][:10], 25)).all()
+        assert kernels.rolling_std(np.array([]), 20).shape == (0,)
+        assert np.isnan(kernels.rolling_std(np.full(30, np.nan), 20)).all()
+
+
+def test_batch_matches_single_ticker():
+    # データ長の異なる銘柄を右詰めでまとめても、銘柄ごとの計算と同じ値になる
+    columns_list = [make_prices(length, seed) for seed, length in enumerate([300, 180, 60])]
+    batch_series = IndicatorService.calculate_series(IndicatorService.stack_arrays(columns_list))
+
+    for row, columns in enumerate(columns_list):
+        single_series = IndicatorService.calculate_series(columns)
+        length = columns["close"].shape[-1]
+        for name, values in single_series.items():
+            assert_series_equal(batch_series[name][row, -length:], values)
+            assert np.isnan(batch_series[name][row, :-length]).all() or name == "ichimoku_chikou"
+
+
+def test_latest_batch_matches_latest():
+    columns_list = [make_prices(length, seed) for seed, length in enumerate([300, 180, 20])]
+    batch = IndicatorService.latest_batch(IndicatorService.calculate_series(IndicatorService.stack_arrays(columns_list)))
+    singles = [
+        IndicatorService.latest(IndicatorService.calculate_series(IndicatorService.to_arrays(to_price_data(columns))))
+        for columns in columns_list
+    ]
+    assert len(batch) == len(singles)
+    for batch_result, single_result in zip(batch, singles):
+        for name, value in single_result.model_dump().items():
+            if value is None:
+                assert getattr(batch_result, name) is None
+            else:
+                assert getattr(batch_result, name) == pytest.approx(value, rel=1e-9)
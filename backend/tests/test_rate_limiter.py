@@ -0,0 +1,178 @@
+"""
+レート制限のテスト
+時刻を差し替えて、予約・60秒経過後の枠の回復・時間枠の境界での判定を確認する
+"""
+
+from datetime import date
+import uuid
+import pytest
+from app.services.rate_limiter import RateLimiter
+
+
+class FakeClock:
+    """テスト用の時刻（秒）"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_limiter(clock, **overrides) -> RateLimiter:
+    limits = dict(daily_requests=100, minute_requests=5, minute_tokens=1000, user_daily_limit=3, workers=1)
+    limits.update(overrides)
+    return RateLimiter(clock=clock, **limits)
+
+
+def set_today(monkeypatch, limiter: RateLimiter, today: date):
+    monkeypatch.setattr(limiter, "_window_keys", lambda: (today, f"{today.isoformat()}_00:00"))
+
+
+def test_admits_up_to_minute_capacity(clock):
+    limiter = make_limiter(clock)
+    for _ in range(5):
+        assert limiter.try_acquire(None, 10) == (None, 0)
+        clock.now += 1
+    reason, _ = limiter.try_acquire(None, 10)
+    assert reason == "Rate limit exceeded, please try again later"
+
+
+def test_minute_capacity_recovers_60_seconds_after_each_reservation(clock):
+    limiter = make_limiter(clock)
+    start = clock.now
+    for offset in range(5):
+        clock.now = start + offset * 10
+        assert limiter.try_acquire(None, 10)[0] is None
+
+    # 最初の予約から60秒未満は枠が戻らない
+    clock.now = start + 59.9
+    assert limiter.try_acquire(None, 10)[0] is not None
+    # 60秒経過した予約の分だけ戻る
+    clock.now = start + 60
+    assert limiter.try_acquire(None, 10)[0] is None
+    assert limiter.try_acquire(None, 10)[0] is not None
+
+
+def test_no_rolling_minute_exceeds_capacity(clock):
+    # 分の切り替わりの直前・直後にまとめて要求しても、60秒間の許可数は上限以内
+    limiter = make_limiter(clock)
+    admitted = []
+    for step in range(240):
+        clock.now = 1000.0 + step * 0.5
+        if limiter.try_acquire(None, 1)[0] is None:
+            admitted.append(clock.now)
+    for index, admitted_at in enumerate(admitted):
+        in_window = [other for other in admitted[index:] if other < admitted_at + 60]
+        assert len(in_window) <= 5
+
+
+def test_rejects_when_token_estimate_exceeds_remaining(clock):
+    limiter = make_limiter(clock)
+    assert limiter.try_acquire(None, 900)[0] is None
+    reason, _ = limiter.try_acquire(None, 200)
+    assert reason == "Token rate limit exceeded"
+    assert limiter.try_acquire(None, 100)[0] is None
+
+
+def test_record_replaces_reserved_tokens_with_actual(clock):
+    limiter = make_limiter(clock)
+    limiter.try_acquire(None, 600)
+    limiter.record(None, reserved_tokens=600, actual_tokens=200)
+    assert limiter.minute_tokens.used == 200
+    assert limiter.try_acquire(None, 800)[0] is None
+
+    # 予約がウィンドウ外になった後の補正は枠に影響しない
+    clock.now += 60
+    limiter.record(None, reserved_tokens=800, actual_tokens=50)
+    assert limiter.minute_tokens.used == 0
+    assert len(limiter.drain()) == 2
+
+
+def test_check_does_not_reserve(clock):
+    limiter = make_limiter(clock)
+    user_id = uuid.uuid4()
+    for _ in range(10):
+        assert limiter.check(user_id, 10) == (None, 3)
+    assert limiter.minute_requests.used == 0
+
+
+def test_user_daily_limit_and_release(clock):
+    limiter = make_limiter(clock, minute_requests=100)
+    user_id = uuid.uuid4()
+    assert limiter.try_acquire(user_id, 10) == (None, 2)
+    assert limiter.try_acquire(user_id, 10) == (None, 1)
+    assert limiter.try_acquire(user_id, 10) == (None, 0)
+    assert limiter.try_acquire(user_id, 10)[0] == "Daily user limit exceeded"
+
+    limiter.release_user(user_id)
+    assert limiter.try_acquire_user(user_id) is None
+    assert limiter.try_acquire_user(user_id) == "Daily user limit exceeded"
+    # システム処理（user_id なし）はユーザー制限の対象外
+    assert limiter.try_acquire(None, 10)[0] is None
+
+
+def test_daily_quota_resets_at_date_boundary(clock, monkeypatch):
+    limiter = make_limiter(clock, daily_requests=2, minute_requests=100)
+    user_id = uuid.uuid4()
+    set_today(monkeypatch, limiter, date(2026, 10, 19))
+    assert limiter.try_acquire(user_id, 10)[0] is None
+    assert limiter.try_acquire(user_id, 10)[0] is None
+    assert limiter.try_acquire(user_id, 10)[0] == "Daily request limit exceeded"
+
+    set_today(monkeypatch, limiter, date(2026, 10, 20))
+    assert limiter.try_acquire(user_id, 10) == (None, 2)
+
+
+def test_capacity_is_split_across_workers(clock):
+    limiter = make_limiter(clock, daily_requests=100, minute_requests=10, minute_tokens=1000, workers=4)
+    assert limiter.daily_requests.capacity == 25
+    assert limiter.minute_requests.capacity == 2
+    assert limiter.minute_tokens.capacity == 250
+
+
+def test_seed_counts_current_minute_usage(clock):
+    limiter = make_limiter(clock)
+    limiter.seed(daily_requests=10, minute_requests=4, minute_tokens=300)
+    assert limiter.daily_requests.used == 10
+    assert limiter.try_acquire(None, 10)[0] is None
+    assert limiter.try_acquire(None, 10)[0] is not None
+    clock.now += 60
+    assert limiter.try_acquire(None, 10)[0] is None
+
+
+def test_seed_user_keeps_unflushed_reservations(clock):
+    limiter = make_limiter(clock, minute_requests=100)
+    user_id = uuid.uuid4()
+    limiter.try_acquire(user_id, 10)
+    limiter.record(user_id, 10, 10)
+    # データベースの回数（他ワーカーの書き込み分）に未書き込みの1回を加える
+    limiter.seed_user(user_id, 1)
+    assert limiter.check(user_id, 10) == (None, 1)
+
+    limiter.confirm_flushed(limiter.drain())
+    limiter.seed_user(user_id, 2)
+    assert limiter.check(user_id, 10) == (None, 1)
+
+
+def test_user_usage_refresh_interval(clock):
+    user_id = uuid.uuid4()
+
+    single = make_limiter(clock, workers=1, user_refresh_seconds=5)
+    assert single.needs_user_refresh(user_id)
+    single.seed_user(user_id, 0)
+    clock.now += 3600
+    assert not single.needs_user_refresh(user_id)
+
+    multiple = make_limiter(clock, workers=2, user_refresh_seconds=5)
+    loaded_at = clock.now
+    multiple.seed_user(user_id, 0)
+    clock.now = loaded_at + 4.9
+    assert not multiple.needs_user_refresh(user_id)
+    clock.now = loaded_at + 5
+    assert multiple.needs_user_refresh(user_id)
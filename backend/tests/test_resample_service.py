@@ -0,0 +1,123 @@
+"""
+チャートデータ変換のテスト
+週足・月足へのリサンプリングとダウンサンプリング（OHLC集約・LTTB）の出力の形、端点、OHLCの整合性を確認する
+"""
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from app.models.stock import StockPriceData, StockPriceResponse
+from app.services.resample_service import ResampleService
+
+
+def make_daily(days: int = 250, seed: int = 0) -> StockPriceResponse:
+    """営業日の日足（始値・終値が高値と安値の範囲に収まる固定データ）"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2026-01-05", periods=days)
+    close = 1000.0 + np.cumsum(rng.normal(0.0, 10.0, days))
+    open_ = close + rng.normal(0.0, 5.0, days)
+    high = np.maximum(open_, close) + rng.uniform(0.0, 10.0, days)
+    low = np.minimum(open_, close) - rng.uniform(0.0, 10.0, days)
+    volume = rng.integers(1_000, 10_000, days)
+    data = [
+        StockPriceData(
+            time=day.strftime("%Y-%m-%d"), open=round(o, 2), high=round(h, 2),
+            low=round(l, 2), close=round(c, 2), volume=int(v)
+        )
+        for day, o, h, l, c, v in zip(dates, open_, high, low, close, volume)
+    ]
+    return StockPriceResponse(stock_code="7203", period="1Y", data=data, last_updated=datetime(2026, 10, 19))
+
+
+def assert_ohlc_invariants(data: list):
+    for bar in data:
+        assert bar.low <= min(bar.open, bar.close)
+        assert bar.high >= max(bar.open, bar.close)
+
+
+DAILY = make_daily()
+
+
+@pytest.mark.parametrize("interval, frequency", [("1wk", "W-SUN"), ("1mo", "M")])
+def test_resample_matches_calendar_groups(interval, frequency):
+    result = ResampleService.resample(DAILY, interval)
+    frame = pd.DataFrame([bar.model_dump() for bar in DAILY.data])
+    groups = frame.groupby(pd.to_datetime(frame["time"]).dt.to_period(frequency), sort=True)
+
+    assert result.interval == interval
+    assert len(result.data) == groups.ngroups
+    for bar, (_, group) in zip(result.data, groups):
+        assert bar.time == group["time"].iloc[0]
+        assert bar.open == group["open"].iloc[0]
+        assert bar.close == group["close"].iloc[-1]
+        assert bar.high == group["high"].max()
+        assert bar.low == group["low"].min()
+        assert bar.volume == group["volume"].sum()
+    assert_ohlc_invariants(result.data)
+
+
+def test_weekly_bars_start_on_first_trading_day_of_week():
+    result = ResampleService.resample(DAILY, "1wk")
+    weeks = [pd.Timestamp(bar.time).isocalendar()[:2] for bar in result.data]
+    assert len(set(weeks)) == len(weeks)
+    assert result.data[0].time == DAILY.data[0].time
+    assert result.data[-1].close == DAILY.data[-1].close
+
+
+def test_resample_daily_and_empty_are_unchanged():
+    assert ResampleService.resample(DAILY, "1d") is DAILY
+    empty = DAILY.model_copy(update={"data": []})
+    assert ResampleService.resample(empty, "1wk") is empty
+    with pytest.raises(ValueError):
+        ResampleService.resample(DAILY, "1h")
+
+
+@pytest.mark.parametrize("threshold", [3, 10, 50, 249])
+def test_lttb_indices_shape_and_endpoints(threshold):
+    values = np.array([bar.close for bar in DAILY.data])
+    indices = ResampleService.lttb_indices(values, threshold)
+
+    assert indices.shape == (threshold,)
+    assert indices[0] == 0
+    assert indices[-1] == len(values) - 1
+    assert np.all(np.diff(indices) > 0)
+
+
+def test_lttb_keeps_all_points_when_threshold_is_not_smaller():
+    values = np.arange(10, dtype=np.float64)
+    np.testing.assert_array_equal(ResampleService.lttb_indices(values, 10), np.arange(10))
+    np.testing.assert_array_equal(ResampleService.lttb_indices(values, 2), np.arange(10))
+
+
+def test_lttb_keeps_spike():
+    values = np.zeros(100)
+    values[37] = 50.0
+    assert 37 in ResampleService.lttb_indices(values, 10)
+
+
+def test_downsample_lttb_selects_original_bars():
+    result = ResampleService.downsample(DAILY, 40, method="lttb")
+    assert len(result.data) == 40
+    assert result.data[0] == DAILY.data[0]
+    assert result.data[-1] == DAILY.data[-1]
+    assert all(bar in DAILY.data for bar in result.data)
+
+
+def test_downsample_ohlc_preserves_range_and_volume():
+    result = ResampleService.downsample(DAILY, 40, method="ohlc")
+    assert len(result.data) <= 40
+    assert result.data[0].time == DAILY.data[0].time
+    assert result.data[0].open == DAILY.data[0].open
+    assert result.data[-1].close == DAILY.data[-1].close
+    assert max(bar.high for bar in result.data) == max(bar.high for bar in DAILY.data)
+    assert min(bar.low for bar in result.data) == min(bar.low for bar in DAILY.data)
+    assert sum(bar.volume for bar in result.data) == sum(bar.volume for bar in DAILY.data)
+    assert_ohlc_invariants(result.data)
+
+
+def test_downsample_is_noop_within_limit():
+    assert ResampleService.downsample(DAILY, len(DAILY.data)) is DAILY
+    assert ResampleService.downsample(DAILY, 0) is DAILY
+    with pytest.raises(ValueError):
+        ResampleService.downsample(DAILY, 10, method="average")
@@ -0,0 +1,79 @@
+"""
+トークン数見積もりのテスト
+実トークン数の観測から比率とばらつきを学習し、予約量が実績に近づくことを確認する
+"""
+
+import math
+import pytest
+from app.services.token_estimator import TokenEstimator
+
+
+PROMPT = "あ" * 300  # 基準値 = 300 / 1.5 + 250 = 450
+
+
+def test_base_estimate_from_prompt_and_outputs():
+    estimator = TokenEstimator(500)
+    assert estimator.base_estimate(PROMPT) == 450
+    assert estimator.base_estimate(PROMPT, outputs=3) == 200 + 250 * 3
+
+
+def test_initial_reservation_uses_safety_margin():
+    estimator = TokenEstimator(500)
+    base, reserved = estimator.estimate(PROMPT)
+    assert base == 450
+    assert reserved == math.ceil(450 * (1.0 + 2.0 * TokenEstimator.INITIAL_DEVIATION))
+
+
+def test_ratio_converges_to_observed_ratio():
+    estimator = TokenEstimator(500)
+    for _ in range(100):
+        estimator.observe(450, 360)
+
+    assert estimator.ratio == pytest.approx(0.8, abs=1e-3)
+    assert estimator.deviation < 0.01
+    base, reserved = estimator.estimate(PROMPT)
+    # 実績が安定すると予約量は実トークン数に近づく（下回らない）
+    assert 360 <= reserved <= 370
+
+
+def test_deviation_grows_with_noisy_observations():
+    steady = TokenEstimator(500)
+    noisy = TokenEstimator(500)
+    for index in range(100):
+        steady.observe(450, 450)
+        noisy.observe(450, 300 if index % 2 else 600)
+
+    assert noisy.deviation > steady.deviation
+    assert noisy.estimate(PROMPT)[1] > steady.estimate(PROMPT)[1]
+
+
+def test_ratio_is_clamped():
+    estimator = TokenEstimator(500)
+    for _ in range(200):
+        estimator.observe(100, 10_000)
+    assert estimator.ratio <= TokenEstimator.MAX_RATIO
+
+    estimator.seed(estimated_tokens=1000, actual_tokens=1)
+    assert estimator.ratio == TokenEstimator.MIN_RATIO
+
+
+def test_invalid_observations_are_ignored():
+    estimator = TokenEstimator(500)
+    estimator.observe(0, 100)
+    estimator.observe(100, 0)
+    estimator.seed(0, 0)
+    assert estimator.ratio == 1.0
+    assert estimator.deviation == TokenEstimator.INITIAL_DEVIATION
+
+
+def test_seed_sets_ratio_from_history():
+    estimator = TokenEstimator(500)
+    estimator.seed(estimated_tokens=10_000, actual_tokens=7_500)
+    assert estimator.ratio == pytest.approx(0.75)
+
+
+def test_typical_follows_reservations_per_output():
+    estimator = TokenEstimator(1000)
+    for _ in range(200):
+        _, reserved = estimator.estimate(PROMPT, outputs=1)
+    assert estimator.typical() == pytest.approx(reserved, abs=1)